@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# druginfo/rsb_sections.py の extract_sections（一括見出し検出）と
+# druginfo/_legacy.py の extract_sections（見出しごとに再走査）の出力一致確認とマイクロベンチマーク
+#   python3 bench_extract_sections.py [--docs 200] [--repeat 3]
+
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from druginfo import _legacy
+from druginfo import rsb_sections as sections_mod
+
+BODY_LINES = [
+    "本剤の作用が増強するおそれがあるので、本剤を減量するなど考慮すること。",
+    "CYP3A4を阻害する薬剤（イトラコナゾール、クラリスロマイシン等）",
+    "通常、成人には1回10mgを1日1回経口投与する。",
+    "発疹、そう痒、肝機能障害があらわれることがある。",
+    "血中濃度が上昇するとの報告がある。",
+]
+
+def make_html(rng, n_body):
+    """RSB の info_html に似た合成データ（見出しの番号付け・空白・<br> の揺れを含む）"""
+    parts = ["<b>【薬効】合成薬効テキスト</b><br>薬効備考の本文<br>"]
+    for jp, _ in sections_mod.known_sections[2:]:
+        if rng.random() < 0.15:
+            continue
+        prefix = rng.choice(["", "1. ", "12. ", "　", " "])
+        parts.append(f"<br>{prefix}{jp}{rng.choice(['', '：', ':'])}<br>")
+        for _ in range(rng.randint(1, n_body)):
+            parts.append(f"<p>{rng.choice(BODY_LINES)}</p><br>")
+    return "".join(parts)
+
+def bench(func, docs, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for html in docs:
+            func(html)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser(description="extract_sections マイクロベンチマーク")
+    ap.add_argument("--docs", type=int, default=200, help="合成文書数")
+    ap.add_argument("--body", type=int, default=30, help="1セクションあたりの最大本文行数")
+    ap.add_argument("--repeat", type=int, default=3, help="計測回数（最良値を採用）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    docs = [make_html(rng, args.body) for _ in range(args.docs)]
+    size_mb = sum(len(d.encode("utf-8")) for d in docs) / 1e6
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        mismatched = sum(1 for d in docs
+                         if sections_mod.extract_sections(d) != _legacy.extract_sections(d))
+        t_new = bench(sections_mod.extract_sections, docs, args.repeat)
+        t_old = bench(_legacy.extract_sections, docs, args.repeat)
+
+    print(f"文書 {args.docs} 件 / {size_mb:.2f} MB / 出力不一致 {mismatched} 件")
+    print(f"legacy : {t_old / args.docs * 1000:8.3f} ms/doc")
+    print(f"new    : {t_new / args.docs * 1000:8.3f} ms/doc")
+    print(f"speedup: {t_old / t_new:.1f}x")
+
+if __name__ == "__main__":
+    main()
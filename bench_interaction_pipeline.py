@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# druginfo/extractor.py の抽出パイプライン（ジョブ claim → LLM 問い合わせ → DB 書き込み）を
+# fake_ollama.py のサーバーに対して通しで動かすスループットベンチマーク
+#   python3 bench_interaction_pipeline.py [--sections 200] [--workers 4] [--latency 0.3 --latency-dist lognormal] [--error-rate 0.1]
+# config.json の db に、専用スキーマ（--schema、既定 interaction_bench）を作って書き込む。本番の drug_interaction には触れない。
+# チャンク/秒、DB 書き込み件数/秒、パース失敗の内訳、サーバーが遊んでいた（処理中のリクエストが無い）時間を表示する。
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+
+import psycopg2
+
+import fake_ollama
+
+from druginfo import config as config_file
+from druginfo import extractor as interaction
+from druginfo.metrics import Metrics
+
+KANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+SUFFIXES = ["ナトリウム", "カリウム", "塩酸塩", "マイシン", "プラゾール", "スタチン", "ゾラム", "フェン"]
+EFFECTS = [
+    "本剤の血中濃度が上昇するおそれがある。",
+    "出血傾向が増強することがある。",
+    "QT延長を起こすおそれがある。",
+    "作用が減弱するおそれがある。",
+]
+
+def make_agent(rng):
+    return "".join(rng.choice(KANA) for _ in range(rng.randint(3, 6))) + rng.choice(SUFFIXES)
+
+def make_section(rng, n_rows):
+    """相互作用セクションに似た合成テキスト（薬剤名・臨床症状・機序の表）"""
+    lines = ["10.2 併用注意（併用に注意すること）", "薬剤名等\t臨床症状・措置方法\t機序・危険因子"]
+    for _ in range(n_rows):
+        lines.append(f"{make_agent(rng)}\t{rng.choice(EFFECTS)}\tCYP3A4を阻害するため。")
+    return "\n".join(lines)
+
+def make_rows(rng, n_sections, n_rows, dup_ratio):
+    """(id_druginformation, yj_code, content) の一覧。dup_ratio の割合で既出の本文を使い回す（後発品の同一文面を想定）"""
+    rows = []
+    for i in range(n_sections):
+        if rows and rng.random() < dup_ratio:
+            content = rng.choice(rows)[2]
+        else:
+            content = make_section(rng, rng.randint(max(1, n_rows // 2), n_rows))
+        rows.append((i + 1, f"{i + 1:012d}", content))
+    return rows
+
+def prepare_schema(db_conf, schema):
+    """ベンチマーク用スキーマを作り直す（db_conf は configure() で search_path をそのスキーマにしたもの）"""
+    conn = psycopg2.connect(**db_conf)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {schema}")
+    interaction.create_interaction_table(cursor)
+    interaction.create_job_table(cursor, drop=True)
+    conn.commit()
+    return conn, cursor
+
+def configure(config, args, url):
+    """config.json の設定をベンチマーク用に書き換えた druginfo.extractor の Settings を返す"""
+    db_conf = dict(config.get("db", {}), options=f"-c search_path={args.schema}")
+    return interaction.Settings(dict(
+        config,
+        db=db_conf,   # produce_tasks の別接続もベンチマーク用スキーマを使う
+        ollama_backends=[{"url": url, "concurrency": args.workers, "weight": 1}],
+        llm_queue_size=args.workers * 2,
+        ollama_stream=args.stream,
+        ollama_timeout=args.timeout,
+        throttle_policy="none",
+        llm_dedup=not args.no_dedup,
+        insert_batch_chunks=args.batch_chunks,
+        insert_flush_seconds=args.flush_seconds,
+    ))
+
+def report(result, server_stats, args):
+    elapsed = result["elapsed"]
+    failed_parse = result["parse"].get("failed", 0)
+    print(f"チャンク {result['chunks']} 件（LLM 問い合わせ {result['tasks']} 件）/ {elapsed:.2f} 秒"
+          f" → {result['chunks'] / elapsed if elapsed else 0:.2f} チャンク/秒")
+    db = result["db_seconds"]
+    print(f"DB: {result['written']} 件登録 / 失敗 {result['failed']} 件 / {result['flushes']} トランザクション"
+          f" / 書き込み {db:.2f} 秒（{result['written'] / db if db else 0:.0f} 件/秒、全体の {db / elapsed * 100 if elapsed else 0:.1f}%）")
+    detail = " / ".join(f"{k} {v}" for k, v in sorted(result["parse"].items()))
+    print(f"パース: {detail}（失敗 {failed_parse} 件）")
+    injected = " / ".join(f"{k} {v}" for k, v in sorted(server_stats["errors"].items())) or "なし"
+    print(f"サーバー: リクエスト {server_stats['requests']} 件 / 注入したエラー {injected}"
+          f" / 最大同時 {server_stats['max_in_flight']}（workers {args.workers}）")
+    gaps = server_stats["idle_gaps"]
+    idle = server_stats["idle_seconds"]
+    print(f"待機: {idle:.2f} 秒（全体の {idle / elapsed * 100 if elapsed else 0:.1f}%）/ {gaps} 回"
+          f" / 1回平均 {idle / gaps * 1000 if gaps else 0:.1f} ms")
+
+def main():
+    ap = argparse.ArgumentParser(description="相互作用抽出パイプラインのスループットベンチマーク（fake Ollama 使用）")
+    ap.add_argument("--sections", type=int, default=200, help="合成する相互作用セクション数")
+    ap.add_argument("--rows", type=int, default=20, help="1セクションあたりの最大行数")
+    ap.add_argument("--dup-ratio", type=float, default=0.3, help="既出の本文を使い回す割合")
+    ap.add_argument("--workers", type=int, default=4, help="同時リクエスト数")
+    ap.add_argument("--no-stream", dest="stream", action="store_false", help="ストリームを使わずに問い合わせる")
+    ap.add_argument("--no-dedup", action="store_true", help="同一文面をまとめない")
+    ap.add_argument("--timeout", type=float, default=30, help="Ollama 問い合わせのタイムアウト秒数")
+    ap.add_argument("--batch-chunks", type=int, help="insert_batch_chunks（既定は config.json の値）")
+    ap.add_argument("--flush-seconds", type=float, help="insert_flush_seconds（既定は config.json の値）")
+    ap.add_argument("--schema", default="interaction_bench", help="書き込み先のスキーマ（実行のたびに作り直す）")
+    ap.add_argument("--json", help="結果を JSON で書き出すファイル")
+    ap.add_argument("--verbose", action="store_true", help="druginfo.extractor の出力をそのまま表示")
+    ap.add_argument("--config", metavar="PATH", help="設定ファイル（db・ollama_model などを読む）")
+    fake_ollama.add_server_arguments(ap)
+    args = ap.parse_args()
+
+    config = config_file.load(args.config)
+    defaults = interaction.Settings(config)
+    args.batch_chunks = defaults.insert_batch_chunks if args.batch_chunks is None else args.batch_chunks
+    args.flush_seconds = defaults.insert_flush_seconds if args.flush_seconds is None else args.flush_seconds
+    rng = random.Random(args.seed or 0)
+    rows = make_rows(rng, args.sections, args.rows, args.dup_ratio)
+    server = fake_ollama.start_server(model=defaults.ollama_model, **fake_ollama.server_options(args))
+    cfg = configure(config, args, server.url)
+    conn, cursor = prepare_schema(cfg.db_conf, args.schema)
+    cache = interaction.ResponseCache(None, cfg.ollama_model, interaction.template_version(cfg.prompt_layout),
+                                      cfg.prompt_layout, enabled=False)
+
+    print(f"セクション {len(rows)} 件 / workers {args.workers} / latency {args.latency}s {args.latency_dist}"
+          f" / error {args.error_rate:.0%} / {'stream' if args.stream else 'non-stream'} → {server.url}")
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            result = interaction.run_extraction(cfg, Metrics("bench_interaction_pipeline"), conn, cursor, rows,
+                                                io.StringIO(), cache)
+    finally:
+        conn.close()
+        server.shutdown()
+    server_stats = server.stats()
+    report(result, server_stats, args)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "result": result, "server": server_stats}, f, ensure_ascii=False, indent=2)
+    # 注入していないのにパースに失敗したら異常
+    sys.exit(1 if result["parse"].get("failed") and not args.error_rate else 0)
+
+if __name__ == "__main__":
+    main()
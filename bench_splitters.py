@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# 添付文書の分割処理のベンチマーク。RSBase の添付文書は配布できないので、合成した文書で計測する。
+#   - druginfo/splitter.py    : make_offsets / choose_best_anchors / slice_sections（EUC-JP テキスト）
+#   - druginfo/rsb_sections.py: extract_sections（RSB の info_html）
+#   python3 bench_splitters.py [--docs 300] [--repeat 3] [--json result.json] [--compare 前回の.json]
+#   python3 bench_splitters.py --write-corpus ./synthetic_di   （合成テキストを EUC-JP の .txt で書き出すだけ）
+# 合成文書には ALIASES の表記ゆれ・番号や記号付きの見出し・効能／用法の併記見出し・CRLF 改行・本文中の見出し語を混ぜる。
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from druginfo import rsb_sections as sections_mod
+from druginfo import splitter
+
+# 文書の大きさ（1セクションあたりの本文行数の範囲）
+SIZES = {"small": (1, 4), "medium": (3, 15), "large": (10, 60)}
+
+HEADING_PREFIXES = ["", "", "1. ", "10.2 ", "２．", "＊", "※", "　", "  "]
+BODY_LINES = [
+    "本剤の作用が増強するおそれがあるので、本剤を減量するなど考慮すること。",
+    "CYP3A4を阻害する薬剤（イトラコナゾール、クラリスロマイシン等）",
+    "発疹、そう痒、肝機能障害があらわれることがある。",
+    "血中濃度が上昇するとの報告がある。",
+    "観察を十分に行い、異常が認められた場合には投与を中止するなど適切な処置を行うこと。",
+    "高齢者では一般に生理機能が低下しているので減量するなど注意すること。",
+    "［9.1.1、11.1.2参照］",
+    "詳細は相互作用の項を参照すること。",     # 本文中の見出し語（見出しとして拾われてはいけない）
+    "副作用発現頻度は承認時までの臨床試験の結果に基づく。",
+]
+DOSAGE_LINES = [
+    "通常、成人には1回10mgを1日1回経口投与する。",
+    "なお、年齢、症状により適宜増減する。",
+]
+COMBINED_HEADINGS = ["効能又は効果／用法及び用量", "【効能・効果】【用法・用量】", "効能・効果及び用法・用量"]
+
+def make_body(rng, size, lines=BODY_LINES):
+    lo, hi = SIZES[size]
+    return [rng.choice(lines) for _ in range(rng.randint(lo, hi))]
+
+def heading(rng, variant):
+    text = rng.choice(HEADING_PREFIXES) + variant
+    return f"【{variant}】" if rng.random() < 0.15 else text
+
+def make_package_insert(rng, size, crlf_ratio=0.5):
+    """splitter が読む添付文書テキストに似た合成データ（str。EUC-JP で表せる文字だけを使う）"""
+    lines = ["日本標準商品分類番号 872123", "", "合成薬錠10mg", "SYNTHETIC TABLETS", ""]
+    combined = rng.random() < 0.25
+    for key in splitter.ALIASES:
+        if key in ("efficacy", "dosage") and combined:
+            if key == "dosage":
+                continue
+            if rng.random() < 0.5:
+                # 「効能」見出しの後に併記見出しが来る形（slice_sections の bridge）
+                lines += [heading(rng, rng.choice(splitter.ALIASES["efficacy"]))] + make_body(rng, size)
+            lines += ["", rng.choice(COMBINED_HEADINGS)] + make_body(rng, size)
+            lines += make_body(rng, size, DOSAGE_LINES) + [""]
+            continue
+        if key not in ("efficacy", "dosage", "interactions") and rng.random() < 0.2:
+            continue
+        lines += ["", heading(rng, rng.choice(splitter.ALIASES[key]))]
+        lines += make_body(rng, size, DOSAGE_LINES if key == "dosage" else BODY_LINES)
+        if rng.random() < 0.1:
+            lines.append("\t表1\t投与量\t頻度")
+    newline = "\r\n" if rng.random() < crlf_ratio else "\n"
+    return newline.join(lines) + newline
+
+def make_rsb_html(rng, size):
+    """rsb_sections が読む RSB の info_html に似た合成データ（見出しの番号付け・空白・<br> の揺れを含む）"""
+    parts = ["<b>【薬効】合成薬効テキスト</b><br>薬効備考の本文<br>"]
+    for jp, _ in sections_mod.known_sections[2:]:
+        if jp != "相互作用" and rng.random() < 0.15:
+            continue
+        prefix = rng.choice(["", "1. ", "12. ", "　", " "])
+        parts.append(f"<br>{prefix}{jp}{rng.choice(['', '：', ':'])}<br>")
+        for line in make_body(rng, size):
+            parts.append(f"<p>{line}</p><br>")
+    return "".join(parts)
+
+def make_corpus(n_docs, sizes, seed, crlf_ratio):
+    """(EUC-JP バイト列の添付文書, info_html) の組を n_docs 件"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n_docs):
+        size = rng.choice(sizes)
+        text = make_package_insert(rng, size, crlf_ratio)
+        corpus.append((text.encode("euc_jp"), make_rsb_html(rng, size)))
+    return corpus
+
+def write_corpus(corpus, folder):
+    os.makedirs(folder, exist_ok=True)
+    for i, (data, _) in enumerate(corpus):
+        with open(os.path.join(folder, f"{9900000000000 + i:013d}.txt"), "wb") as f:
+            f.write(data)
+    print(f"{folder} に {len(corpus)} 件書き出しました（EUC-JP）")
+
+def run_stages(corpus):
+    """1回分の計測。{段階: [文書ごとの秒数]} と検出セクション数の合計を返す"""
+    times = {name: [] for name in ("decode", "make_offsets", "choose_best_anchors", "slice_sections", "extract_sections")}
+    n_sections = 0
+    clock = time.perf_counter
+    for data, html in corpus:
+        t0 = clock()
+        text = splitter.decode_text_euc(data)
+        t1 = clock()
+        lines, raw_lines, starts, text_len = splitter.make_offsets(text)
+        t2 = clock()
+        anchors, bucket = splitter.choose_best_anchors(lines)
+        t3 = clock()
+        sections = splitter.slice_sections(text, anchors, lines, raw_lines, starts, text_len, bucket_by_line=bucket)
+        t4 = clock()
+        sections_mod.extract_sections(html)
+        t5 = clock()
+        for name, elapsed in zip(times, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            times[name].append(elapsed)
+        n_sections += len(sections)
+    return times, n_sections
+
+def summarize(times, mb):
+    result = {}
+    for name, values in times.items():
+        ordered = sorted(values)
+        total = sum(values)
+        size = mb["html"] if name == "extract_sections" else mb["text"]
+        result[name] = {
+            "total_s": total,
+            "ms_per_doc": total / len(values) * 1000,
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+            "ms_per_mb": total / size * 1000 if size else 0.0,
+        }
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_table(stages, previous=None):
+    print(f"{'段階':22} {'ms/doc':>9} {'p50':>8} {'p95':>8} {'max':>8} {'ms/MB':>10}" + ("   前回比" if previous else ""))
+    for name, s in stages.items():
+        line = (f"{name:24} {s['ms_per_doc']:9.3f} {s['p50_ms']:8.3f} {s['p95_ms']:8.3f} {s['max_ms']:8.3f}"
+                f" {s['ms_per_mb']:10.1f}")
+        old = (previous or {}).get(name)
+        if old and s["ms_per_doc"]:
+            line += f"   {old['ms_per_doc'] / s['ms_per_doc']:5.2f}x"
+        print(line)
+
+def main():
+    ap = argparse.ArgumentParser(description="添付文書分割処理のベンチマーク（合成コーパス）")
+    ap.add_argument("--docs", type=int, default=300, help="合成文書数")
+    ap.add_argument("--sizes", default="small,medium,large", help=f"文書の大きさ（カンマ区切り: {', '.join(SIZES)}）")
+    ap.add_argument("--crlf-ratio", type=float, default=0.5, help="CRLF 改行にする文書の割合")
+    ap.add_argument("--repeat", type=int, default=3, help="計測回数（合計時間が最小の回を採用）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="結果を書き出す JSON ファイル")
+    ap.add_argument("--compare", help="比較する前回の JSON ファイル")
+    ap.add_argument("--write-corpus", metavar="DIR", help="合成テキストを EUC-JP の .txt で書き出して終了")
+    args = ap.parse_args()
+
+    sizes = [s for s in args.sizes.split(",") if s]
+    unknown = set(sizes) - set(SIZES)
+    if unknown:
+        sys.exit(f"不明な大きさ: {', '.join(sorted(unknown))}")
+    corpus = make_corpus(args.docs, sizes, args.seed, args.crlf_ratio)
+    if args.write_corpus:
+        write_corpus(corpus, args.write_corpus)
+        return
+
+    mb = {"text": sum(len(d) for d, _ in corpus) / 1e6, "html": sum(len(h.encode("utf-8")) for _, h in corpus) / 1e6}
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(max(1, args.repeat)):
+            times, n_sections = run_stages(corpus)
+            total = sum(sum(v) for v in times.values())
+            if best is None or total < best[0]:
+                best = (total, times, n_sections)
+    _, times, n_sections = best
+    stages = summarize(times, mb)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)["stages"]
+    print(f"文書 {args.docs} 件（{', '.join(sizes)}）/ テキスト {mb['text']:.2f} MB（EUC-JP）/ HTML {mb['html']:.2f} MB"
+          f" / 検出セクション 平均 {n_sections / args.docs:.1f}")
+    print_table(stages, previous)
+
+    if args.json:
+        result = {
+            "meta": {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                     "python": platform.python_version(), "platform": platform.platform(),
+                     "splitter_version": splitter.splitter_version(), "args": vars(args)},
+            "corpus": {"docs": args.docs, "text_mb": mb["text"], "html_mb": mb["html"],
+                       "sections_per_doc": n_sections / args.docs},
+            "stages": stages,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"{args.json} に保存しました")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# druginfo/splitter.py の calc_line_score（一括マッチャ版）が
+# druginfo/_legacy.py の calc_line_score（ALIASES 総当たり版）と全行で同じスコアを返し、同じ見出し行を選ぶかを確認する回帰チェック
+#   python3 check_heading_scores.py [--docs 300] [--seed 0]   （bench_splitters.py の合成文書で確認）
+#   python3 check_heading_scores.py 添付文書フォルダ ...       （手元の添付文書テキストで確認）
+# スコアか選ばれた見出し行に不一致があれば終了コード 1
+
+import argparse
+import os
+import sys
+import time
+
+import bench_splitters
+from druginfo import _legacy, splitter
+
+def iter_paths(targets):
+    for target in targets:
+        if os.path.isdir(target):
+            for fn in sorted(os.listdir(target)):
+                if fn.endswith(".txt"):
+                    yield os.path.join(target, fn)
+        else:
+            yield target
+
+def iter_documents(args):
+    """(表示名, 行のリスト) を返す。paths が無ければ合成文書を使う"""
+    if args.paths:
+        for path in iter_paths(args.paths):
+            yield os.path.basename(path), splitter.make_offsets(splitter.read_text_euc(path))[0]
+        return
+    corpus = bench_splitters.make_corpus(args.docs, list(bench_splitters.SIZES), args.seed, crlf_ratio=0.5)
+    for i, (data, _) in enumerate(corpus):
+        yield f"synthetic#{i}", splitter.make_offsets(splitter.decode_text_euc(data))[0]
+
+def main():
+    ap = argparse.ArgumentParser(description="見出しスコアの新旧比較")
+    ap.add_argument("paths", nargs="*", help="テキストファイルまたはフォルダ（省略時は合成文書）")
+    ap.add_argument("--docs", type=int, default=300, help="合成文書数")
+    ap.add_argument("--seed", type=int, default=0, help="合成文書の乱数シード")
+    ap.add_argument("--max-report", type=int, default=20, help="表示する不一致の最大件数")
+    args = ap.parse_args()
+
+    n_files = n_lines = n_diff = n_anchor_diff = 0
+    t_old = t_new = 0.0
+    for name, lines in iter_documents(args):
+        n_files += 1
+        n_lines += len(lines)
+
+        started = time.perf_counter()
+        old = [_legacy.calc_line_score(ln, i, lines) for i, ln in enumerate(lines)]
+        t_old += time.perf_counter() - started
+        started = time.perf_counter()
+        new = [splitter.calc_line_score(ln, i, lines) for i, ln in enumerate(lines)]
+        t_new += time.perf_counter() - started
+
+        for i, (a, b) in enumerate(zip(old, new)):
+            # 値だけでなくキー順（＝ログ出力順）も比較する
+            if list(a.items()) != list(b.items()):
+                n_diff += 1
+                if n_diff <= args.max_report:
+                    print(f"[DIFF] {name}:{i} {lines[i]!r}\n  legacy={a}\n  new   ={b}")
+
+        # 採用される見出し行（セクションごとのアンカー）も比べる
+        old_anchors, _ = splitter.choose_best_anchors(lines, line_score=_legacy.calc_line_score)
+        new_anchors, _ = splitter.choose_best_anchors(lines)
+        if old_anchors != new_anchors:
+            n_anchor_diff += 1
+            if n_anchor_diff <= args.max_report:
+                keys = sorted(set(old_anchors) | set(new_anchors))
+                detail = ", ".join(f"{k}: {old_anchors.get(k)}→{new_anchors.get(k)}"
+                                   for k in keys if old_anchors.get(k) != new_anchors.get(k))
+                print(f"[HEADING] {name} {detail}")
+
+    print(f"ファイル {n_files} 件 / {n_lines} 行 / スコア不一致 {n_diff} 行 / 見出し不一致 {n_anchor_diff} 件")
+    if n_lines:
+        print(f"legacy : {t_old:.3f} 秒  new : {t_new:.3f} 秒  ({t_old / t_new if t_new else 0:.1f}x)")
+    sys.exit(1 if n_diff or n_anchor_diff or not n_files else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""添付文書の読み込み・セクション分割・LLM による相互作用抽出
+
+    loader       : RSBase の drug_RSB.dat → drug_RSB
+    rsb_sections : drug_RSB の info_html → modified_info
+    splitter     : 添付文書テキスト → drug_filedata
+    extractor    : drug_filedata の相互作用セクション → drug_interaction
+
+コマンドラインは python -m druginfo（druginfo.cli）。
+各モジュールは import 時に設定を読まない。設定の読み込み・DB 接続・確認は main(args) で行う。
+"""
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# splitter / rsb_sections の高速化前の実装。check_heading_scores.py・bench_extract_sections.py で
+# 新旧の出力一致とベンチマークを確かめるためだけに残している（実行時には使わない）
+
+import re
+
+from .rsb_sections import clean_text, extract_efficacy, known_sections, strip_html_tags
+from .splitter import ALIASES, LEAD_NOISE
+
+def calc_line_score(line: str, idx: int, lines: list) -> dict:
+    """旧実装（全キー×全表記を毎行 in 判定）。splitter.calc_line_score との一致確認用"""
+    raw = line.rstrip("\r\n")
+    s = LEAD_NOISE.sub("", raw).strip()
+    if not s:
+        return {}
+    scores = {}
+    # 基本的な特徴量
+    begins = (len(raw) - len(raw.lstrip()))  # 行頭空白
+    length = len(s)
+    has_period = "。" in s
+
+    for key, variants in ALIASES.items():
+        local_score = 0.0
+        hit_variant = None
+        for v in variants:
+            if s == v:
+                local_score = max(local_score, 8.0)  # 完全一致 強い
+                hit_variant = v
+            elif v in s:
+                local_score = max(local_score, 5.0)  # 含む
+                if not hit_variant:
+                    hit_variant = v
+
+        if local_score == 0.0:
+            continue
+
+        # 追加ボーナス/減点
+        if begins <= 4:
+            local_score += 2.0
+        if length <= 20:
+            local_score += 1.5
+        elif length <= 35:
+            local_score += 0.8
+        if not has_period:
+            local_score += 0.5
+
+        # 前後が空行
+        prev_empty = (idx-1 >= 0 and lines[idx-1].strip() == "")
+        next_empty = (idx+1 < len(lines) and lines[idx+1].strip() == "")
+        if prev_empty or next_empty:
+            local_score += 0.5
+
+        # 括弧/【】で囲われている
+        if raw.strip().startswith(("【","[")) or raw.strip().endswith(("】","]")):
+            local_score += 0.5
+
+        # 合体見出しの特別扱い（主要文献・文献請求先）
+        if hit_variant and ("主要文献" in hit_variant and "文献請求先" in hit_variant):
+            if key == "main_references":
+                local_score += 0.5
+            if key == "contact_info":
+                local_score += 0.5
+
+        scores[key] = local_score
+
+    return scores
+
+def extract_sections(html):
+    """旧実装（見出しごとに正規表現を組み直して再走査）。rsb_sections.extract_sections との一致確認・ベンチマーク用"""
+    html = html.replace("<br>", "\n")
+    raw = html
+    text = strip_html_tags(html)
+    result = {}
+
+    extract_efficacy(raw, result)
+
+    # その他のセクション
+    for j, (jp_section, en_col) in enumerate(known_sections):
+        if jp_section in ["薬効、効果・効能、適応症", "薬効備考"]:
+            continue
+        pattern = r"(\n|^)\s*([0-9]{1,2}\.\s*)?" + re.escape(jp_section) + r"[：:\s]*"
+        matches = list(re.finditer(pattern, text, re.IGNORECASE))
+        if matches:
+            start = matches[0].start()
+            end = len(text)
+            for next_j in range(j + 1, len(known_sections)):
+                next_pattern = r"(\n|^)\s*([0-9]{1,2}\.\s*)?" + re.escape(known_sections[next_j][0]) + r"[：:\s]*"
+                next_match = re.search(next_pattern, text[start+1:], re.IGNORECASE)
+                if next_match:
+                    next_pos = start + 1 + next_match.start()
+                    if next_pos < end:
+                        end = next_pos
+            content = text[start:end]
+            content = re.sub(re.escape(jp_section), "", content, flags=re.IGNORECASE)
+            result[en_col] = clean_text(content)
+    return result
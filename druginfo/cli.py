@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# python -m druginfo のコマンドライン。各処理のモジュールは import しても設定を読まず、
+# psycopg2・requests・tqdm も実行するときに読み込む（--help や引数解析だけなら不要）。
+#   python -m druginfo [--config config.json] load|rsb-sections|split|extract [オプション]
+#   python -m druginfo pipeline --yes        （load → split → extract を確認なしで続けて実行。cron 用）
+
+import argparse
+import importlib
+import sys
+
+from . import config
+
+# サブコマンド: (モジュール名, 説明)
+STEPS = {
+    "load": ("loader", "RSBase の drug_RSB.dat を drug_RSB テーブルに読み込む"),
+    "rsb-sections": ("rsb_sections", "drug_RSB の info_html をセクション分割して modified_info に保存する"),
+    "split": ("splitter", "添付文書テキストをセクション分割して drug_filedata に登録する"),
+    "extract": ("extractor", "相互作用セクションから LLM で併用薬を抽出して drug_interaction に登録する"),
+}
+PIPELINE_STEPS = "load,split,extract"
+
+def confirm(question, assume_yes=False, default="n"):
+    """y / yes なら True。assume_yes（--yes）なら聞かずに True、空入力や入力なし（EOF）は default"""
+    if assume_yes:
+        return True
+    try:
+        answer = input(question).strip().lower()
+    except EOFError:
+        print()
+        answer = ""
+    return (answer or default) in ("y", "yes")
+
+def step_module(name):
+    return importlib.import_module(f".{STEPS[name][0]}", __package__)
+
+CONFIG_HELP = f"設定ファイル（既定は環境変数 {config.CONFIG_ENV}、なければ {config.DEFAULT_PATH}）"
+
+def build_parser():
+    ap = argparse.ArgumentParser(prog="python -m druginfo", description="添付文書から相互作用を抽出する処理のコマンドライン")
+    ap.add_argument("--config", metavar="PATH", help=CONFIG_HELP)
+    # サブコマンドの後ろにも書けるようにする（python3 12InteractionLLM.py --config ... のため）
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", metavar="PATH", default=argparse.SUPPRESS, help=CONFIG_HELP)
+    sub = ap.add_subparsers(dest="command", metavar="COMMAND")
+    sub.required = True
+    for name, (_, description) in STEPS.items():
+        p = sub.add_parser(name, parents=[common], help=description, description=description)
+        step_module(name).add_arguments(p)
+
+    p = sub.add_parser("pipeline", parents=[common], help="load → split → extract を続けて実行する",
+                       description="各処理を順に実行し、失敗した処理があればそこで止める（終了コード 1）")
+    p.add_argument("--steps", default=PIPELINE_STEPS,
+                   help=f"実行する処理（カンマ区切り: {', '.join(STEPS)}。既定 {PIPELINE_STEPS}）")
+    p.add_argument("--yes", "-y", action="store_true", help="確認せずに実行する（cron などの無人実行用）")
+    p.add_argument("--mode", choices=("copy", "delta", "row"), help="load の読み込みモード")
+    p.add_argument("--workers", type=int, help="split のプロセス数")
+    p.add_argument("--retry-failed", action="store_true", help="extract の前に failed のジョブを pending に戻す")
+    p.add_argument("--no-cache", action="store_true", help="extract で LLM 応答キャッシュを使わない")
+    return ap
+
+def pipeline_argv(step, args):
+    """pipeline のオプションから各処理に渡す引数を作る"""
+    argv = [step] + (["--yes"] if args.yes else []) + (["--config", args.config] if args.config else [])
+    if step == "load" and args.mode:
+        argv += ["--mode", args.mode]
+    if step == "split" and args.workers is not None:
+        argv += ["--workers", str(args.workers)]
+    if step == "extract":
+        argv += ["--retry-failed"] if args.retry_failed else []
+        argv += ["--no-cache"] if args.no_cache else []
+    return argv
+
+def run_pipeline(ap, args):
+    steps = [s.strip() for s in args.steps.split(",") if s.strip()]
+    unknown = [s for s in steps if s not in STEPS]
+    if unknown:
+        ap.error(f"不明な処理: {', '.join(unknown)}")
+    for step in steps:
+        print(f"===== {step} =====")
+        code = main(pipeline_argv(step, args))
+        if code:
+            print(f"{step} が終了コード {code} で終わったので中断しました。")
+            return code
+    return 0
+
+def main(argv=None):
+    ap = build_parser()
+    args = ap.parse_args(sys.argv[1:] if argv is None else list(argv))
+    if args.command == "pipeline":
+        return run_pipeline(ap, args)
+    return step_module(args.command).main(args) or 0
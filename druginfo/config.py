@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# config.json の読み込み。各処理の main(args) が load(args.config) で読み、設定を関数・クラスに渡す。
+# 読み込むファイルは引数で指定したもの → 環境変数 DRUGINFO_CONFIG → カレントフォルダの config.json の順。
+# ファイルが無くても空の設定になり、DB に接続するときに db.connect() がエラーにする。
+
+import json
+import os
+
+CONFIG_ENV = "DRUGINFO_CONFIG"
+DEFAULT_PATH = "config.json"
+
+def config_path(path=None):
+    return path or os.environ.get(CONFIG_ENV) or DEFAULT_PATH
+
+def load(path=None):
+    """設定の dict"""
+    try:
+        with open(config_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+# PostgreSQL まわりの共通処理。psycopg2 は実際に接続するときに読み込む（import だけなら不要）。
+
+def connect(db_conf):
+    """config.json の "db" で接続する"""
+    import psycopg2
+    if not db_conf:
+        raise SystemExit("設定ファイルに \"db\" の設定がありません。")
+    return psycopg2.connect(**db_conf)
+
+def execute_values(cur, sql, argslist, template=None, page_size=100, fetch=False):
+    """psycopg2.extras.execute_values と同じ"""
+    from psycopg2.extras import execute_values as _execute_values
+    return _execute_values(cur, sql, argslist, template=template, page_size=page_size, fetch=fetch)
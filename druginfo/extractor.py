@@ -0,0 +1,1944 @@
+# drug_filedata の相互作用セクションから Ollama で併用薬を抽出し、drug_interaction に登録する（python -m druginfo extract）
+# requests・psycopg2・tqdm は使うときに読み込む（プロンプト生成やチャンク分割だけなら不要）
+
+import copy
+import json
+import re, ast
+import io
+import time
+import hashlib
+import functools
+import unicodedata
+import sqlite3
+import os
+import socket
+import subprocess
+import queue
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+
+from . import config as config_file
+from .cli import confirm
+from .db import connect, execute_values
+from .metrics import Metrics
+
+# このプロセスを識別する名前（drug_interaction_job.worker）
+worker_name = f"{socket.gethostname()}:{os.getpid()}"
+
+class Settings:
+    """
+    config.json の抽出処理の設定。main() で読み、問い合わせ・チャンク分割・パイプラインの各関数に渡す。
+    format_unsupported だけは実行中に変わる（format を受け付けないサーバーだと分かったら立てる）。
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.db_conf = config.get("db", {})
+        self.ollama_url = config.get("ollama_url", "http://localhost:11434/api/generate")
+        self.ollama_model = config.get("ollama_model", "gemma3:12b")
+        self.ollama_timeout = config.get("ollama_timeout", 60)
+        # 応答を NDJSON ストリームで受け取り、配列の閉じ ] が来た時点で生成を打ち切る
+        self.ollama_stream = bool(config.get("ollama_stream", True))
+        # 応答形式の指定（schema: INTERACTION_SCHEMA を format で渡す / json: format="json" / none: 指定しない）
+        self.ollama_format = config.get("ollama_format", "schema")
+        self.chunk_length = config.get("chunk_length", 3000)
+        self.chunk_overlap = config.get("chunk_overlap", 500)
+        # チャンクの切り方（tokens: 推定トークン数でモデルのコンテキストに収まるよう行単位で詰める / chars: 従来の chunk_length 文字単位）
+        self.chunk_mode = config.get("chunk_mode", "tokens")
+        self.context_tokens = config.get("context_tokens", 8192)              # Ollama の num_ctx
+        self.output_tokens_reserve = config.get("output_tokens_reserve", 2048)  # 応答用に空けておくトークン数
+        self.chunk_overlap_tokens = config.get("chunk_overlap_tokens", 100)    # 前チャンク末尾から重ねる行の上限
+        self.tokens_per_cjk_char = config.get("tokens_per_cjk_char", 1.0)      # 日本語1文字あたりの推定トークン数
+        self.pause_second = config.get("gpu_cooling_wait", 30) #GPU加熱対策。throttle_policy が fixed のとき、10件処理するごとにこの秒数処理を中断する
+        # GPU加熱対策の休止方法（fixed / budget / thermal / none。リストで複数指定可）。gpu_cooling_wait が 0 なら既定で休止しない
+        self.throttle_policy = config.get("throttle_policy", "none" if self.pause_second == 0 else "budget")
+        self.throttle_window_seconds = config.get("throttle_window_seconds", 300)
+        self.throttle_busy_ratio = config.get("throttle_busy_ratio", 0.8)
+        self.throttle_max_tokens = config.get("throttle_max_tokens", 0)
+        self.thermal_probe_fake = config.get("thermal_probe_fake")
+        self.thermal_probe_file = config.get("thermal_probe_file")
+        self.thermal_probe_command = config.get(
+            "thermal_probe_command", "nvidia-smi --query-gpu=temperature.gpu --format=csv,noheader,nounits")
+        self.thermal_limit = config.get("thermal_limit", 80)
+        self.thermal_resume = config.get("thermal_resume", 70)
+        self.thermal_poll_seconds = config.get("thermal_poll_seconds", 5)
+        # 同時に Ollama へ投げるリクエスト数（Ollama 側の OLLAMA_NUM_PARALLEL に合わせる）。1 なら従来どおり逐次
+        ollama_parallel = max(1, int(config.get("ollama_parallel", 1)))
+        # 複数の Ollama サーバーに振り分ける場合: [{"url": ..., "concurrency": 同時リクエスト数, "weight": 重み}, ...]
+        # 省略時は ollama_url 1台に ollama_parallel 本
+        self.ollama_backends = config.get("ollama_backends") or [{"url": self.ollama_url, "concurrency": ollama_parallel, "weight": 1}]
+        self.backend_retry_seconds = config.get("backend_retry_seconds", 30)  # 接続できなかったサーバーを再び使うまでの秒数
+        self.n_llm_workers = sum(max(1, int(b.get("concurrency", 1))) for b in self.ollama_backends)
+        # プロンプト生成→LLM→DB書き込みの間に置くキューの長さ
+        self.llm_queue_size = max(1, int(config.get("llm_queue_size", self.n_llm_workers * 2)))
+        # drug_interaction への書き込みを何チャンク分／何秒分ためて1トランザクションにするか
+        self.insert_batch_chunks = int(config.get("insert_batch_chunks", 20))
+        self.insert_flush_seconds = float(config.get("insert_flush_seconds", 5))
+        # チャンクをまたいだ重複行の統合（inline: 薬剤の全チャンクが終わるたび / bulk: 実行の最後に一括 / off）
+        self.merge_mode = config.get("merge_mode", "inline")
+        # 再起動時に、この秒数以上 running のままのジョブ（落ちたプロセスの取りこぼし）を pending に戻す
+        self.job_stale_seconds = config.get("job_stale_seconds", 3600)
+        # LLM 応答キャッシュ（model, プロンプト版, レイアウト, チャンク本文ハッシュ をキーにしたローカル SQLite）
+        self.llm_cache_file = config.get("llm_cache_file", "llm_response_cache.sqlite3")
+        self.llm_cache_enabled = bool(config.get("llm_cache", True))
+        # 同一文面の相互作用セクションをまとめて LLM を1回だけ呼ぶ
+        self.llm_dedup = bool(config.get("llm_dedup", True))
+        # プロンプトの組み立て方（prefix: 固定の指示文を先頭、チャンク番号と本文を末尾 / system: 指示文を system に入れる / legacy: 従来の文面）
+        self.prompt_layout = config.get("prompt_layout", "prefix")
+        # 問い合わせ後もモデルを GPU に載せておく時間（Ollama の keep_alive。空なら送らない）
+        self.ollama_keep_alive = config.get("ollama_keep_alive", "30m")
+        # format を受け付けないサーバーだと分かったら、以降は指定せずに問い合わせる
+        self.format_unsupported = threading.Event()
+        self.format_lock = threading.Lock()
+
+    def use_format(self):
+        """Ollama に format を渡して問い合わせるか"""
+        return self.ollama_format != "none" and not self.format_unsupported.is_set()
+
+    def token_budget(self):
+        """1チャンクに入れてよい本文の推定トークン数"""
+        return chunk_token_budget(self.context_tokens, self.output_tokens_reserve, self.prompt_layout, self.tokens_per_cjk_char)
+
+# build_prompt() の文面を変えたら上げる（古いキャッシュを使わないため）。legacy レイアウトは 1 のまま
+PROMPT_TEMPLATE_VERSION = 2
+
+# Ollama の応答から拾う計測値
+OLLAMA_STATS_KEYS = ("eval_count", "eval_duration", "prompt_eval_count", "prompt_eval_duration", "total_duration", "load_duration")
+
+# Ollama呼び出し関数
+INTERACTION_FIELDS = ("agent", "category", "interaction_type", "description")
+
+# Ollama の format に渡す JSON スキーマ（build_prompt() で指示している形式と同じ）
+INTERACTION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in INTERACTION_FIELDS},
+        "required": list(INTERACTION_FIELDS),
+    },
+}
+
+def ollama_payload(cfg, prompt, stream, layout=None):
+    payload = {"model": cfg.ollama_model, "prompt": prompt, "stream": stream}
+    if (layout or cfg.prompt_layout) == "system":
+        payload["system"] = PROMPT_INSTRUCTIONS
+    if cfg.ollama_keep_alive:
+        payload["keep_alive"] = cfg.ollama_keep_alive
+    if cfg.chunk_mode != "chars":
+        # チャンクの大きさを決めたコンテキスト長で Ollama にも読ませる（既定の num_ctx だと後ろが切り捨てられる）
+        payload["options"] = {"num_ctx": cfg.context_tokens}
+    if cfg.use_format():
+        payload["format"] = INTERACTION_SCHEMA if cfg.ollama_format == "schema" else "json"
+    return payload
+
+def disable_format(cfg, error):
+    """format 付きの問い合わせがエラーになったとき、以降は format なしで問い合わせるよう切り替える"""
+    with cfg.format_lock:
+        if not cfg.format_unsupported.is_set():
+            cfg.format_unsupported.set()
+            print(f"Ollama が format 指定を受け付けないため、以降は format なしで問い合わせます: {error}")
+
+def call_ollama(cfg, prompt, layout=None, stream=None, url=None):
+    """
+    応答本文、Ollama の計測値（eval_count など）の dict、ストリームで読み切れた配列（無ければ None）を返す。
+    ollama_stream が無効なら従来どおり生成完了まで待つ。
+    失敗したときは stats["error"] に内容を、接続エラー・タイムアウトなら stats["network_error"] に True を入れる。
+    """
+    if cfg.ollama_stream if stream is None else stream:
+        return call_ollama_stream(cfg, prompt, layout, url)
+    import requests
+    try:
+        start = time.time()
+        payload = ollama_payload(cfg, prompt, False, layout)
+        response = requests.post(
+            url or cfg.ollama_url,
+            json=payload,
+            timeout=cfg.ollama_timeout
+        )
+        data = response.json()
+        # format を受け付けないサーバーは 400 を返す（500 などは一時的なエラーとして扱い、format はそのまま）
+        if "error" in data and "format" in payload and response.status_code == 400:
+            disable_format(cfg, data["error"])
+            return call_ollama(cfg, prompt, layout, stream, url)
+        raw = data.get("response", "")
+        stats = {k: data[k] for k in OLLAMA_STATS_KEYS if k in data}
+        if "error" in data:
+            raw = str(data["error"])
+            stats["error"] = raw
+        stats["elapsed"] = time.time() - start
+        if data.get("eval_count") and data.get("eval_duration"):
+            stats["tokens_per_sec"] = data["eval_count"] / (data["eval_duration"] / 1e9)
+
+        return raw, stats, None
+    except Exception as e:
+        return str(e), {"error": str(e), "network_error": isinstance(e, requests.exceptions.RequestException)}, None
+
+class JsonArrayScanner:
+    """
+    少しずつ届く応答テキストから JSON 配列を読み、閉じた {...} を1件ずつパースする。
+    配列の開始は「[ の直後（空白を除く）が { か ]」の位置とみなし、前置きの文章やコードフェンスは読み飛ばす。
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.in_array = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.obj_start = None
+        self.items = []
+        self.errors = 0
+        self.closed = False
+
+    def feed(self, text):
+        """text を追加し、新たにパースできた要素のリストを返す"""
+        self.buf += text
+        new_items = []
+        while self.pos < len(self.buf) and not self.closed:
+            c = self.buf[self.pos]
+            if not self.in_array:
+                if c == "[":
+                    rest = self.buf[self.pos + 1:].lstrip()
+                    if not rest:
+                        break    # 次の文字が届くまで判定を保留
+                    self.in_array = rest[0] in "{]"
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "{":
+                if self.depth == 0:
+                    self.obj_start = self.pos
+                self.depth += 1
+            elif c == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    item = self._parse(self.buf[self.obj_start:self.pos + 1])
+                    if item is not None:
+                        new_items.append(item)
+            elif c == "]" and self.depth == 0:
+                self.closed = True
+            self.pos += 1
+        self.items.extend(new_items)
+        return new_items
+
+    def _parse(self, text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return ast.literal_eval(text)
+        except Exception:
+            self.errors += 1
+            return None
+
+def call_ollama_stream(cfg, prompt, layout=None, url=None):
+    """
+    stream: true で問い合わせ、NDJSON を1行ずつ読みながら配列要素をパースする。
+    閉じ ] を読んだら接続を切って生成を打ち切る（Ollama はクライアント切断で生成を止める）。
+    最初のトークンまでの時間（ttft）と tokens/sec を stats に入れて返す。
+    """
+    import requests
+    scanner = JsonArrayScanner()
+    parts = []
+    stats = {"aborted": False}
+    n_tokens = 0
+    start = time.time()
+    first = None
+    payload = ollama_payload(cfg, prompt, True, layout)
+    try:
+        with requests.post(
+            url or cfg.ollama_url,
+            json=payload,
+            timeout=cfg.ollama_timeout,
+            stream=True
+        ) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    if not parts and "format" in payload and response.status_code == 400:
+                        disable_format(cfg, data["error"])
+                        return call_ollama_stream(cfg, prompt, layout, url)
+                    parts.append(str(data["error"]))
+                    stats["error"] = str(data["error"])
+                    break
+                token = data.get("response", "")
+                if token:
+                    if first is None:
+                        first = time.time()
+                        stats["ttft"] = first - start
+                    n_tokens += 1
+                    parts.append(token)
+                    scanner.feed(token)
+                if data.get("done"):
+                    stats.update({k: data[k] for k in OLLAMA_STATS_KEYS if k in data})
+                    break
+                if scanner.closed:
+                    stats["aborted"] = True
+                    break
+    except Exception as e:
+        parts.append(str(e))
+        stats["error"] = str(e)
+        stats["network_error"] = isinstance(e, requests.exceptions.RequestException)
+    end = time.time()
+    stats["elapsed"] = end - start
+    stats["stream_tokens"] = n_tokens
+    if stats.get("eval_count") and stats.get("eval_duration"):
+        stats["tokens_per_sec"] = stats["eval_count"] / (stats["eval_duration"] / 1e9)
+    elif first is not None and end > first:
+        stats["tokens_per_sec"] = n_tokens / (end - first)
+    if scanner.errors:
+        stats["item_errors"] = scanner.errors
+    return "".join(parts), stats, (scanner.items if scanner.closed else None)
+
+# コードフェンス除去
+# def strip_code_fence(text):
+#     return text.strip().removeprefix("```json").removesuffix("```").strip()
+def strip_code_fence(text, log_file):
+    """
+    応答テキストから JSON 配列または Python 構文配列を抽出・パースし、log_file にデバッグ出力。
+    """
+    # 応答本文ログ出力
+    log_file.write("--- strip_code_fence(): 応答本文 ---\n")
+    log_file.write(text + "\n")
+    log_file.write("-----------------------------------\n")
+
+   # すでにPythonのlist/dictとして渡された場合はそのまま返す
+    if isinstance(text, (list, dict)):
+        return text
+
+    # 文字列から [] を抽出
+    array_matches = re.findall(r"\[[\s\S]*?\]", text)
+    for candidate in array_matches:
+        try:
+            log_file.write(f"✓ JSONとして成功\n")
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return ast.literal_eval(candidate)
+        except Exception:
+            continue
+
+    return None
+
+def validate_entries(data):
+    """
+    INTERACTION_SCHEMA に沿って検査し、(使える要素のリスト, 捨てた要素数) を返す。
+    agent が空の要素は捨て、他のフィールドは文字列にそろえる。配列として読めなければ ValueError。
+    """
+    if isinstance(data, dict):
+        # {"interactions": [...]} のように包まれた応答、または要素1件だけの応答
+        lists = [v for v in data.values() if isinstance(v, list)]
+        data = lists[0] if len(lists) == 1 else [data]
+    if not isinstance(data, list):
+        raise ValueError(f"JSON 配列ではありません: {type(data).__name__}")
+    entries = []
+    for item in data:
+        if not isinstance(item, dict) or not isinstance(item.get("agent"), str) or not item["agent"].strip():
+            continue
+        entries.append({field: "" if item.get(field) is None else str(item[field]) for field in INTERACTION_FIELDS})
+    if data and not entries:
+        raise ValueError("スキーマに合う要素がありません")
+    return entries, len(data) - len(entries)
+
+def parse_response(raw, items, log_file, formatted=False):
+    """
+    応答を (要素のリスト または None, パース方式) にする。方式は
+    stream（ストリームで配列を読み切れた）/ schema（format 指定の応答をそのまま json.loads できた）/
+    fallback（strip_code_fence の正規表現で拾えた）/ failed。
+    formatted: format を指定して問い合わせた応答か
+    """
+    data, method = None, "failed"
+    if items is not None:
+        data, method = items, "stream"
+    elif formatted:
+        try:
+            data, method = json.loads(raw), "schema"
+        except (json.JSONDecodeError, TypeError):
+            pass
+    if data is None:
+        data = strip_code_fence(raw, log_file)
+        if data is not None:
+            method = "fallback"
+    if data is None:
+        return None, "failed"
+    try:
+        entries, n_invalid = validate_entries(data)
+    except ValueError as e:
+        log_file.write(f"--- スキーマ検査エラー ---\n{e}\n")
+        return None, "failed"
+    if n_invalid:
+        log_file.write(f"--- スキーマに合わない {n_invalid} 件を除外 ---\n")
+    return entries, method
+
+def split_text_safely(text, max_len=3000, overlap=500):
+    """
+    長文を max_len 文字以内のチャンクに改行単位で安全に分割。
+    各チャンクは overlap 文字だけ前のチャンクの末尾と重複させる。
+
+    :param text: 分割対象の文字列
+    :param max_len: 各チャンクの最大文字数（デフォルト: 3000）
+    :param overlap: チャンク間のオーバーラップ文字数（デフォルト: 500）
+    :return: 分割されたチャンクのリスト
+    """
+    paragraphs = text.split("\n")
+    chunks = []
+    current_chunk = ""
+
+    for para in paragraphs:
+        # 改行 + 1 文字分を見越して余裕を見る
+        if len(current_chunk) + len(para) + 1 <= max_len:
+            current_chunk += para + "\n"
+        else:
+            # チャンク完成
+            chunks.append(current_chunk.strip())
+
+            # overlap分を残す（改行込みで確保）
+            tail = current_chunk[-overlap:] if len(current_chunk) > overlap else current_chunk
+            current_chunk = tail + para + "\n"
+
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+
+    return chunks
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+# 新しい行単位（表の行・箇条書き）の始まりとみなさない行頭: 字下げ・閉じ括弧・「等」など前の行の続き
+_CONTINUATION_HEAD = re.compile(r"^(?:[ \t\u3000]|[）)\]】、。，,等])")
+
+def estimate_tokens(text, tokens_per_cjk_char=1.0):
+    """推定トークン数（ASCII は4文字で1トークン、それ以外は1文字 tokens_per_cjk_char トークン）"""
+    n_other = len(_NON_ASCII.findall(text))
+    return int((len(text) - n_other) / 4 + n_other * tokens_per_cjk_char) + 1
+
+def split_units(text):
+    """
+    相互作用の本文を、表の1行（薬剤名等・臨床症状・機序の行と、その字下げされた続き）や箇条書き1項目の単位に分ける。
+    括弧が閉じていない行の次の行も同じ単位にする。
+    """
+    units = []
+    current = []
+    depth = 0
+    for line in text.split("\n"):
+        if current and line.strip() and (depth > 0 or _CONTINUATION_HEAD.match(line)):
+            current.append(line)
+        else:
+            if current:
+                units.append("\n".join(current))
+            current = [line]
+            depth = 0
+        depth = max(0, depth + line.count("（") + line.count("(") - line.count("）") - line.count(")"))
+    if current:
+        units.append("\n".join(current))
+    return [u for u in units if u.strip()]
+
+def _split_oversized(unit, budget, tokens_per_cjk_char=1.0):
+    """budget に収まらない単位を行ごと、それでも長い行は句読点の後ろで切る"""
+    estimate = functools.partial(estimate_tokens, tokens_per_cjk_char=tokens_per_cjk_char)
+    pieces = []
+    for line in unit.split("\n"):
+        if estimate(line) <= budget:
+            pieces.append(line)
+            continue
+        part = []
+        for sentence in re.split(r"(?<=[。、，,；;])", line):
+            if part and estimate("".join(part) + sentence) > budget:
+                pieces.append("".join(part))
+                part = []
+            while estimate(sentence) > budget:
+                cut = max(1, int(len(sentence) * budget / estimate(sentence)))
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:]
+            part.append(sentence)
+        if part:
+            pieces.append("".join(part))
+    return pieces
+
+@functools.lru_cache(maxsize=None)
+def chunk_token_budget(context_tokens, output_tokens_reserve, layout="prefix", tokens_per_cjk_char=1.0):
+    """1チャンクに入れてよい本文の推定トークン数（コンテキスト − プロンプト本体 − 応答用）"""
+    overhead = (estimate_tokens(build_prompt("", 0, 1, layout), tokens_per_cjk_char)
+                + (estimate_tokens(PROMPT_INSTRUCTIONS, tokens_per_cjk_char) if layout == "system" else 0))
+    return max(256, context_tokens - overhead - output_tokens_reserve)
+
+def split_text_by_tokens(text, budget, overlap_tokens=100, tokens_per_cjk_char=1.0):
+    """
+    本文を split_units() の単位で、推定トークン数が budget 以内になるよう詰めてチャンクにする。
+    前のチャンクの末尾の単位を overlap_tokens 以内で次のチャンクの先頭に重ねる（単位の途中では切らない）。
+    """
+    estimate = functools.partial(estimate_tokens, tokens_per_cjk_char=tokens_per_cjk_char)
+    units = []
+    for unit in split_units(text):
+        if estimate(unit) > budget:
+            units.extend(_split_oversized(unit, budget, tokens_per_cjk_char))
+        else:
+            units.append(unit)
+    chunks = []
+    current, current_tokens = [], 0
+    fresh = False    # current に重ね分以外の単位が入っているか
+    for unit in units:
+        n = estimate(unit) + 1
+        if current and current_tokens + n > budget:
+            chunks.append("\n".join(current).strip())
+            # 重ね分は末尾から単位ごとに、overlap_tokens と budget の半分の小さい方まで
+            tail, tail_tokens = [], 0
+            for prev in reversed(current):
+                t = estimate(prev) + 1
+                if tail_tokens + t > min(overlap_tokens, budget // 2) or tail_tokens + t + n > budget:
+                    break
+                tail.insert(0, prev)
+                tail_tokens += t
+            current, current_tokens = tail, tail_tokens
+            fresh = False
+        current.append(unit)
+        current_tokens += n
+        fresh = True
+    if current and fresh:
+        chunks.append("\n".join(current).strip())
+    return chunks
+
+def split_text(cfg, text):
+    """chunk_mode に従って本文をチャンクに分ける"""
+    if cfg.chunk_mode == "chars":
+        return split_text_safely(text, max_len=cfg.chunk_length, overlap=cfg.chunk_overlap)
+    return split_text_by_tokens(text, cfg.token_budget(), overlap_tokens=cfg.chunk_overlap_tokens,
+                                tokens_per_cjk_char=cfg.tokens_per_cjk_char)
+
+def chunk_stats(cfg, plan):
+    """plan_groups() の結果から、1文面あたりのチャンク数の分布と推定トークン数をまとめた文字列を返す"""
+    counts = {}
+    tokens = []
+    for group in plan:
+        counts[len(group["chunks"])] = counts.get(len(group["chunks"]), 0) + 1
+        tokens.extend(estimate_tokens(chunk, cfg.tokens_per_cjk_char) for chunk in group["chunks"])
+    if not tokens:
+        return "チャンク: 0 件"
+    dist = " / ".join(f"{n}分割 {counts[n]}件" for n in sorted(counts))
+    budget = cfg.token_budget() if cfg.chunk_mode != "chars" else None
+    text = (f"チャンク（{cfg.chunk_mode}）: {len(tokens)} 件 / 推定トークン 平均 {sum(tokens) / len(tokens):.0f}・最大 {max(tokens)}"
+            f"\n  1文面あたり: {dist}")
+    if budget:
+        text += f"\n  上限 {budget} トークン（context_tokens {cfg.context_tokens}）に対する平均充填率 {sum(tokens) / len(tokens) / budget * 100:.0f}%"
+    return text
+
+# 全チャンク共通の指示文。Ollama のプロンプトキャッシュが効くよう、チャンクごとに変わる内容は入れない
+PROMPT_INSTRUCTIONS = (
+    "これから示す医薬品の「相互作用」に関する記載から、相互作用が記載されているすべての薬剤名（一般名または商品名）と薬効群名を抽出してください。\n\n"
+    "特に、薬効群（例：カテコールアミン製剤、キサンチン系薬剤など）の中に個別薬剤（例：アドレナリン、テオフィリン等）が列挙されている場合は、\n"
+    "カッコ書き内のすべての薬剤名（例：キニジン、パロキセチンなど）をそれぞれ展開し、1つずつ独立した項目として出力してください。\n"
+    "例えば以下のような文章：\n"
+    "「CYP2D6阻害作用を有する薬剤（キニジン、パロキセチン等）」\n"
+    "という記載があれば、以下のように展開して出力してください：\n\n"
+    "[\n"
+    "  {\n"
+    "    \"agent\": \"キニジン\",\n"
+    "    \"category\": \"CYP2D6阻害剤\",\n"
+    "    \"interaction_type\": \"併用注意\",\n"
+    "    \"description\": \"本剤の作用が増強するおそれがあるので、本剤を減量するなど考慮すること。\"\n"
+    "  },\n"
+    "  {\n"
+    "    \"agent\": \"パロキセチン\",\n"
+    "    \"category\": \"CYP2D6阻害剤\",\n"
+    "    \"interaction_type\": \"併用注意\",\n"
+    "    \"description\": \"本剤の作用が増強するおそれがあるので、本剤を減量するなど考慮すること。\"\n"
+    "  }\n"
+    "]\n\n"
+    "このように、括弧内に薬剤名が並んでいる場合は、それぞれを別の JSON オブジェクトとして出力してください。\n\n"
+    "以下の形式の JSON 配列で返してください（すべての薬剤について1つずつ）：\n\n"
+    "[\n"
+    "  {\n"
+    "    \"agent\": \"薬剤名または薬効群名（できる限り個別薬剤名）\",\n"
+    "    \"category\": \"薬効分類（不明な場合は近い表現）\",\n"
+    "    \"interaction_type\": \"併用注意 または 禁忌\",\n"
+    "    \"description\": \"相互作用の内容（薬効群名に対する説明を共通で使ってよい）\"\n"
+    "  }\n"
+    "]\n\n"
+    "絶対にフィールド名を変更しないでください。返答は、厳密な JSON 形式（ダブルクォートで囲まれた文字列）でのみ出力してください。\n"
+    "シングルクォートや <think> のような説明文は含めないでください。\n\n"
+)
+
+def build_prompt(chunk, part_idx, n_chunks, layout="prefix"):
+    """
+    prompt に入れる文字列を返す。prefix では固定の指示文のあとにチャンク番号と本文を置き、
+    system では指示文を ollama_payload() が system に入れるので、ここではチャンク番号と本文だけを返す。
+    """
+    if layout == "legacy":
+        return build_prompt_legacy(chunk, part_idx, n_chunks)
+    tail = f"以下が添付文書です（分割{part_idx+1}/{n_chunks}）：\n{chunk}"
+    return tail if layout == "system" else PROMPT_INSTRUCTIONS + tail
+
+def template_version(layout="prefix"):
+    """キャッシュのキーにするプロンプト版"""
+    return 1 if layout == "legacy" else PROMPT_TEMPLATE_VERSION
+
+def build_prompt_legacy(chunk, part_idx, n_chunks):
+    """従来の文面（チャンク番号が先頭にあるので、チャンクごとにプロンプトの先頭から評価し直しになる）"""
+    return (
+        f"以下は医薬品の「相互作用」に関する記載です（分割{part_idx+1}/{n_chunks}）。\n"
+        f"この文章から、相互作用が記載されているすべての薬剤名（一般名または商品名）と薬効群名を抽出してください。\n\n"
+        f"特に、薬効群（例：カテコールアミン製剤、キサンチン系薬剤など）の中に個別薬剤（例：アドレナリン、テオフィリン等）が列挙されている場合は、\n"
+        f"カッコ書き内のすべての薬剤名（例：キニジン、パロキセチンなど）をそれぞれ展開し、1つずつ独立した項目として出力してください。\n"
+        f"例えば以下のような文章：\n"
+        f"「CYP2D6阻害作用を有する薬剤（キニジン、パロキセチン等）」\n"
+        f"という記載があれば、以下のように展開して出力してください：\n\n"
+        "[\n"
+        "  {\n"
+        "    \"agent\": \"キニジン\",\n"
+        "    \"category\": \"CYP2D6阻害剤\",\n"
+        "    \"interaction_type\": \"併用注意\",\n"
+        "    \"description\": \"本剤の作用が増強するおそれがあるので、本剤を減量するなど考慮すること。\"\n"
+        "  },\n"
+        "  {\n"
+        "    \"agent\": \"パロキセチン\",\n"
+        "    \"category\": \"CYP2D6阻害剤\",\n"
+        "    \"interaction_type\": \"併用注意\",\n"
+        "    \"description\": \"本剤の作用が増強するおそれがあるので、本剤を減量するなど考慮すること。\"\n"
+        "  }\n"
+        "]\n\n"
+        "このように、括弧内に薬剤名が並んでいる場合は、それぞれを別の JSON オブジェクトとして出力してください。\n\n"
+        "以下の形式の JSON 配列で返してください（すべての薬剤について1つずつ）：\n\n"
+        "[\n"
+        "  {\n"
+        "    \"agent\": \"薬剤名または薬効群名（できる限り個別薬剤名）\",\n"
+        "    \"category\": \"薬効分類（不明な場合は近い表現）\",\n"
+        "    \"interaction_type\": \"併用注意 または 禁忌\",\n"
+        "    \"description\": \"相互作用の内容（薬効群名に対する説明を共通で使ってよい）\"\n"
+        "  }\n"
+        "]\n\n"
+        "絶対にフィールド名を変更しないでください。返答は、厳密な JSON 形式（ダブルクォートで囲まれた文字列）でのみ出力してください。\n"
+        "シングルクォートや <think> のような説明文は含めないでください。\n\n"
+        "以下が添付文書です：\n"
+        f"{chunk}"
+    )
+
+INSERT_SQL = """
+    INSERT INTO drug_interaction (id_druginformation, yj_code, chunk_index, agent, agent_key, category, interaction_type, description, created_at, AImodel)
+    VALUES %s
+"""
+
+def entry_values(members, entries, now, model):
+    """members=[(id_druginformation, yj_code, chunk_index), ...] × entries の drug_interaction 行"""
+    return [
+        (id_druginformation, yj_code, chunk_index,
+         entry.get("agent", ""), normalize_agent(entry.get("agent", "")), entry.get("category", ""),
+         entry.get("interaction_type", ""), entry.get("description", ""),
+         now, model)
+        for id_druginformation, yj_code, chunk_index in members
+        for entry in entries
+    ]
+
+# normalize_agent() と同じ規則の SQL 式（PostgreSQL 13 以降の normalize() を使う）
+# 空白は \s を使わず文字を列挙する（Python の \s は Unicode の空白全般、PostgreSQL の \s はロケール次第で一致しない）。
+# 全角空白・ノーブレークスペースは NFKC で半角空白になる
+_SPACES = r"[ \t\r\n\f\v]+"
+_AGENT_TRIM = r"^[・]+|(等|など|[、。,.])+$"
+AGENT_KEY_SQL = f"regexp_replace(regexp_replace(normalize(agent, NFKC), '{_SPACES}', '', 'g'), '{_AGENT_TRIM}', '', 'g')"
+INTERACTION_KEY_SQL = f"regexp_replace(normalize(coalesce(interaction_type, ''), NFKC), '{_SPACES}', '', 'g')"
+
+def normalize_agent(name):
+    """
+    重複判定用の薬剤名キー。全角・半角をそろえ（NFKC）、空白を除き、先頭の「・」と末尾の「等」「など」・句読点を落とす。
+    例: 「ＣＹＰ３Ａ４阻害剤 等」→「CYP3A4阻害剤」
+    """
+    text = re.sub(_SPACES, "", unicodedata.normalize("NFKC", name or ""))
+    return re.sub(_AGENT_TRIM, "", text)
+
+def merge_duplicates(conn, cursor, model, ids=None):
+    """
+    同じ (yj_code, 薬剤名キー, 注意区分) の行を1行にまとめ、削除した行数を返す。
+    残すのは説明が最も長い行（同じ長さなら先のチャンク）で、区分が空なら消す行の区分で補う。
+    ids を指定するとその id_druginformation だけ、None なら全件（このモデル分）を対象にする。
+    """
+    cursor.execute(f"UPDATE drug_interaction SET agent_key = {AGENT_KEY_SQL} WHERE agent_key IS NULL AND AImodel = %s",
+                   (model,))
+    where = "AImodel = %s" + (" AND id_druginformation = ANY(%s)" if ids is not None else "")
+    params = (model, list(ids)) if ids is not None else (model,)
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS interaction_merge (id INTEGER, keep_id INTEGER, rn BIGINT) ON COMMIT DELETE ROWS
+    """)
+    cursor.execute(f"""
+        INSERT INTO interaction_merge
+        SELECT id, first_value(id) OVER w, row_number() OVER w
+        FROM drug_interaction
+        WHERE {where}
+        WINDOW w AS (PARTITION BY yj_code, agent_key, {INTERACTION_KEY_SQL}
+                     ORDER BY length(coalesce(description, '')) DESC, chunk_index NULLS LAST, id)
+    """, params)
+    cursor.execute("""
+        UPDATE drug_interaction d SET category = g.category
+        FROM (
+            SELECT m.keep_id, max(d2.category) AS category
+            FROM interaction_merge m JOIN drug_interaction d2 ON d2.id = m.id
+            WHERE m.rn > 1 AND coalesce(d2.category, '') <> ''
+            GROUP BY m.keep_id
+        ) g
+        WHERE d.id = g.keep_id AND coalesce(d.category, '') = ''
+    """)
+    cursor.execute("DELETE FROM drug_interaction d USING interaction_merge m WHERE d.id = m.id AND m.rn > 1")
+    merged = cursor.rowcount
+    conn.commit()
+    return merged
+
+def finished_drugs(cursor, model, ids):
+    """ids のうち、このモデルの全チャンクが done / failed になった id_druginformation"""
+    cursor.execute("""
+        SELECT id_druginformation FROM drug_interaction_job
+        WHERE model = %s AND id_druginformation = ANY(%s)
+        GROUP BY id_druginformation
+        HAVING bool_and(status IN ('done', 'failed'))
+    """, (model, list(ids)))
+    return [r[0] for r in cursor.fetchall()]
+
+class InteractionWriter:
+    """
+    チャンクごとの抽出結果を batch_chunks チャンク分、または flush_seconds 秒分ためて、
+    1回の execute_values／1トランザクションで drug_interaction に書き、ジョブを done にする。
+    既存の同じ (id_druginformation, chunk_index, AImodel) の行は消してから入れ直すので、同じチャンクを何度書いても結果は1回分になる。
+    一括書き込みが失敗した場合はロールバックし、チャンクごと→1件ずつ（SAVEPOINT）に切り替えて、失敗した行だけを報告する。
+    """
+
+    def __init__(self, conn, log_file, model, metrics, batch_chunks=20, flush_seconds=5.0, merge_mode="inline",
+                 report=print):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.log_file = log_file
+        self.model = model
+        self.metrics = metrics
+        self.batch_chunks = max(1, batch_chunks)
+        self.flush_seconds = flush_seconds
+        self.merge_mode = merge_mode
+        self.report = report
+        self.chunks = []     # (members, entries, latency)
+        self.failures = []   # (keys, latency, error, kind)
+        self.first_added = None
+        self.written = 0
+        self.failed = 0
+        self.merged = 0
+        self.n_flush = 0
+        self.db_seconds = 0.0   # flush（書き込み・統合）にかかった時間の合計
+
+    def add(self, members, entries, latency):
+        """1チャンク分の抽出結果を追加し、書き込む予定の行数を返す"""
+        entries = [e for e in entries if isinstance(e, dict)]
+        self.chunks.append((members, entries, latency))
+        self._added()
+        return len(members) * len(entries)
+
+    def add_failure(self, members, latency, error, kind="parse"):
+        """抽出に失敗したチャンクのジョブを failed にする（kind は失敗の理由。create_job_table の fail_kind を参照）"""
+        keys = [(id_druginformation, chunk_index) for id_druginformation, _, chunk_index in members]
+        self.failures.append((keys, latency, str(error)[:1000], kind))
+        self._added()
+
+    def _added(self):
+        if self.first_added is None:
+            self.first_added = time.time()
+        if len(self.chunks) + len(self.failures) >= self.batch_chunks:
+            self.flush()
+
+    def due(self):
+        """最初にためた結果から flush_seconds 秒以上たっていれば True"""
+        return self.first_added is not None and time.time() - self.first_added >= self.flush_seconds
+
+    def flush(self):
+        if not self.chunks and not self.failures:
+            self.first_added = None
+            return
+        flush_started = time.time()
+        now = datetime.now()
+        values = [v for members, entries, _ in self.chunks for v in entry_values(members, entries, now, self.model)]
+        try:
+            with self.metrics.stage("insert"):
+                self._write_chunks(self.chunks, values)
+                self._write_failures()
+                self.conn.commit()
+            self.written += len(values)
+            self.log_file.write(f"--- SQL insert success! ({len(values)}件 / {len(self.chunks)}チャンク) ---\n")
+        except Exception as e:
+            self.conn.rollback()
+            self.report(f"[batch] 一括INSERT失敗のためチャンクごとに再実行します: {e}")
+            self.log_file.write(f"--- SQL bulk INSERT Error → チャンクごとに再実行 ---\n{e}\n")
+            with self.metrics.stage("insert_retry"):
+                self._flush_one_by_one(now)
+        self.n_flush += 1
+        touched = {i for members, _, _ in self.chunks for i, _, _ in members}
+        touched.update(i for keys, _, _, _ in self.failures for i, _ in keys)
+        self.chunks = []
+        self.failures = []
+        self.first_added = None
+        if self.merge_mode == "inline" and touched:
+            self._merge_finished(touched)
+        self.db_seconds += time.time() - flush_started
+
+    def _merge_finished(self, ids):
+        """全チャンクが終わった薬剤だけ、チャンクをまたいだ重複行をまとめる"""
+        try:
+            with self.metrics.stage("merge"):
+                done = finished_drugs(self.cur, self.model, ids)
+                if done:
+                    self.merged += merge_duplicates(self.conn, self.cur, self.model, done)
+                self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.report(f"[merge] 重複行の統合に失敗しました: {e}")
+
+    def _write_chunks(self, chunks, values):
+        keys = [(id_druginformation, chunk_index)
+                for members, _, _ in chunks for id_druginformation, _, chunk_index in members]
+        delete_chunk_rows(self.cur, self.model, keys)
+        if values:
+            execute_values(self.cur, INSERT_SQL, values, page_size=len(values))
+        for members, _, latency in chunks:
+            set_job_status(self.cur, self.model, [(i, c) for i, _, c in members], "done", latency=latency)
+
+    def _write_failures(self):
+        for keys, latency, error, kind in self.failures:
+            set_job_status(self.cur, self.model, keys, "failed", latency=latency, error=error, fail_kind=kind)
+
+    def _flush_one_by_one(self, now):
+        """チャンクごとに SAVEPOINT を切って書き直し、それでも失敗したチャンクは1件ずつ書く"""
+        for chunk in self.chunks:
+            members, entries, latency = chunk
+            values = entry_values(members, entries, now, self.model)
+            self.cur.execute("SAVEPOINT chunk")
+            try:
+                self._write_chunks([chunk], values)
+                self.cur.execute("RELEASE SAVEPOINT chunk")
+                self.written += len(values)
+                continue
+            except Exception:
+                self.cur.execute("ROLLBACK TO SAVEPOINT chunk")
+            keys = [(i, c) for i, _, c in members]
+            delete_chunk_rows(self.cur, self.model, keys)
+            for row in values:
+                self.cur.execute("SAVEPOINT entry")
+                try:
+                    execute_values(self.cur, INSERT_SQL, [row])
+                    self.cur.execute("RELEASE SAVEPOINT entry")
+                    self.written += 1
+                except Exception as insert_err:
+                    self.cur.execute("ROLLBACK TO SAVEPOINT entry")
+                    self.failed += 1
+                    self.log_file.write(f"--- SQL INSERT Error ---\n{insert_err}\nentry={row}\n")
+                    self.report(f"--- SQL INSERT Error ---\n{insert_err}\nentry={row}\n")
+            set_job_status(self.cur, self.model, keys, "done", latency=latency)
+        self._write_failures()
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.cur.close()
+
+def normalize_content(text):
+    """重複判定用の正規化（改行コード・行末空白・連続空白・前後の空行の違いを無視）"""
+    text = (text or "").replace("\r\n", "\n").replace("\r", "\n").replace("\u3000", " ")
+    lines = [re.sub(r"[ \t]+", " ", ln).strip() for ln in text.split("\n")]
+    return "\n".join(lines).strip()
+
+def plan_groups(cfg, rows):
+    """
+    rows を正規化本文のハッシュでグループ化し、LLM に投げる単位（グループ）のリストを返す。
+    各グループ: {"members": [(id_druginformation, yj_code), ...], "yj_code": 代表, "chunks": [...]}
+    代表は id_druginformation 最小の行で、グループは代表の id 順に並ぶ。
+    """
+    groups = {}
+    for id_druginformation, yj_code, content in rows:
+        key = (hashlib.sha256(normalize_content(content).encode("utf-8")).hexdigest()
+               if cfg.llm_dedup else id_druginformation)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = group = {"members": [], "yj_code": yj_code, "content": content}
+        group["members"].append((id_druginformation, yj_code))
+    plan = sorted(groups.values(), key=lambda g: g["members"][0][0])
+    for group in plan:
+        group["chunks"] = split_text(cfg, group.pop("content") or "")
+    return plan
+
+def create_interaction_table(cursor, drop=False):
+    """drug_interaction を作る。drop=True なら削除して作り直す"""
+    if drop:
+        cursor.execute("DROP TABLE IF EXISTS drug_interaction")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS drug_interaction (
+        id SERIAL PRIMARY KEY,
+        id_druginformation INTEGER,
+        yj_code VARCHAR(16),
+        chunk_index INTEGER,
+        agent TEXT,
+        agent_key TEXT,
+        category TEXT,
+        interaction_type TEXT,
+        description TEXT,
+        AImodel VARCHAR(64),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def create_job_table(cursor, drop=False):
+    """
+    チャンク単位の処理状況テーブル。status は pending / running / done / failed。
+    failed のときは fail_kind に理由（parse: 応答の JSON パース失敗 / llm: HTTP エラー・タイムアウト・サーバーなし /
+    worker: ワーカー内の例外 / missing: 本文が見つからない）を入れる。
+    """
+    if drop:
+        cursor.execute("DROP TABLE IF EXISTS drug_interaction_job")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS drug_interaction_job (
+            id_druginformation INTEGER,
+            chunk_index INTEGER,
+            model VARCHAR(64),
+            yj_code VARCHAR(16),
+            n_chunks INTEGER,
+            chunk_hash CHAR(64),
+            status VARCHAR(16) DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            worker TEXT,
+            latency REAL,
+            error TEXT,
+            fail_kind VARCHAR(16),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id_druginformation, chunk_index, model)
+        )
+    """)
+    cursor.execute("ALTER TABLE drug_interaction_job ADD COLUMN IF NOT EXISTS fail_kind VARCHAR(16)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS drug_interaction_job_status_idx ON drug_interaction_job (model, status, id_druginformation)")
+    # チャンク単位で入れ直せるよう drug_interaction にもチャンク番号を持たせる
+    cursor.execute("SELECT to_regclass('drug_interaction')")
+    if cursor.fetchone()[0] is not None:
+        cursor.execute("ALTER TABLE drug_interaction ADD COLUMN IF NOT EXISTS chunk_index INTEGER")
+        cursor.execute("ALTER TABLE drug_interaction ADD COLUMN IF NOT EXISTS agent_key TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS drug_interaction_chunk_idx ON drug_interaction (id_druginformation, chunk_index)")
+
+def sync_jobs(conn, cursor, plan, model):
+    """
+    plan のチャンクをジョブとして登録する。既存ジョブは本文ハッシュか分割数が変わったものだけ pending に戻し、
+    分割数が減って不要になったチャンクのジョブと抽出結果は削除する。他プロセスが同時に呼んでも結果は同じ。
+    """
+    values = [
+        (id_druginformation, chunk_index, model, yj_code, len(group["chunks"]), ResponseCache.chunk_hash(chunk))
+        for group in plan
+        for id_druginformation, yj_code in group["members"]
+        for chunk_index, chunk in enumerate(group["chunks"])
+    ]
+    changed = execute_values(cursor, """
+        INSERT INTO drug_interaction_job (id_druginformation, chunk_index, model, yj_code, n_chunks, chunk_hash)
+        VALUES %s
+        ON CONFLICT (id_druginformation, chunk_index, model) DO UPDATE
+        SET yj_code = EXCLUDED.yj_code, n_chunks = EXCLUDED.n_chunks, chunk_hash = EXCLUDED.chunk_hash,
+            status = 'pending', attempts = 0, error = NULL, fail_kind = NULL, updated_at = now()
+        WHERE drug_interaction_job.chunk_hash <> EXCLUDED.chunk_hash
+           OR drug_interaction_job.n_chunks <> EXCLUDED.n_chunks
+        RETURNING id_druginformation
+    """, values, page_size=1000, fetch=True)
+    # 統合済みの行は別チャンクの行を吸収しているので、1チャンクでも変わった薬剤は全チャンクをやり直す
+    changed_ids = sorted({r[0] for r in changed})
+    if changed_ids:
+        cursor.execute("""
+            UPDATE drug_interaction_job SET status = 'pending', attempts = 0, error = NULL, fail_kind = NULL, updated_at = now()
+            WHERE model = %s AND id_druginformation = ANY(%s) AND status <> 'pending'
+        """, (model, changed_ids))
+    cursor.execute("""
+        DELETE FROM drug_interaction d USING drug_interaction_job j0
+        WHERE j0.model = %s AND j0.chunk_index = 0 AND d.AImodel = j0.model
+          AND d.id_druginformation = j0.id_druginformation AND d.chunk_index >= j0.n_chunks
+    """, (model,))
+    cursor.execute("""
+        DELETE FROM drug_interaction_job j USING drug_interaction_job j0
+        WHERE j0.model = %s AND j0.chunk_index = 0 AND j.model = j0.model
+          AND j.id_druginformation = j0.id_druginformation AND j.chunk_index >= j0.n_chunks
+    """, (model,))
+    conn.commit()
+
+def reset_jobs(conn, cursor, model, statuses, older_than=None):
+    """指定した status のジョブを pending に戻し、件数を返す（older_than 秒より古い更新のものだけに絞れる）"""
+    sql = "UPDATE drug_interaction_job SET status = 'pending', updated_at = now() WHERE model = %s AND status = ANY(%s)"
+    params = [model, list(statuses)]
+    if older_than is not None:
+        sql += " AND updated_at < now() - %s * interval '1 second'"
+        params.append(older_than)
+    cursor.execute(sql, params)
+    n = cursor.rowcount
+    conn.commit()
+    return n
+
+def claim_jobs(conn, cursor, model, limit):
+    """
+    pending のジョブを最大 limit 件ぶん running にして返す（FOR UPDATE SKIP LOCKED で他プロセスと取り合わない）。
+    先頭 limit 件と同じプロンプト（本文ハッシュ・チャンク番号・分割数）のジョブもまとめて取る。
+    """
+    cursor.execute("""
+        WITH head AS (
+            SELECT chunk_hash, chunk_index, n_chunks FROM drug_interaction_job
+            WHERE model = %s AND status = 'pending'
+            ORDER BY id_druginformation, chunk_index
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), picked AS (
+            SELECT id_druginformation, chunk_index FROM drug_interaction_job
+            WHERE model = %s AND status = 'pending'
+              AND (chunk_hash, chunk_index, n_chunks) IN (SELECT chunk_hash, chunk_index, n_chunks FROM head)
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE drug_interaction_job j
+        SET status = 'running', worker = %s, attempts = j.attempts + 1, updated_at = now()
+        FROM picked p
+        WHERE j.model = %s AND j.id_druginformation = p.id_druginformation AND j.chunk_index = p.chunk_index
+        RETURNING j.id_druginformation, j.yj_code, j.chunk_index, j.n_chunks, j.chunk_hash
+    """, (model, limit, model, worker_name, model))
+    jobs = sorted(cursor.fetchall())
+    conn.commit()
+    return jobs
+
+def set_job_status(cursor, model, keys, status, latency=None, error=None, fail_kind=None):
+    """keys=[(id_druginformation, chunk_index), ...] のジョブの状態を更新する（commit は呼び出し側）"""
+    sql = cursor.mogrify("""
+        UPDATE drug_interaction_job j
+        SET status = %s, latency = %s, error = %s, fail_kind = %s, updated_at = now()
+        FROM (VALUES %%s) AS k (id_druginformation, chunk_index)
+        WHERE j.model = %s AND j.id_druginformation = k.id_druginformation AND j.chunk_index = k.chunk_index
+    """, (status, latency, error, fail_kind, model))
+    execute_values(cursor, sql, keys)
+
+def delete_chunk_rows(cursor, model, keys):
+    """keys=[(id_druginformation, chunk_index), ...] の既存の抽出結果（このモデル分）を削除する"""
+    sql = cursor.mogrify("""
+        DELETE FROM drug_interaction d
+        USING (VALUES %%s) AS k (id_druginformation, chunk_index)
+        WHERE d.AImodel = %s AND d.id_druginformation = k.id_druginformation AND d.chunk_index = k.chunk_index
+    """, (model,))
+    execute_values(cursor, sql, keys)
+
+def job_summary(cursor, model):
+    cursor.execute("SELECT status, count(*) FROM drug_interaction_job WHERE model = %s GROUP BY status ORDER BY status",
+                   (model,))
+    return " / ".join(f"{status} {n}" for status, n in cursor.fetchall())
+
+class ResponseCache:
+    """
+    パース済みの LLM 応答を (model, template_version, layout, チャンク本文の sha256) で保存する。
+    prefix と system はプロンプト版が同じでも文面の置き場所が違うので、layout もキーに入れる。
+    同一文面の相互作用（後発品など）は2回目以降 Ollama を呼ばずに済む。複数スレッドから使う。
+    """
+
+    def __init__(self, path, model, template_version, layout="prefix", enabled=True):
+        self.model = model
+        self.template_version = template_version
+        self.layout = layout
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if enabled:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self._migrate()
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    model TEXT,
+                    template_version INTEGER,
+                    layout TEXT,
+                    chunk_hash TEXT,
+                    response TEXT,
+                    created_at TEXT,
+                    PRIMARY KEY (model, template_version, layout, chunk_hash)
+                )
+            """)
+            self.db.commit()
+
+    def _migrate(self):
+        """
+        layout 列の無い古いキャッシュを作り直す。プロンプト版 1 は legacy の応答なのでそのまま移し、
+        版 2 は prefix と system のどちらの応答か分からないので捨てる。
+        """
+        columns = [r[1] for r in self.db.execute("PRAGMA table_info(llm_response_cache)")]
+        if not columns or "layout" in columns:
+            return
+        self.db.execute("ALTER TABLE llm_response_cache RENAME TO llm_response_cache_old")
+        self.db.execute("""
+            CREATE TABLE llm_response_cache (
+                model TEXT,
+                template_version INTEGER,
+                layout TEXT,
+                chunk_hash TEXT,
+                response TEXT,
+                created_at TEXT,
+                PRIMARY KEY (model, template_version, layout, chunk_hash)
+            )
+        """)
+        kept = self.db.execute("""
+            INSERT INTO llm_response_cache
+            SELECT model, template_version, 'legacy', chunk_hash, response, created_at
+            FROM llm_response_cache_old WHERE template_version = 1
+        """).rowcount
+        dropped = self.db.execute("SELECT count(*) FROM llm_response_cache_old WHERE template_version <> 1").fetchone()[0]
+        self.db.execute("DROP TABLE llm_response_cache_old")
+        self.db.commit()
+        print(f"LLMキャッシュにレイアウト列を追加しました（legacy {kept} 件を移行 / レイアウト不明の {dropped} 件を削除）。")
+
+    @staticmethod
+    def chunk_hash(chunk):
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def get(self, chunk):
+        """キャッシュ済みのパース結果（list/dict）を返す。無ければ None"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT response FROM llm_response_cache"
+                " WHERE model = ? AND template_version = ? AND layout = ? AND chunk_hash = ?",
+                (self.model, self.template_version, self.layout, self.chunk_hash(chunk))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, chunk, parsed):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO llm_response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (self.model, self.template_version, self.layout, self.chunk_hash(chunk),
+                 json.dumps(parsed, ensure_ascii=False), datetime.now().isoformat()))
+            self.db.commit()
+
+    def evict(self, model=None, template_version=None, layout=None):
+        """model / template_version / layout を指定して削除し、削除件数を返す（すべて None なら全削除）"""
+        where, params = [], []
+        if model is not None:
+            where.append("model = ?"); params.append(model)
+        if template_version is not None:
+            where.append("template_version = ?"); params.append(template_version)
+        if layout is not None:
+            where.append("layout = ?"); params.append(layout)
+        sql = "DELETE FROM llm_response_cache" + (" WHERE " + " AND ".join(where) if where else "")
+        with self.lock:
+            n = self.db.execute(sql, params).rowcount
+            self.db.commit()
+        return n
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"LLMキャッシュ: hit {self.hits} / miss {self.misses}（ヒット率 {rate:.1f}%）"
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+class Backend:
+    """Ollama サーバー1台分の設定と、同時実行数・実績の集計"""
+
+    def __init__(self, url, concurrency=1, weight=1.0):
+        self.url = url
+        self.concurrency = max(1, int(concurrency))
+        self.weight = max(float(weight), 1e-6)
+        self.active = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.tokens = 0
+
+    @property
+    def name(self):
+        return self.url.split("//")[-1].split("/")[0]
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def load(self):
+        """重みで割った負荷（これが小さいサーバーから使う）"""
+        return (self.active + 1) / self.weight
+
+class BackendPool:
+    """
+    複数の Ollama サーバーへの振り分け。acquire() は、同時実行数に空きがあって接続エラーで外されていない
+    サーバーのうち、重み付きの負荷が最も小さいものを返す（空きが無ければ待つ）。
+    """
+
+    def __init__(self, backends, retry_seconds=30):
+        self.backends = [Backend(b["url"], b.get("concurrency", 1), b.get("weight", 1)) for b in backends]
+        self.retry_seconds = retry_seconds   # 接続できなかったサーバーを再び使うまでの秒数
+        self.cond = threading.Condition()
+
+    def acquire(self, exclude=()):
+        with self.cond:
+            while True:
+                now = time.time()
+                candidates = [b for b in self.backends
+                              if b not in exclude and b.active < b.concurrency and b.healthy(now)]
+                if candidates:
+                    backend = min(candidates, key=Backend.load)
+                    backend.active += 1
+                    return backend
+                if all(b in exclude for b in self.backends):
+                    return None
+                # 空き待ち。外されたサーバーの復帰時刻にも起きる
+                waits = [b.down_until - now for b in self.backends if b not in exclude and not b.healthy(now)]
+                self.cond.wait(timeout=min(waits + [1.0]))
+
+    def release(self, backend, start, end, stats):
+        with self.cond:
+            backend.active -= 1
+            backend.requests += 1
+            backend.busy += end - start
+            backend.tokens += stats.get("eval_count", stats.get("stream_tokens", 0))
+            if stats.get("error"):
+                backend.errors += 1
+                if stats.get("network_error"):
+                    backend.down_until = time.time() + self.retry_seconds
+            self.cond.notify_all()
+
+    def check_health(self):
+        """起動時に各サーバーの /api/tags を確認し、応答しないサーバーはしばらく外す"""
+        import requests
+        for backend in self.backends:
+            base = backend.url.split("/api/")[0]
+            try:
+                requests.get(f"{base}/api/tags", timeout=3).raise_for_status()
+                print(f"Ollama {backend.name}: OK（同時 {backend.concurrency} / 重み {backend.weight:g}）")
+            except Exception as e:
+                backend.down_until = time.time() + self.retry_seconds
+                print(f"Ollama {backend.name}: 応答なし、{self.retry_seconds}秒後に再試行します（{e}）")
+
+    def summary(self, elapsed):
+        lines = []
+        for b in self.backends:
+            rate = b.requests / elapsed * 60 if elapsed else 0.0
+            tps = b.tokens / b.busy if b.busy else 0.0
+            lines.append(f"  {b.name}: {b.requests} 件（{rate:.1f} 件/分）/ エラー {b.errors} / 稼働 {b.busy:.1f} 秒 / {tps:.1f} tokens/sec")
+        return "Ollama サーバー別:\n" + "\n".join(lines)
+
+class LatencyStats:
+    """チャンクごとの ttft・tokens/sec を集計する（キャッシュ使用分は含めない）"""
+
+    def __init__(self, layout="prefix", model=""):
+        self.layout = layout
+        self.model = model
+        self.n = 0
+        self.ttft = []
+        self.tokens_per_sec = []
+        self.aborted = 0
+        self.parse = {}
+        self.prompt_eval = []   # (prompt_eval_count, prompt_eval_duration 秒)
+
+    def add(self, stats):
+        if not stats:
+            return
+        self.n += 1
+        if "ttft" in stats:
+            self.ttft.append(stats["ttft"])
+        if "tokens_per_sec" in stats:
+            self.tokens_per_sec.append(stats["tokens_per_sec"])
+        self.aborted += bool(stats.get("aborted"))
+        if "prompt_eval_duration" in stats:
+            self.prompt_eval.append((stats.get("prompt_eval_count", 0), stats["prompt_eval_duration"] / 1e9))
+        if "parse" in stats:
+            self.parse[stats["parse"]] = self.parse.get(stats["parse"], 0) + 1
+
+    @staticmethod
+    def describe(stats):
+        """ログ1行分の表記（stats が空なら空文字）"""
+        text = ""
+        if "ttft" in stats:
+            text += f" / ttft {stats['ttft']:.2f} sec"
+        if "tokens_per_sec" in stats:
+            text += f" / {stats['tokens_per_sec']:.1f} tokens/sec"
+        if stats.get("aborted"):
+            text += " / ] で打ち切り"
+        if "backend" in stats:
+            text += f" / {stats['backend']}"
+        if "prompt_eval_duration" in stats:
+            text += f" / prompt eval {stats.get('prompt_eval_count', 0)} tokens {stats['prompt_eval_duration'] / 1e6:.0f} ms"
+        return text
+
+    def summary(self):
+        def median(values):
+            values = sorted(values)
+            return values[len(values) // 2] if values else 0.0
+        text = f"LLM応答 {self.n} 件"
+        if self.ttft:
+            text += f": ttft 平均 {sum(self.ttft) / len(self.ttft):.2f} 秒 / 中央値 {median(self.ttft):.2f} 秒"
+        if self.tokens_per_sec:
+            text += f" / {sum(self.tokens_per_sec) / len(self.tokens_per_sec):.1f} tokens/sec"
+        if self.aborted:
+            text += f" / ] で打ち切り {self.aborted} 件"
+        if self.prompt_eval:
+            n = len(self.prompt_eval)
+            text += (f"\nプロンプト評価（{self.layout}）: 平均 {sum(c for c, _ in self.prompt_eval) / n:.0f} tokens / "
+                     f"{sum(d for _, d in self.prompt_eval) / n * 1000:.0f} ms")
+        if self.parse:
+            detail = " / ".join(f"{k} {v}" for k, v in sorted(self.parse.items()))
+            text += f"\nパース（model: {self.model}）: {detail}（失敗率 {self.parse.get('failed', 0) / self.n * 100:.1f}%）"
+        return text
+
+class ThrottlePolicy:
+    """
+    GPU加熱対策の休止方針。ワーカーは問い合わせ前に delay() が 0 になるまで待ち、
+    応答後に record() で実測値を渡す。書き込み側は薬剤が終わるたびに drugs_done() を呼ぶ。
+    """
+    name = "none"
+
+    def delay(self):
+        """今から待つべき秒数（0 以下なら待たない）"""
+        return 0.0
+
+    def record(self, start, end, tokens):
+        pass
+
+    def drugs_done(self, n_done):
+        """n_done: これまでに終わった薬剤の累計。休止を始めたらメッセージを返す"""
+        return None
+
+class FixedThrottle(ThrottlePolicy):
+    """従来どおり every 件処理するごとに seconds 秒休む"""
+    name = "fixed"
+
+    def __init__(self, seconds, every=10):
+        self.seconds = seconds
+        self.every = every
+        self.prev = 0
+        self.until = 0.0
+
+    def delay(self):
+        return self.until - time.time()
+
+    def drugs_done(self, n_done):
+        crossed = n_done // self.every > self.prev // self.every
+        self.prev = n_done
+        if crossed and self.seconds > 0:
+            self.until = max(self.until, time.time() + self.seconds)
+            return f"{n_done}件処理済み、{self.seconds}秒休止"
+        return None
+
+class BudgetThrottle(ThrottlePolicy):
+    """
+    直近 window 秒のうち GPU が応答生成に使った時間（問い合わせ区間の和集合）が busy_ratio を超えるか、
+    生成トークン数（eval_count の合計）が max_tokens を超えたら、窓から古い実績が抜けるまで休む。
+    短い相互作用が続くときは休まず、長い生成が続くときだけ休む。
+    """
+    name = "budget"
+
+    def __init__(self, window=300.0, busy_ratio=0.8, max_tokens=0):
+        self.window = window
+        self.busy_ratio = busy_ratio
+        self.max_tokens = max_tokens
+        self.events = deque()   # (start, end, tokens)  end 昇順
+
+    def record(self, start, end, tokens):
+        self.events.append((start, end, tokens))
+
+    def delay(self):
+        now = time.time()
+        lower = now - self.window
+        while self.events and self.events[0][1] <= lower:
+            self.events.popleft()
+        wait = 0.0
+        if self.busy_ratio and self.busy_ratio < 1:
+            busy = 0.0
+            cur_start = cur_end = None
+            for start, end, _ in sorted(self.events):
+                start = max(start, lower)
+                if cur_end is None or start > cur_end:
+                    if cur_end is not None:
+                        busy += cur_end - cur_start
+                    cur_start, cur_end = start, end
+                else:
+                    cur_end = max(cur_end, end)
+            if cur_end is not None:
+                busy += cur_end - cur_start
+            wait = max(wait, busy - self.busy_ratio * self.window)
+        if self.max_tokens and self.events and sum(e[2] for e in self.events) >= self.max_tokens:
+            wait = max(wait, self.events[0][1] + self.window - now)
+        return wait
+
+class CommandProbe:
+    """コマンドの出力に含まれる数値の最大値を温度とする（例: nvidia-smi --query-gpu=temperature.gpu --format=csv,noheader,nounits）"""
+
+    def __init__(self, command):
+        self.command = command
+
+    def read(self):
+        out = subprocess.run(self.command, shell=True, capture_output=True, text=True, timeout=10).stdout
+        values = [float(v) for v in re.findall(r"-?\d+(?:\.\d+)?", out)]
+        return max(values) if values else None
+
+class FileProbe:
+    """ファイルの数値を温度とする（/sys/class/hwmon/*/temp*_input のミリ度表記は ℃ に直す）"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            value = float(f.read().split()[0])
+        return value / 1000 if value > 1000 else value
+
+class FakeProbe:
+    """テスト用。values を順に返し、尽きたら最後の値を返し続ける"""
+
+    def __init__(self, values):
+        self.values = deque(values)
+
+    def read(self):
+        if len(self.values) > 1:
+            return self.values.popleft()
+        return self.values[0] if self.values else None
+
+class ThermalThrottle(ThrottlePolicy):
+    """温度が limit 以上になったら、resume 以下に下がるまで poll 秒ごとに測り直しながら休む"""
+    name = "thermal"
+
+    def __init__(self, probe, limit=80.0, resume=70.0, poll=5.0):
+        self.probe = probe
+        self.limit = limit
+        self.resume = resume
+        self.poll = poll
+        self.hot = False
+        self.last_read = 0.0
+        self.temperature = None
+
+    def delay(self):
+        now = time.time()
+        if now - self.last_read >= self.poll or self.temperature is None:
+            self.last_read = now
+            try:
+                self.temperature = self.probe.read()
+            except Exception as e:
+                print(f"温度の取得に失敗しました: {e}")
+                self.temperature = None
+            if self.temperature is not None:
+                if not self.hot and self.temperature >= self.limit:
+                    self.hot = True
+                    print(f"\n--- 温度 {self.temperature:.0f}℃ ≥ {self.limit:.0f}℃ のため休止 ---\n")
+                elif self.hot and self.temperature <= self.resume:
+                    self.hot = False
+                    print(f"\n--- 温度 {self.temperature:.0f}℃ に下がったので再開 ---\n")
+        return self.last_read + self.poll - now if self.hot else 0.0
+
+class Throttle:
+    """複数の休止方針をまとめ、休止した実時間（複数ワーカーが同時に待った分は重ねない）を方針ごとに集計する"""
+
+    def __init__(self, policies):
+        self.policies = policies
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.pause_start = 0.0
+        self.pause_reason = None
+        self.throttled = {p.name: 0.0 for p in policies}
+
+    def _delay(self):
+        with self.lock:
+            return max(((p.delay(), p.name) for p in self.policies), default=(0.0, None))
+
+    def wait(self):
+        wait, name = self._delay()
+        if wait <= 0:
+            return
+        with self.lock:
+            self.waiting += 1
+            if self.waiting == 1:
+                self.pause_start = time.time()
+                self.pause_reason = name
+        try:
+            while wait > 0:
+                time.sleep(min(wait, 1.0))
+                wait, _ = self._delay()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                if self.waiting == 0:
+                    self.throttled[self.pause_reason] += time.time() - self.pause_start
+
+    def record(self, start, end, tokens):
+        with self.lock:
+            for p in self.policies:
+                p.record(start, end, tokens)
+
+    def drugs_done(self, n_done):
+        with self.lock:
+            messages = [m for m in (p.drugs_done(n_done) for p in self.policies) if m]
+        return messages
+
+    def summary(self, elapsed):
+        if not self.policies:
+            return "休止時間: なし（throttle_policy: none）"
+        total = sum(self.throttled.values())
+        detail = " / ".join(f"{name} {sec:.1f}秒" for name, sec in self.throttled.items())
+        rate = total / elapsed * 100 if elapsed else 0.0
+        return f"休止時間: 合計 {total:.1f}秒（{detail}）/ 経過 {elapsed:.1f}秒の {rate:.1f}%"
+
+def build_throttle(cfg):
+    """設定の throttle_policy から Throttle を作る"""
+    names = cfg.throttle_policy if isinstance(cfg.throttle_policy, list) else [cfg.throttle_policy]
+    policies = []
+    for name in names:
+        if name == "fixed":
+            policies.append(FixedThrottle(cfg.pause_second))
+        elif name == "budget":
+            policies.append(BudgetThrottle(window=cfg.throttle_window_seconds,
+                                           busy_ratio=cfg.throttle_busy_ratio,
+                                           max_tokens=cfg.throttle_max_tokens))
+        elif name == "thermal":
+            if cfg.thermal_probe_fake is not None:
+                probe = FakeProbe(cfg.thermal_probe_fake)
+            elif cfg.thermal_probe_file:
+                probe = FileProbe(cfg.thermal_probe_file)
+            else:
+                probe = CommandProbe(cfg.thermal_probe_command)
+            policies.append(ThermalThrottle(probe, limit=cfg.thermal_limit,
+                                            resume=cfg.thermal_resume,
+                                            poll=cfg.thermal_poll_seconds))
+        elif name != "none":
+            raise ValueError(f"throttle_policy が不正です: {name}")
+    return Throttle(policies)
+
+def produce_tasks(cfg, metrics, chunk_texts, tasks, n_workers, log_file, errors):
+    """
+    ジョブを少しずつ claim し、同じプロンプトになるジョブを1タスクにまとめて LLM ワーカー用のキューに積む。
+    DB 書き込みとは別の接続を使う。途中で例外が起きたら errors に入れて終わる（呼び出し側で中断扱いにする）。
+    """
+    conn = connect(cfg.db_conf)
+    cursor = conn.cursor()
+    try:
+        while True:
+            with metrics.stage("claim"):
+                jobs = claim_jobs(conn, cursor, cfg.ollama_model, cfg.llm_queue_size)
+            if not jobs:
+                break
+            grouped = {}
+            for id_druginformation, yj_code, chunk_index, n_chunks, chunk_hash in jobs:
+                key = (chunk_hash, chunk_index, n_chunks) if cfg.llm_dedup else (id_druginformation, chunk_index)
+                group = grouped.setdefault(key, {"chunk_hash": chunk_hash, "n_chunks": n_chunks, "members": []})
+                group["members"].append((id_druginformation, yj_code, chunk_index))
+            for group in grouped.values():
+                members = group["members"]
+                _, yj_code, part_idx = members[0]
+                chunk = chunk_texts.get(group["chunk_hash"])
+                if chunk is None:
+                    # 他プロセスが新しい本文で登録し直したジョブ。このプロセスの計画には無いので failed にしておく
+                    set_job_status(cursor, cfg.ollama_model, [(i, c) for i, _, c in members], "failed",
+                                   error="chunk text not found", fail_kind="missing")
+                    conn.commit()
+                    log_file.write(f"[{yj_code}] chunk {part_idx+1}: 本文が見つからないため failed にしました\n")
+                    continue
+                with metrics.stage("prompt_build"):
+                    prompt = build_prompt(chunk, part_idx, group["n_chunks"], cfg.prompt_layout)
+                tasks.put((members, yj_code, part_idx, group["n_chunks"], chunk, prompt))
+    except Exception as e:
+        errors.append(e)
+        log_file.write(f"--- ジョブの取り出しに失敗しました ---\n{e}\n")
+    finally:
+        for _ in range(n_workers):
+            tasks.put(None)
+        cursor.close()
+        conn.close()
+
+def query_backends(cfg, metrics, pool, prompt, parse_log):
+    """空いているサーバーに問い合わせ、接続エラー・タイムアウトなら別のサーバーで問い合わせ直す"""
+    tried = []
+    raw, stats, items = "使用できる Ollama サーバーがありません", {"error": "no backend"}, None
+    while True:
+        with metrics.stage("backend_wait"):
+            backend = pool.acquire(exclude=tried)
+        if backend is None:
+            return raw, stats, items
+        start = time.time()
+        raw, stats, items = call_ollama(cfg, prompt, cfg.prompt_layout, url=backend.url)
+        end = time.time()
+        pool.release(backend, start, end, stats)
+        metrics.record("llm", end - start)
+        stats["backend"] = backend.name
+        if not stats.get("network_error"):
+            return raw, stats, items
+        metrics.count("retries")
+        tried.append(backend)
+        parse_log.write(f"--- {backend.name} に接続できませんでした（{stats['error']}）---\n")
+
+def llm_worker(cfg, metrics, tasks, results, throttle, cache, pool):
+    """
+    キューからプロンプトを取り出して Ollama に問い合わせ（キャッシュがあればそれを使い）、パースまで済ませて結果キューに積む。
+    タスクの処理中に例外が起きたら、そのチャンクは応答なし（failed）の結果にして次のタスクに進む。
+    終了の印（None）は例外で抜けた場合も必ず積む（積まないと run_extraction が待ち続ける）。
+    """
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            members, yj_code, part_idx, n_chunks, _, prompt = task
+            start = time.time()
+            try:
+                result = process_task(cfg, metrics, task, throttle, cache, pool)
+            except Exception as e:
+                metrics.count("worker_errors")
+                error = f"{type(e).__name__}: {e}"
+                result = (members, yj_code, part_idx, n_chunks, prompt, None,
+                          f"--- LLMワーカーで例外 ---\n{traceback.format_exc()}", time.time() - start,
+                          {"worker_error": error})
+            results.put(result)
+    finally:
+        results.put(None)
+
+def process_task(cfg, metrics, task, throttle, cache, pool):
+    """llm_worker の1タスク分。結果キューに積むタプルを返す"""
+    members, yj_code, part_idx, n_chunks, chunk, prompt = task
+    parse_log = io.StringIO()
+    start = time.time()
+    stats = {}
+    with metrics.stage("cache"):
+        response = cache.get(chunk)
+    if response is not None:
+        metrics.count("cache_hits")
+        parse_log.write("--- LLMキャッシュ使用 ---\n")
+        try:
+            response, _ = validate_entries(response)
+        except ValueError:
+            response = None
+    else:
+        with metrics.stage("throttle"):
+            throttle.wait()
+        print(f"[{yj_code}] (chunk {part_idx+1}/{n_chunks}) ollama({cfg.ollama_model})問い合わせ中...")
+        start = time.time()
+        raw, stats, items = query_backends(cfg, metrics, pool, prompt, parse_log)
+        throttle.record(start, time.time(), stats.get("eval_count", stats.get("stream_tokens", 0)))
+        if items is not None:
+            parse_log.write("--- ストリーム応答本文 ---\n" + raw + "\n")
+        if stats.get("item_errors"):
+            items = None
+        with metrics.stage("parse"):
+            response, stats["parse"] = parse_response(raw, items, parse_log, cfg.use_format())
+        if "eval_count" in stats or "stream_tokens" in stats:
+            metrics.observe("eval_tokens", stats.get("eval_count", stats.get("stream_tokens", 0)))
+        if stats["parse"] == "stream":
+            parse_log.write(f"✓ ストリームで {len(response)} 件パース{'（] で打ち切り）' if stats.get('aborted') else ''}\n")
+        if response is not None:
+            cache.put(chunk, response)
+    elapsed = time.time() - start
+
+    return members, yj_code, part_idx, n_chunks, prompt, response, parse_log.getvalue(), elapsed, stats
+
+def run_extraction(cfg, metrics, conn, cursor, rows, log_file, cache):
+    """
+    重複本文のグループ化とジョブ登録 → ジョブの claim・チャンク生成（1スレッド）→ LLM 問い合わせ（各サーバーの同時実行数の合計スレッド）
+    → DB 書き込み（このスレッド）のパイプラインで rows を処理する。各段の間は有界キューでつなぐ。
+    処理したチャンク数・書き込み件数・DB 書き込み時間・パース結果の内訳などを dict で返す。
+    """
+    from tqdm import tqdm
+    with metrics.stage("plan"):
+        plan = plan_groups(cfg, rows)
+    n_chunks_total = sum(len(g["chunks"]) for g in plan)
+    ratio = len(plan) / len(rows) * 100 if rows else 0.0
+    print(f"相互作用セクション {len(rows)} 件 → 異なる文面 {len(plan)} 件（{ratio:.1f}%）/ チャンク {n_chunks_total} 件")
+    log_file.write(f"[{datetime.now()}] rows={len(rows)} distinct={len(plan)} chunks={n_chunks_total}\n")
+    print(chunk_stats(cfg, plan))
+    log_file.write(chunk_stats(cfg, plan) + "\n")
+
+    model = cfg.ollama_model
+    with metrics.stage("sync_jobs"):
+        sync_jobs(conn, cursor, plan, model)
+    chunk_texts = {ResponseCache.chunk_hash(chunk): chunk for group in plan for chunk in group["chunks"]}
+    cursor.execute("SELECT count(*) FROM drug_interaction_job WHERE model = %s AND status = 'pending'", (model,))
+    n_pending = cursor.fetchone()[0]
+    conn.commit()
+    print(f"ジョブ: {job_summary(cursor, model)}")
+
+    tasks = queue.Queue(maxsize=cfg.llm_queue_size)
+    results = queue.Queue(maxsize=cfg.llm_queue_size)
+    throttle = build_throttle(cfg)
+    latency = LatencyStats(cfg.prompt_layout, model)
+    started = time.time()
+
+    n_workers = cfg.n_llm_workers
+    pool = BackendPool(cfg.ollama_backends, cfg.backend_retry_seconds)
+    pool.check_health()
+    producer_errors = []
+    threading.Thread(target=produce_tasks, args=(cfg, metrics, chunk_texts, tasks, n_workers, log_file, producer_errors),
+                     daemon=True).start()
+    for _ in range(n_workers):
+        threading.Thread(target=llm_worker, args=(cfg, metrics, tasks, results, throttle, cache, pool), daemon=True).start()
+
+    writer = InteractionWriter(conn, log_file, model, metrics, batch_chunks=cfg.insert_batch_chunks,
+                               flush_seconds=cfg.insert_flush_seconds, merge_mode=cfg.merge_mode, report=tqdm.write)
+    finished_workers = 0
+    idx = 0
+    n_results = 0
+    try:
+        with tqdm(total=n_pending, desc="LLM処理中", unit="chunk", disable=None) as pbar:
+            while finished_workers < n_workers:
+                try:
+                    result = results.get(timeout=cfg.insert_flush_seconds)
+                except queue.Empty:
+                    result = False
+                if writer.due():
+                    writer.flush()
+                if result is False:
+                    continue
+                if result is None:
+                    finished_workers += 1
+                    continue
+                members, yj_code, part_idx, n_chunks, prompt, response, parse_log, elapsed, stats = result
+                n_results += 1
+                if "worker_error" not in stats:
+                    latency.add(stats)
+                shared = f" (+同一文面 {len(members)-1}件)" if len(members) > 1 else ""
+
+                # ログにプロンプトを書き込む
+                log_file.write("======================================================================================\n")
+                log_file.write(f"\n[{datetime.now()}]\n[{yj_code}]{shared} (chunk {part_idx+1})\n--- Prompt(model:{model}) ---\n{prompt}\n")
+                log_file.write(parse_log)
+                log_file.write(f"--- Response (model: {model})---\n{response}\n")
+                log_file.write(f"[{datetime.now()}] response time: {elapsed:.2f} sec{latency.describe(stats)}\n")
+                print(f"[Response](model: {model})\n{response}...\n---")
+                print(f"[{datetime.now()}] response time: {elapsed:.2f} sec{latency.describe(stats)}\n")
+
+                if response is None:
+                    if "worker_error" in stats:
+                        writer.add_failure(members, elapsed, stats["worker_error"], "worker")
+                    elif stats.get("error"):
+                        writer.add_failure(members, elapsed, stats["error"], "llm")
+                    else:
+                        writer.add_failure(members, elapsed, "JSON parse error", "parse")
+                    log_file.write(f"--- JSON Parse Error (chunk {part_idx+1}) ---\n{response}\n")
+                    print(f"--- JSON Parse Error (chunk {part_idx+1}) ---\n{response}\n")
+                else:
+                    inserted_number = writer.add(members, response, elapsed)
+                    if inserted_number > 0:
+                        print(f"SQL{inserted_number}件登録予定{shared}\n")
+                pbar.update(len(members))
+
+                # 休止方針に処理済みの薬剤数を伝える（最終チャンクまで処理した薬剤の数で数える）
+                if part_idx == n_chunks - 1:
+                    idx += len(members)
+                    for message in throttle.drugs_done(idx):
+                        print(f"\n--- {message} ---\n")
+                        log_file.write(f"\n--- {message} ---\n")
+    finally:
+        writer.close()
+    if producer_errors:
+        raise RuntimeError(f"ジョブの取り出しに失敗しました: {producer_errors[0]}") from producer_errors[0]
+    if cfg.merge_mode == "bulk":
+        with metrics.stage("merge"):
+            writer.merged += merge_duplicates(conn, cursor, model)
+    metrics.count("rows", len(rows))
+    metrics.count("chunks", n_results)
+    metrics.count("rows_written", writer.written)
+    metrics.count("failures", writer.failed)
+    metrics.count("parse_failures", latency.parse.get("failed", 0))
+    print(f"drug_interaction: {writer.written}件登録 / 失敗 {writer.failed}件 / 重複統合 {writer.merged}件 / {writer.n_flush}トランザクション")
+    log_file.write(f"drug_interaction: written={writer.written} failed={writer.failed} merged={writer.merged} flushes={writer.n_flush}\n")
+    print(throttle.summary(time.time() - started))
+    print(pool.summary(time.time() - started))
+    log_file.write(pool.summary(time.time() - started) + "\n")
+    if latency.n:
+        print(latency.summary())
+        log_file.write(latency.summary() + "\n")
+    log_file.write(throttle.summary(time.time() - started) + "\n")
+    return {"elapsed": time.time() - started, "tasks": n_results, "chunks": n_pending,
+            "written": writer.written, "failed": writer.failed, "merged": writer.merged,
+            "flushes": writer.n_flush, "db_seconds": writer.db_seconds,
+            "llm_responses": latency.n, "parse": dict(latency.parse)}
+
+def prompt_bench(cfg, rows, n):
+    """
+    先頭 n チャンクを legacy / prefix / system の各レイアウトで順に問い合わせ、
+    Ollama が返す prompt_eval_count・prompt_eval_duration の平均を比べる（DB には書かない）。
+    """
+    chunks = [(chunk, i, len(g["chunks"])) for g in plan_groups(cfg, rows) for i, chunk in enumerate(g["chunks"])][:n]
+    print(f"{len(chunks)} チャンクで比較します（model: {cfg.ollama_model}）")
+    for layout in ("legacy", "prefix", "system"):
+        measured = []
+        for chunk, part_idx, n_chunks in chunks:
+            _, stats, _ = call_ollama(cfg, build_prompt(chunk, part_idx, n_chunks, layout), layout, stream=False)
+            if "prompt_eval_duration" in stats:
+                measured.append((stats.get("prompt_eval_count", 0), stats["prompt_eval_duration"] / 1e6))
+        if not measured:
+            print(f"  {layout:7}: prompt_eval_duration が返りませんでした")
+            continue
+        warm = measured[1:] or measured
+        print(f"  {layout:7}: 平均 {sum(c for c, _ in measured) / len(measured):6.0f} tokens / "
+              f"{sum(d for _, d in measured) / len(measured):8.1f} ms（2件目以降 {sum(d for _, d in warm) / len(warm):8.1f} ms）")
+
+def add_arguments(ap):
+    ap.add_argument("--yes", "-y", action="store_true",
+                    help="確認せずに実行する（cron などの無人実行用。--drop / --restart が無ければ前回の続きから）")
+    ap.add_argument("--drop", action="store_true", help="確認せずに drug_interaction とジョブを削除して作り直す")
+    ap.add_argument("--restart", action="store_true", help="確認せずに全ジョブを pending に戻して先頭から処理する")
+    ap.add_argument("--no-cache", action="store_true", help="LLM 応答キャッシュを使わない")
+    ap.add_argument("--cache-evict", action="store_true",
+                    help="キャッシュを削除して終了（--cache-model / --cache-template / --cache-layout で対象を絞る）")
+    ap.add_argument("--cache-model", help="--cache-evict の対象モデル名")
+    ap.add_argument("--cache-template", type=int, help="--cache-evict の対象プロンプト版")
+    ap.add_argument("--cache-layout", choices=("prefix", "system", "legacy"), help="--cache-evict の対象レイアウト")
+    ap.add_argument("--retry-failed", action="store_true", help="failed のジョブを pending に戻して再実行する")
+    ap.add_argument("--status", action="store_true", help="ジョブの状態別件数を表示して終了")
+    ap.add_argument("--prompt-bench", type=int, metavar="N",
+                    help="先頭 N チャンクでプロンプトのレイアウトごとの prompt_eval_duration を比較して終了")
+    ap.add_argument("--merge", action="store_true", help="drug_interaction 全体の重複行を SQL で一括統合して終了")
+    ap.add_argument("--chunk-stats", action="store_true",
+                    help="LLM に投げずに、現在の設定でのチャンク分割の統計を表示して終了（chars と tokens の比較）")
+
+def main(args):
+    config = config_file.load(args.config)
+    cfg = Settings(config)
+    model = cfg.ollama_model
+
+    if args.cache_evict:
+        cache = ResponseCache(cfg.llm_cache_file, model, template_version(cfg.prompt_layout), cfg.prompt_layout)
+        n = cache.evict(model=args.cache_model, template_version=args.cache_template, layout=args.cache_layout)
+        cache.close()
+        print(f"LLMキャッシュを {n} 件削除しました。")
+        return 0
+
+    if args.status:
+        conn = connect(cfg.db_conf)
+        cursor = conn.cursor()
+        create_job_table(cursor)
+        conn.commit()
+        print(f"ジョブ（model: {model}）: {job_summary(cursor, model)}")
+        # fail_kind が無かった頃の failed は error の文言で見分ける
+        cursor.execute("""
+            SELECT model, count(*) FILTER (WHERE status = 'failed'
+                                             AND coalesce(fail_kind, CASE WHEN error = 'JSON parse error' THEN 'parse' END) = 'parse'),
+                   count(*) FILTER (WHERE status = 'failed'), count(*) FILTER (WHERE status IN ('done', 'failed'))
+            FROM drug_interaction_job GROUP BY model ORDER BY model
+        """)
+        for model, n_parse, n_failed, n_finished in cursor.fetchall():
+            rate = n_parse / n_finished * 100 if n_finished else 0.0
+            print(f"  {model}: パース失敗 {n_parse} / {n_finished} チャンク（{rate:.1f}%）"
+                  f" / その他の失敗 {n_failed - n_parse} チャンク（LLM エラー・ワーカー例外など）")
+        conn.close()
+        return 0
+
+    if args.prompt_bench:
+        conn = connect(cfg.db_conf)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id_druginformation, yj_code, content FROM drug_filedata WHERE section_key = 'interactions' ORDER BY id_druginformation")
+        rows = cursor.fetchall()
+        conn.close()
+        prompt_bench(cfg, rows, args.prompt_bench)
+        return 0
+
+    if args.merge:
+        conn = connect(cfg.db_conf)
+        cursor = conn.cursor()
+        create_interaction_table(cursor)
+        create_job_table(cursor)
+        conn.commit()
+        cursor.execute("SELECT count(*) FROM drug_interaction WHERE AImodel = %s", (model,))
+        before = cursor.fetchone()[0]
+        merged = merge_duplicates(conn, cursor, model)
+        print(f"drug_interaction（model: {model}）: {before} 行中 {merged} 行を統合しました。")
+        conn.close()
+        return 0
+
+    if args.chunk_stats:
+        conn = connect(cfg.db_conf)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id_druginformation, yj_code, content FROM drug_filedata WHERE section_key = 'interactions'")
+        rows = cursor.fetchall()
+        conn.close()
+        for chunk_mode in ("chars", "tokens"):
+            mode_cfg = copy.copy(cfg)
+            mode_cfg.chunk_mode = chunk_mode
+            print(chunk_stats(mode_cfg, plan_groups(mode_cfg, rows)))
+        return 0
+
+    # --- ユーザー確認 ---
+    if not confirm(f"併用情報からデータの抽出を行います。LLMを使うのでかなりの時間がかかりますが、よろしいですか？ (y/n): ", args.yes):
+        print("中止しました。")
+        return 1
+
+    # --- DB接続 ---
+    conn = connect(cfg.db_conf)
+    cursor = conn.cursor()
+
+    # --- DROP確認プロンプト ---
+    if args.drop or (not args.yes and confirm("既存の drug_interaction テーブルを削除して作り直しますか？ (Y/n): ")):
+        print("テーブルを削除して作り直します。")
+        create_interaction_table(cursor, drop=True)
+        create_job_table(cursor, drop=True)
+        conn.commit()
+        print("テーブルを作成しました。")
+    else:
+        print("テーブル削除・再作成をスキップしました。")
+        # 初回実行（テーブルが無い DB）でもそのまま抽出できるよう、無ければ作る
+        create_interaction_table(cursor)
+        create_job_table(cursor)
+        conn.commit()
+        # --- 処理再開の確認（完了済みチャンクはジョブテーブルで判定する） ---
+        restart = args.restart or (not args.yes and not confirm("前回の中断部位から再開しますか？ n:先頭から(Y/n): ", default="y"))
+        if not restart:
+            n = reset_jobs(conn, cursor, model, ["running"], older_than=cfg.job_stale_seconds)
+            if n:
+                print(f"{cfg.job_stale_seconds}秒以上 running のままのジョブ {n} 件を pending に戻しました。")
+            if args.retry_failed:
+                print(f"failed のジョブ {reset_jobs(conn, cursor, model, ['failed'])} 件を再実行します。")
+            print("完了済みのチャンクを飛ばして再開します。")
+        else:
+            reset_jobs(conn, cursor, model, ["pending", "running", "done", "failed"])
+            print("最初から処理を開始します。")
+
+    log_file = open("interaction_debug.log", "a", encoding="utf-8")
+
+    # 相互作用データの取得
+    # cursor.execute("SELECT yj_code, content FROM drug_filedata WHERE section_key = 'interactions' LIMIT 100000 OFFSET 1000")
+    cursor.execute("""
+        SELECT id_druginformation, yj_code, content
+        FROM drug_filedata
+        WHERE section_key = 'interactions'
+        ORDER BY id_druginformation
+    """)
+    rows = cursor.fetchall()
+
+    # メイン処理
+    cache = ResponseCache(cfg.llm_cache_file, model, template_version(cfg.prompt_layout), cfg.prompt_layout,
+                          enabled=cfg.llm_cache_enabled and not args.no_cache)
+    # 処理段階ごとの所要時間（プロンプト生成・LLM・パース・DB書き込みなど）と件数
+    metrics = Metrics("12InteractionLLM", config)
+    status = 0
+    try:
+        run_extraction(cfg, metrics, conn, cursor, rows, log_file, cache)
+    except Exception as e:
+        # pipeline が後続の段に進まないよう、終了コードで失敗を返す
+        print(f"抽出を中断しました: {e}")
+        log_file.write(f"[{datetime.now()}] 抽出を中断しました: {e}\n")
+        status = 1
+    finally:
+        # 中断時はこのプロセスが claim したままのジョブを他プロセス・次回起動で拾えるよう戻す
+        conn.rollback()
+        cursor.execute("UPDATE drug_interaction_job SET status = 'pending' WHERE worker = %s AND status = 'running'",
+                       (worker_name,))
+        conn.commit()
+        # 中断した場合も、そこまでの計測結果を書き出す
+        metrics.finish()
+    print(f"ジョブ: {job_summary(cursor, model)}")
+    log_file.write(f"ジョブ: {job_summary(cursor, model)}\n")
+    if cache.enabled:
+        print(cache.summary())
+        log_file.write(cache.summary() + "\n")
+    cache.close()
+
+    # 後処理
+    #conn.commit()
+    cursor.close()
+    conn.close()
+    log_file.close()
+    return status
@@ -0,0 +1,380 @@
+# RSBase の drug_RSB.dat を PostgreSQL の drug_RSB テーブルに読み込む（python -m druginfo load）
+
+import csv
+import io
+import re
+import time
+
+from . import config as config_file
+from .cli import confirm
+from .db import connect
+from .metrics import Metrics
+
+# 読み込みモード: "copy"（COPY→ステージング→一括マージ） / "delta"（差分のみ反映＋changelog記録）
+#                 / "row"（従来の1行ずつINSERT）
+LOAD_MODES = ("copy", "delta", "row")
+
+# drug_RSB の列定義（列名, VARCHAR長 / None=長さ制限なし）
+RSB_COLUMNS = [
+    ("drug_name", 128),
+    ("price", None),
+    ("manufacturer", 128),
+    ("generic_name", 128),
+    ("unit", 32),
+    ("generic", 8),
+    ("info_html", None),
+    ("concomitant", None),
+    ("yj_code", 16),
+    ("kana_name", 128),
+]
+RSB_COLUMN_NAMES = [name for name, _ in RSB_COLUMNS]
+
+# price として PostgreSQL の NUMERIC が受け付ける書式（Decimal は "1_000" や全角数字も通すので使わない）
+PRICE_PATTERN = re.compile(r"[+-]?([0-9]+(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]+)?")
+
+def read_rsb_rows(path):
+    """drug_RSB.dat を読み、(行番号, 列リスト) を順に返す（タブ→スペース）"""
+    with open(path, "r", encoding="euc_jp", errors="replace") as f:
+        reader = csv.reader(f)
+        for i, row in enumerate(reader, start=1):
+            yield i, [col.replace("\t", " ") for col in row]
+
+def validate_row(row):
+    """COPY 前に1行を検査し、エラー内容（問題なければ None）を返す"""
+    if len(row) != 10:
+        return f"列数エラー ({len(row)}列)"
+    for (name, max_len), value in zip(RSB_COLUMNS, row):
+        if max_len is not None and len(value) > max_len:
+            return f"{name} が長すぎます ({len(value)} > {max_len})"
+    if not row[8]:
+        return "yj_code が空です"
+    if not PRICE_PATTERN.fullmatch(row[1]):
+        return f"price が数値ではありません: {row[1]!r}"
+    if "\x00" in "".join(row):
+        return "NUL文字を含んでいます"
+    return None
+
+def _copy_escape(value):
+    """COPY text 形式用のエスケープ"""
+    return (value.replace("\\", "\\\\")
+                 .replace("\n", "\\n")
+                 .replace("\r", "\\r")
+                 .replace("\t", "\\t"))
+
+class CopyStream(io.TextIOBase):
+    """行ジェネレータを copy_expert に渡すための読み取り専用ストリーム（全件をメモリに載せない）"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buf = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            out, self._buf = self._buf, ""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+def copy_lines(rows, reject_f, stats):
+    """検査済みの行を COPY text 形式で返し、不正行は reject_f へ書き出す"""
+    for i, row in rows:
+        stats["read"] += 1
+        err = validate_row(row)
+        if err:
+            stats["rejected"] += 1
+            reject_f.write(f"[行 {i}] {err}: {row}\n")
+            continue
+        stats["copied"] += 1
+        yield "\t".join([str(i)] + [_copy_escape(col) for col in row]) + "\n"
+
+def row_hash_sql(alias):
+    """行内容のハッシュ式（drug_RSB とステージングで同じ式を使い、既存行の再計算にも使う）"""
+    return "md5(concat_ws(E'\\x1f', {}))".format(
+        ", ".join(f"{alias}.{name}" for name in RSB_COLUMN_NAMES))
+
+def copy_to_stage(cur, path, reject_path):
+    """drug_RSB.dat を COPY で一時テーブル drug_RSB_stage に流し込む"""
+    stats = {"read": 0, "copied": 0, "rejected": 0}
+    cur.execute("""
+        CREATE TEMP TABLE drug_RSB_stage (
+            line_no         INTEGER,
+            drug_name       TEXT,
+            price           NUMERIC,
+            manufacturer    TEXT,
+            generic_name    TEXT,
+            unit            TEXT,
+            generic         TEXT,
+            info_html       TEXT,
+            concomitant     TEXT,
+            yj_code         TEXT,
+            kana_name       TEXT
+        ) ON COMMIT DROP
+    """)
+    with open(reject_path, "w", encoding="utf-8") as reject_f:
+        stream = CopyStream(copy_lines(read_rsb_rows(path), reject_f, stats))
+        cur.copy_expert(
+            f"COPY drug_RSB_stage (line_no, {', '.join(RSB_COLUMN_NAMES)}) FROM STDIN",
+            stream, size=1 << 20)
+    return stats
+
+def bulk_load(conn, path, reject_path, metrics):
+    """COPY でステージングテーブルへ流し込み、1文で drug_RSB にマージする"""
+    started = time.time()
+    cur = conn.cursor()
+    with metrics.stage("copy"):
+        stats = copy_to_stage(cur, path, reject_path)
+
+    # ファイル内で yj_code が重複した場合は先に出現した行を採用（従来の DO NOTHING と同じ）
+    cols = ", ".join(RSB_COLUMN_NAMES)
+    with metrics.stage("merge"):
+        cur.execute(f"""
+            INSERT INTO drug_RSB ({cols}, row_hash)
+            SELECT DISTINCT ON (yj_code) {cols}, {row_hash_sql("s")}
+            FROM drug_RSB_stage s
+            ORDER BY yj_code, line_no
+            ON CONFLICT (yj_code) DO NOTHING
+        """)
+        stats["inserted"] = cur.rowcount
+        conn.commit()
+    cur.close()
+    stats["elapsed"] = time.time() - started
+    return stats
+
+def delta_load(conn, path, reject_path, metrics, delete_missing=False, max_delete_ratio=0.05):
+    """
+    ハッシュ比較で新規/変更/削除された yj_code だけを drug_RSB に反映し、drug_RSB_changelog に記録する
+    （rsb-sections --since で、記録された薬剤だけ modified_info を作り直せる）。
+    delete_missing: ファイルに無い yj_code を削除する。除外行があるとき、
+    削除件数が既存行の max_delete_ratio を超えるときは削除せず stats["delete_skipped"] に理由を入れる
+    """
+    started = time.time()
+    cur = conn.cursor()
+    with metrics.stage("copy"):
+        stats = copy_to_stage(cur, path, reject_path)
+    merge_started = time.perf_counter()
+    cols = ", ".join(RSB_COLUMN_NAMES)
+
+    cur.execute(f"""
+        CREATE TEMP TABLE drug_RSB_new ON COMMIT DROP AS
+        SELECT DISTINCT ON (yj_code) {cols}, {row_hash_sql("s")} AS row_hash
+        FROM drug_RSB_stage s
+        ORDER BY yj_code, line_no
+    """)
+    cur.execute("CREATE UNIQUE INDEX ON drug_RSB_new (yj_code)")
+    # ハッシュ未計算の既存行（通常モードで投入済み）を補完
+    cur.execute(f"UPDATE drug_RSB d SET row_hash = {row_hash_sql('d')} WHERE d.row_hash IS NULL")
+
+    changed_columns = "ARRAY_REMOVE(ARRAY[{}], NULL)".format(", ".join(
+        f"CASE WHEN n.{name} IS DISTINCT FROM d.{name} THEN '{name}' END"
+        for name in RSB_COLUMN_NAMES if name != "yj_code"))
+
+    # 変更内容を先に記録（更新前の値と比較するため）
+    cur.execute(f"""
+        INSERT INTO drug_RSB_changelog (yj_code, change_type, changed_columns, old_hash, new_hash)
+        SELECT n.yj_code, 'insert', NULL, NULL, n.row_hash
+        FROM drug_RSB_new n
+        WHERE NOT EXISTS (SELECT 1 FROM drug_RSB d WHERE d.yj_code = n.yj_code)
+        UNION ALL
+        SELECT n.yj_code, 'update', {changed_columns}, d.row_hash, n.row_hash
+        FROM drug_RSB_new n JOIN drug_RSB d ON d.yj_code = n.yj_code
+        WHERE d.row_hash <> n.row_hash
+    """)
+    # ファイルに無い yj_code を削除するのは、除外行が無く（途中で切れたファイルや読めなかった行の取りこぼしでない）、
+    # 削除件数が既存行の max_delete_ratio 以下のときだけ
+    stats["deleted"] = 0
+    stats["delete_skipped"] = None
+    if delete_missing:
+        cur.execute("""
+            SELECT count(*), count(*) FILTER (WHERE NOT EXISTS (SELECT 1 FROM drug_RSB_new n WHERE n.yj_code = d.yj_code))
+            FROM drug_RSB d
+        """)
+        n_existing, n_missing = cur.fetchone()
+        stats["missing"] = n_missing
+        if n_missing and stats["rejected"]:
+            stats["delete_skipped"] = f"除外行が {stats['rejected']} 行あるため"
+        elif n_missing and n_missing > n_existing * max_delete_ratio:
+            stats["delete_skipped"] = (f"既存 {n_existing} 件の {n_missing / n_existing:.1%} にあたり"
+                                       f" rsb_delta_max_delete_ratio（{max_delete_ratio:.1%}）を超えるため")
+    if delete_missing and not stats["delete_skipped"]:
+        cur.execute("""
+            INSERT INTO drug_RSB_changelog (yj_code, change_type, changed_columns, old_hash, new_hash)
+            SELECT d.yj_code, 'delete', NULL, d.row_hash, NULL
+            FROM drug_RSB d
+            WHERE NOT EXISTS (SELECT 1 FROM drug_RSB_new n WHERE n.yj_code = d.yj_code)
+        """)
+        cur.execute("""
+            DELETE FROM drug_RSB d
+            WHERE NOT EXISTS (SELECT 1 FROM drug_RSB_new n WHERE n.yj_code = d.yj_code)
+        """)
+        stats["deleted"] = cur.rowcount
+
+    cur.execute(f"""
+        UPDATE drug_RSB d SET
+            {", ".join(f"{name} = n.{name}" for name in RSB_COLUMN_NAMES if name != "yj_code")},
+            row_hash = n.row_hash
+        FROM drug_RSB_new n
+        WHERE d.yj_code = n.yj_code AND d.row_hash <> n.row_hash
+    """)
+    stats["updated"] = cur.rowcount
+    cur.execute(f"""
+        INSERT INTO drug_RSB ({cols}, row_hash)
+        SELECT {cols}, row_hash FROM drug_RSB_new
+        ON CONFLICT (yj_code) DO NOTHING
+    """)
+    stats["inserted"] = cur.rowcount
+    conn.commit()
+    metrics.record("merge", time.perf_counter() - merge_started)
+    cur.close()
+    stats["elapsed"] = time.time() - started
+    return stats
+
+def row_load(conn, path, metrics):
+    """従来方式: 1行ずつ INSERT & commit"""
+    cursor = conn.cursor()
+    for i, row in read_rsb_rows(path):
+        metrics.count("rows")
+        if len(row) != 10:
+            metrics.count("rejected")
+            print(f"[行 {i}] 列数エラー ({len(row)}列): {row}")
+            continue
+        started = time.perf_counter()
+        try:
+            cursor.execute("""
+                INSERT INTO drug_RSB (
+                    drug_name, price, manufacturer, generic_name, unit,
+                    generic, info_html, concomitant, yj_code, kana_name
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (yj_code) DO NOTHING
+            """, row)
+            conn.commit()
+            metrics.record("insert", time.perf_counter() - started)
+            print(f"[行 {i}] 成功: {row[0]}")
+        except Exception as e:
+            conn.rollback()
+            metrics.count("failures")
+            print(f"[行 {i}] エラー: {e}\nデータ: {row}")
+    cursor.close()
+
+def create_database(db_conf):
+    """PostgreSQL管理DBに接続して drug_info 作成"""
+    # 管理DB用設定を drug_info 設定から派生させる（dbnameだけ変更）
+    admin_conf = dict(db_conf, dbname="postgres")
+    admin_conn = connect(admin_conf)
+    admin_conn.autocommit = True
+    admin_cur = admin_conn.cursor()
+
+    admin_cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", ("drug_info",))
+    if not admin_cur.fetchone():
+        print("データベース 'drug_info' を作成します。")
+        admin_cur.execute("""
+            CREATE DATABASE drug_info
+            WITH ENCODING = 'UTF8' LC_COLLATE='C' LC_CTYPE='C' TEMPLATE=template0
+        """)
+    else:
+        print("データベース 'drug_info' はすでに存在します。")
+
+    admin_cur.close()
+    admin_conn.close()
+
+def create_tables(conn):
+    """テーブル作成（なければ）"""
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS drug_RSB (
+        drug_name       VARCHAR(128),
+        price           NUMERIC,
+        manufacturer    VARCHAR(128),
+        generic_name    VARCHAR(128),
+        unit            VARCHAR(32),
+        generic         VARCHAR(8),
+        info_html       TEXT,
+        concomitant     TEXT,
+        yj_code         VARCHAR(16) PRIMARY KEY,
+        kana_name       VARCHAR(128),
+        row_hash        CHAR(32)
+    )
+    """)
+    # 旧バージョンで作成済みのテーブルにもハッシュ列を追加
+    cursor.execute("ALTER TABLE drug_RSB ADD COLUMN IF NOT EXISTS row_hash CHAR(32)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS drug_RSB_changelog (
+        id              SERIAL PRIMARY KEY,
+        yj_code         VARCHAR(16),
+        change_type     VARCHAR(8),
+        changed_columns TEXT[],
+        old_hash        CHAR(32),
+        new_hash        CHAR(32),
+        changed_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS drug_RSB_changelog_changed_at ON drug_RSB_changelog (changed_at)")
+    conn.commit()
+    cursor.close()
+
+def add_arguments(ap):
+    ap.add_argument("--yes", "-y", action="store_true", help="確認せずに読み込む（cron などの無人実行用）")
+    ap.add_argument("--file", help="読み込むファイル（既定は config.json の rsb_file、なければ drug_RSB.dat）")
+    ap.add_argument("--mode", choices=LOAD_MODES, help="読み込みモード（既定は config.json の rsb_load_mode、なければ copy）")
+
+def main(args):
+    # 設定ファイル読み込み
+    config = config_file.load(args.config)
+    db_conf = config.get("db", {})
+    path = args.file or config.get("rsb_file", "drug_RSB.dat")
+    mode = args.mode or config.get("rsb_load_mode", "copy")
+    delta_delete = bool(config.get("rsb_delta_delete", False))  # delta: ファイルから消えた yj_code を削除
+    max_delete_ratio = float(config.get("rsb_delta_max_delete_ratio", 0.05))  # 1回で削除してよい割合の上限
+    reject_path = config.get("rsb_reject_file", "01drugRSB_rejected.log")
+    if mode not in LOAD_MODES:
+        print(f"rsb_load_mode が不正です: {mode}")
+        return 1
+
+    create_database(db_conf)
+
+    # drug_info に接続
+    conn = connect(db_conf)
+    create_tables(conn)
+
+    # ユーザー確認
+    if not confirm(f"\n'{path}' のデータをSQLサーバーにアップロードしますか？ [Y/n]: ", args.yes, default="y"):
+        print("アップロード処理を中止しました。")
+        conn.close()
+        return 1
+
+    # データ読み込み & 登録
+    metrics = Metrics("01drugRSB2SQL", config)
+    if mode == "row":
+        row_load(conn, path, metrics)
+    else:
+        if mode == "delta":
+            stats = delta_load(conn, path, reject_path, metrics, delete_missing=delta_delete,
+                               max_delete_ratio=max_delete_ratio)
+        else:
+            stats = bulk_load(conn, path, reject_path, metrics)
+        rate = stats["read"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+        print(f"読込 {stats['read']} 行 / COPY {stats['copied']} 行 / 新規登録 {stats['inserted']} 件 / "
+              f"除外 {stats['rejected']} 行（{reject_path}）")
+        if mode == "delta":
+            print(f"変更 {stats['updated']} 件 / 削除 {stats['deleted']} 件（drug_RSB_changelog に記録）")
+            if stats["delete_skipped"]:
+                print(f"警告: ファイルに無い {stats['missing']} 件の削除を見送りました（{stats['delete_skipped']}）。"
+                      f"ファイルを確認してください。")
+        print(f"所要時間 {stats['elapsed']:.2f} 秒（{rate:,.0f} 行/秒）")
+        for key in ("read", "rejected", "inserted", "updated", "deleted"):
+            if key in stats:
+                metrics.count("rows" if key == "read" else key, stats[key])
+
+    conn.close()
+    metrics.finish()
+    return 0
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# 01〜12 の各スクリプト共通の計測（処理段階ごとの所要時間・件数カウンタ・ヒストグラム）
+#   metrics = Metrics("12InteractionLLM", config)   # ファイル名は元のスクリプト名のまま
+#   with metrics.stage("llm"): ...        # 所要時間をヒストグラムに記録
+#   metrics.record("read", seconds)       # 別プロセスなどで測った時間を記録
+#   metrics.count("chunks")               # カウンタ
+#   metrics.observe("eval_tokens", n)     # 任意の値のヒストグラム
+#   metrics.finish()                      # 集計表を表示し、config の metrics_format で書き出す
+# config.json:
+#   "metrics_format": json（既定）/ prometheus / both / off
+#   "metrics_dir": 書き出し先フォルダ（既定 "."）。<スクリプト名>.metrics.json / <スクリプト名>.prom
+# prometheus 形式は node_exporter の textfile collector でそのまま読める（一時ファイルに書いてから置き換える）。
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 所要時間（秒）のバケット。1ファイルの分割（ミリ秒）から LLM 1回（数十秒）までを想定
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 件数・トークン数などのバケット
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+METRIC_PREFIX = "druginfo"
+METRICS_FORMATS = ("json", "prometheus", "both", "off")
+
+class Histogram:
+    """累積しないバケット件数と合計・最小・最大を持つ（書き出し時に累積する）"""
+
+    def __init__(self, buckets):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)   # 最後は +Inf
+        self.n = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self):
+        """[(上限の表記, 累積件数), ...]（Prometheus の le と同じ）"""
+        out, acc = [], 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            acc += count
+            out.append(("+Inf" if bound == float("inf") else f"{bound:g}", acc))
+        return out
+
+    def quantile(self, q):
+        """バケットから求めた q 分位点の上限（正確な値ではなく、どのバケットに入るかの目安）"""
+        if not self.n:
+            return 0.0
+        target = q * self.n
+        for (_, acc), bound in zip(self.cumulative(), self.bounds + (self.max,)):
+            if acc >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.n, "sum": self.total, "mean": self.total / self.n if self.n else 0.0,
+                "min": self.min, "max": self.max, "buckets": dict(self.cumulative())}
+
+class Metrics:
+    """
+    1回の実行分の計測値。複数スレッドから使える（12 の LLM ワーカーなど）。
+    別プロセス（11 の --workers）で測った時間は、結果と一緒に親へ返して record() で足す。
+    """
+
+    def __init__(self, script, config=None):
+        self.script = script
+        self.lock = threading.Lock()
+        self.stages = {}       # 段階名 -> Histogram（秒）
+        self.counters = {}
+        self.histograms = {}   # 名前 -> Histogram
+        self.started = time.time()
+        self.format = "json"
+        self.folder = "."
+        if config is not None:
+            self.configure(config)
+
+    def configure(self, config):
+        self.format = config.get("metrics_format", "json")
+        if self.format not in METRICS_FORMATS:
+            print(f"metrics_format が不正です（{self.format}）。json で書き出します。")
+            self.format = "json"
+        self.folder = config.get("metrics_dir", ".")
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self.lock:
+            hist = self.stages.get(name)
+            if hist is None:
+                hist = self.stages[name] = Histogram(TIME_BUCKETS)
+            hist.add(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value, buckets=SIZE_BUCKETS):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram(buckets)
+            hist.add(value)
+
+    def summary(self):
+        """段階ごとの回数・合計・平均・最大と、実行時間に占める割合の表"""
+        elapsed = time.time() - self.started
+        with self.lock:
+            lines = [f"計測（{self.script}）: 実行時間 {elapsed:.1f} 秒"]
+            for name, h in sorted(self.stages.items(), key=lambda kv: -kv[1].total):
+                share = h.total / elapsed * 100 if elapsed else 0.0
+                lines.append(f"  {name:18} {h.n:8} 回 / 合計 {h.total:9.2f} 秒（{share:5.1f}%）"
+                             f" / 平均 {h.total / h.n * 1000:9.2f} ms / p95 ≦{h.quantile(0.95) * 1000:9.1f} ms"
+                             f" / 最大 {h.max * 1000:9.1f} ms")
+            if self.counters:
+                lines.append("  " + " / ".join(f"{k} {v}" for k, v in self.counters.items()))
+            for name, h in self.histograms.items():
+                lines.append(f"  {name}: {h.n} 件 / 平均 {h.total / h.n:.1f} / 最大 {h.max:g}")
+        return "\n".join(lines)
+
+    def as_dict(self):
+        finished = time.time()
+        with self.lock:
+            return {
+                "script": self.script,
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "finished": datetime.fromtimestamp(finished).isoformat(timespec="seconds"),
+                "elapsed_s": finished - self.started,
+                "stages": {name: h.as_dict() for name, h in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: h.as_dict() for name, h in self.histograms.items()},
+            }
+
+    def prometheus(self):
+        """Prometheus のテキスト形式"""
+        data = self.as_dict()
+        job = f'script="{self.script}"'
+        out = [f"# HELP {METRIC_PREFIX}_stage_seconds 処理段階ごとの所要時間",
+               f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+        for name, h in data["stages"].items():
+            out += _histogram_lines(f"{METRIC_PREFIX}_stage_seconds", f'{job},stage="{name}"', h)
+        out += [f"# HELP {METRIC_PREFIX}_items_total 処理件数",
+                f"# TYPE {METRIC_PREFIX}_items_total counter"]
+        out += [f'{METRIC_PREFIX}_items_total{{{job},name="{name}"}} {value}' for name, value in data["counters"].items()]
+        for name, h in data["histograms"].items():
+            metric = f"{METRIC_PREFIX}_{_metric_name(name)}"
+            out.append(f"# TYPE {metric} histogram")
+            out += _histogram_lines(metric, job, h)
+        out += [f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+                f"{METRIC_PREFIX}_run_seconds{{{job}}} {data['elapsed_s']:.3f}",
+                f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+                f"{METRIC_PREFIX}_last_run_timestamp_seconds{{{job}}} {time.time():.0f}"]
+        return "\n".join(out) + "\n"
+
+    def export(self):
+        """metrics_format に従って書き出し、書き出したファイルの一覧を返す"""
+        if self.format == "off":
+            return []
+        os.makedirs(self.folder, exist_ok=True)
+        written = []
+        if self.format in ("json", "both"):
+            path = os.path.join(self.folder, f"{self.script}.metrics.json")
+            _write_atomic(path, json.dumps(self.as_dict(), ensure_ascii=False, indent=2))
+            written.append(path)
+        if self.format in ("prometheus", "both"):
+            path = os.path.join(self.folder, f"{self.script}.prom")
+            _write_atomic(path, self.prometheus())
+            written.append(path)
+        return written
+
+    def finish(self, report=print):
+        """実行の最後に呼ぶ。集計表を表示して書き出す"""
+        report(self.summary())
+        try:
+            for path in self.export():
+                report(f"計測結果を {path} に書き出しました。")
+        except OSError as e:
+            report(f"計測結果の書き出しに失敗しました: {e}")
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+def _histogram_lines(metric, labels, h):
+    lines = [f'{metric}_bucket{{{labels},le="{le}"}} {count}' for le, count in h["buckets"].items()]
+    lines.append(f"{metric}_sum{{{labels}}} {h['sum']:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {h['count']}")
+    return lines
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,240 @@
+# drug_RSB の info_html を見出しで分割して modified_info テーブルに保存する（python -m druginfo rsb-sections）
+
+import re
+from bisect import bisect_left
+import time
+from datetime import datetime
+
+from . import config as config_file
+from .cli import confirm
+from .db import connect, execute_values
+from .metrics import Metrics
+
+known_sections = [
+    ("薬効、効果・効能、適応症", "efficacy"),
+    ("薬効備考", "efficacy_notes"),
+    ("用法及び用量", "dosage"),
+    ("用法及び用量に関連する注意", "dosage_notes"),
+    ("重要な基本的注意", "important_notes"),
+    ("特定の背景を有する患者に関する注意", "special_patient_notes"),
+    ("相互作用", "interactions"),
+    ("副作用", "side_effects"),
+    ("臨床検査結果に及ぼす影響", "lab_influence"),
+    ("過量投与", "overdose"),
+    ("適用上の注意", "application_notes"),
+    ("その他の注意", "other_notes"),
+    ("薬物動態", "pharmacokinetics"),
+    ("臨床成績", "clinical_results"),
+    ("薬効薬理", "pharmacodynamics"),
+    ("有効成分に関する理化学的知見", "compound_properties"),
+    ("取扱い上の注意", "handling_notes"),
+    ("承認条件", "approval_conditions"),
+    ("包装", "packaging"),
+    ("主要文献", "main_references"),
+    ("文献請求先及び問い合わせ先", "contact_info")
+]
+
+# --- HTML処理関数 ---
+def strip_html_tags(text):
+    return re.sub(r"<[^>]+>", "", text)
+
+def clean_text(text):
+    text = re.sub(r"\t|\r\n|\n", " ", text)
+    text = text.replace("\u3000", " ")
+    return re.sub(r"\s{2,}", " ", text).strip()
+
+def extract_efficacy(raw, result):
+    """【薬効】処理： <b>タグから efficacy / efficacy_notes を抽出して result に入れる"""
+#    print("\n--- 薬効抽出デバッグ ---")
+#    print(f"[raw全文]（前300文字）: {raw[:300]}")
+
+    efficacy_match = re.search(r"<b>【薬効】[:：]?(.*?)</b>", raw, re.DOTALL | re.IGNORECASE)
+    if efficacy_match:
+        efficacy = efficacy_match.group(1)
+#        print(f"[マッチ成功] efficacy: {efficacy}")
+
+        result["efficacy"] = clean_text(efficacy)
+
+        # efficacy_notes はそれ以降を対象に
+        after = raw[efficacy_match.end():]
+#        print(f"[afterテキスト]（前300文字）: {after[:300]}")
+
+        after_text = strip_html_tags(after)
+#        print(f"[HTML除去後のefficacy_notes]（前300文字）: {after_text[:300]}")
+
+        result["efficacy_notes"] = clean_text(after_text)
+    else:
+        print(f"[マッチ失敗] <b>【薬効】...<b> の形式が見つかりませんでした: {raw[:100]}")
+        result["efficacy"] = ""
+        result["efficacy_notes"] = ""
+
+# --- 見出し位置の一括検出 ---
+# 【薬効】系の2項目は <b> タグから取るので見出し検索の対象外
+HEADING_SKIP = ("薬効、効果・効能、適応症", "薬効備考")
+_heading_names = sorted({jp for jp, _ in known_sections if jp not in HEADING_SKIP}, key=len, reverse=True)
+_heading_body = r"\s*(?:[0-9]{1,2}\.\s*)?(" + "|".join(re.escape(n) for n in _heading_names) + ")"
+# 全見出しの出現位置を1回の走査で列挙（先読みなので同じ改行から始まる重なった候補も拾える）
+HEADING_FINDER = re.compile(r"(?=(?:\n|^)" + _heading_body + ")", re.IGNORECASE)
+# 位置を指定して「そこから見出しが始まるか」を判定する（旧実装の text[start+1:] に対する ^ 一致の再現用）
+HEADING_AT = re.compile(_heading_body, re.IGNORECASE)
+# 最長一致した見出し語 -> その位置で一致する全セクション番号（短い見出し語が長い見出し語の接頭辞になる場合がある）
+HEADING_INDEXES = {
+    name: tuple(j for j, (jp, _) in enumerate(known_sections)
+                if jp not in HEADING_SKIP and name.startswith(jp))
+    for name in _heading_names
+}
+HEADING_REMOVE = {jp: re.compile(re.escape(jp), re.IGNORECASE) for jp, _ in known_sections}
+
+def find_heading_positions(text):
+    """全見出し候補を [(位置, セクション番号), ...] の位置順リストで返す"""
+    positions = []
+    for m in HEADING_FINDER.finditer(text):
+        q = m.start()
+        positions.extend((q, j) for j in HEADING_INDEXES[m.group(1)])
+    return positions
+
+def extract_sections(html):
+    html = html.replace("<br>", "\n")
+    raw = html
+    text = strip_html_tags(html)
+    result = {}
+
+    extract_efficacy(raw, result)
+
+    # その他のセクション: 見出し位置を一度だけ求め、位置リストから切り出す
+    positions = find_heading_positions(text)
+    first = {}
+    for q, j in positions:
+        first.setdefault(j, q)
+    for j, (jp_section, en_col) in enumerate(known_sections):
+        start = first.get(j)
+        if start is None:
+            continue
+        end = len(text)
+        at = HEADING_AT.match(text, start + 1)
+        if at and any(k > j for k in HEADING_INDEXES[at.group(1)]):
+            end = start + 1
+        else:
+            for q, k in positions[bisect_left(positions, (start + 1, -1)):]:
+                if k > j:
+                    end = q
+                    break
+        content = HEADING_REMOVE[jp_section].sub("", text[start:end])
+        result[en_col] = clean_text(content)
+    return result
+
+# --- テーブル作成 ---
+def create_table(cursor):
+    cursor.execute("DROP TABLE IF EXISTS modified_info")
+    create_sql = """
+    CREATE TABLE modified_info (
+        yj_code VARCHAR(16) PRIMARY KEY,
+        {}
+    );
+    """.format(",\n        ".join([f"{col} TEXT" for _, col in known_sections]))
+    cursor.execute(create_sql)
+
+# --- データ読み込みと処理 ---
+SECTION_COLUMNS = [col for _, col in known_sections]
+
+def changed_since(cursor, since):
+    """drug_RSB_changelog で since 以降に新規・変更・削除された yj_code（load の delta モードで記録される）"""
+    cursor.execute("SELECT DISTINCT yj_code FROM drug_RSB_changelog WHERE changed_at >= %s", (since,))
+    return [r[0] for r in cursor.fetchall()]
+
+def iter_rsb_html(conn, fetch_size, metrics, yj_codes=None):
+    """
+    サーバーサイドカーソルで drug_RSB を fetch_size 件ずつ読み、(yj_code, info_html) を返す。
+    yj_codes を指定するとその yj_code だけを読む。
+    """
+    with conn.cursor(name="rsb_html_stream") as src:
+        src.itersize = fetch_size
+        if yj_codes is None:
+            src.execute("SELECT yj_code, info_html FROM drug_RSB")
+        else:
+            src.execute("SELECT yj_code, info_html FROM drug_RSB WHERE yj_code = ANY(%s)", (list(yj_codes),))
+        rows = iter(src)
+        while True:
+            started = time.perf_counter()
+            row = next(rows, None)
+            metrics.record("fetch", time.perf_counter() - started)
+            if row is None:
+                return
+            yield row
+
+def iter_section_rows(records, metrics):
+    """(yj_code, info_html) から modified_info の1行分（全セクション列、無い列は NULL）を生成"""
+    for yj_code, html in records:
+        with metrics.stage("extract"):
+            sections = extract_sections(html or "")
+        metrics.count("rows")
+        metrics.count("sections", len(sections))
+        yield (yj_code, *[sections.get(col) for col in SECTION_COLUMNS])
+
+def write_sections(cursor, rows, batch_size, metrics):
+    """batch_size 行ずつ execute_values で INSERT し、登録件数を返す"""
+    sql = (f"INSERT INTO modified_info (yj_code, {', '.join(SECTION_COLUMNS)}) VALUES %s "
+           "ON CONFLICT (yj_code) DO NOTHING")
+    total, batch = 0, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with metrics.stage("db_write"):
+                execute_values(cursor, sql, batch, page_size=batch_size)
+            total += len(batch)
+            batch = []
+    if batch:
+        with metrics.stage("db_write"):
+            execute_values(cursor, sql, batch, page_size=batch_size)
+        total += len(batch)
+    return total
+
+def add_arguments(ap):
+    ap.add_argument("--yes", "-y", action="store_true", help="確認せずに実行する（cron などの無人実行用）")
+    ap.add_argument("--since", type=datetime.fromisoformat, metavar="日時",
+                    help="modified_info を作り直さず、この日時（例 2025-06-01 や \"2025-06-01 03:00\"）以降に "
+                         "drug_RSB_changelog に記録された yj_code だけを処理する（load の delta モードで読み込んだとき）")
+
+def main(args):
+    # --- config.jsonの読み込み ---
+    config = config_file.load(args.config)
+    db_conf = config.get("db", {})
+    fetch_size = int(config.get("rsb_fetch_size", 200))   # サーバーサイドカーソルの1回の取得件数
+    batch_size = int(config.get("sections_batch_size", 500))  # execute_values の1バッチ行数
+
+    target = f"{args.since} 以降に変更された薬剤だけ" if args.since else "すべて"
+    if not confirm(f"⚠️ 読み込んだRSBデータ（{target}）を modified_info テーブルにセクション分割して保存します。よろしいですか？ (y/n): ", args.yes):
+        print("処理を中断しました。")
+        return 1
+
+    # 処理段階ごとの所要時間と件数
+    metrics = Metrics("02processDrugRSB2sections", config)
+    conn = connect(db_conf)
+    cursor = conn.cursor()
+    yj_codes = None
+    if args.since:
+        cursor.execute("SELECT to_regclass('modified_info'), to_regclass('drug_RSB_changelog')")
+        if None in cursor.fetchone():
+            print("modified_info か drug_RSB_changelog がありません。最初は --since なしで実行してください。")
+            conn.close()
+            return 1
+        yj_codes = changed_since(cursor, args.since)
+        # 変更・削除された薬剤の行を消してから入れ直す（削除された薬剤は drug_RSB に無いので消えたままになる）。
+        # 削除も再登録と同じトランザクションで行い、途中で失敗したら元の行が残るようにする
+        cursor.execute("DELETE FROM modified_info WHERE yj_code = ANY(%s)", (yj_codes,))
+        print(f"{args.since} 以降の変更: {len(yj_codes)} 件（modified_info から {cursor.rowcount} 件を削除して再処理）")
+    else:
+        create_table(cursor)
+        conn.commit()
+
+    # 読み出し（名前付きカーソル）と書き込みは同一トランザクション内で行い、最後に1回だけ commit
+    rows = iter_section_rows(iter_rsb_html(conn, fetch_size, metrics, yj_codes), metrics)
+    total = write_sections(cursor, rows, batch_size, metrics)
+
+    with metrics.stage("commit"):
+        conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"完了: {total} 件を modified_info に登録しました。")
+    metrics.finish()
+    return 0
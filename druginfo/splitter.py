@@ -0,0 +1,948 @@
+# -*- coding: utf-8 -*-
+# ルールベースで添付文書テキストをセクション分割して drug_filedata に投入
+# - EUC-JP固定読み込み（タブ→スペース）
+# - 各行に対し見出し語辞書でスコアリング→セクションごとの最良行をアンカーに採用
+# - 同一行で「効能／用法」が併記される場合はブロック内をヒューリスティックで二分
+#   -> 分割点が見つからない場合は、用法に効能本文を複製（空欄回避）
+# - 改行込みオフセットでCRLFズレ回避
+# - 進捗表示＆確認プロンプト、pause_every_n_files/gpu_cooling_wait対応
+# - --workers N で読み込み・スコアリング・切り出しをプロセス並列化（DB書き込みは親プロセスで順序通り）
+# - UPSERT（同一 yj_code, section_key は上書き）。upsert_batch_files ファイル分を1トランザクションで一括投入
+# - python -m druginfo split で実行（--yes / --drop で確認なし）。分割関数だけなら DB・tqdm なしで import できる
+# - 読み込み・デコード・スコアリング・切り出し・DB書き込みの所要時間を druginfo.metrics で記録
+
+import os
+import re
+import gzip
+import queue
+import shutil
+import threading
+import json
+import time
+import hashlib
+import functools
+import multiprocessing
+from datetime import datetime
+
+from . import config as config_file
+from .cli import confirm
+from .db import connect, execute_values
+from .metrics import Metrics
+
+# ===================== 設定 =====================
+MIN_HEADING_SCORE = 5.0  # 見出し採用の下限（config.json の min_heading_score の既定値）
+
+class Settings:
+    """
+    config.json の分割処理の設定。main() で読み、split_file() などに渡す。
+    --workers のワーカープロセスにもそのまま渡す（pickle できる値だけを持つ）。
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.db_conf = config.get("db", {})
+        self.source_dir = config.get("DI_folder") or "./drug_information"
+        self.workers = int(config.get("split_workers", 1))
+        self.min_heading_score = float(config.get("min_heading_score", MIN_HEADING_SCORE))
+        self.heading_log_path = config.get("heading_log_file", "11heading_detect.log")
+        log_candidates = bool(config.get("log_candidates", True))
+        # 見出しログ: off（出力なし） / anchors（採用アンカーのみ） / candidates（候補行も出力）
+        self.heading_log_level = config.get("heading_log_level", "candidates" if log_candidates else "anchors")
+        self.heading_log_format = config.get("heading_log_format", "text")  # text / jsonl / both
+        self.heading_log_jsonl_path = config.get("heading_log_jsonl_file", "11heading_detect.jsonl")
+        self.heading_log_rotate_mb = float(config.get("heading_log_rotate_mb", 0))  # 0 でローテーションなし
+        self.heading_log_backups = int(config.get("heading_log_backups", 5))
+        self.log_min_score = float(config.get("log_candidates_min_score", 0.0))
+        self.log_max_lines = int(config.get("log_candidates_max_lines", 300))
+        self.upsert_batch_files = int(config.get("upsert_batch_files", 50))  # 何ファイル分ためて一括UPSERTするか
+        self.skip_unchanged = bool(config.get("skip_unchanged_files", True))  # 前回から変わっていないファイルは処理しない
+
+# ===================== セクション定義 =====================
+SECTION_KEYS = [
+    "warning","contraindications","efficacy","efficacy_notes","dosage","dosage_notes",
+    "precautions","important_notes","special_patient_notes","interactions","side_effects",
+    "lab_influence","overdose","application_notes","other_notes","pharmacokinetics",
+    "clinical_results","pharmacodynamics","compound_properties","handling_notes",
+    "approval_conditions","packaging","main_references","contact_info"
+]
+
+# 表記ゆれ辞書（必要に応じて追記）
+ALIASES = {
+    "warning": ["警告"],
+    "contraindications": ["禁忌","禁忌（次の患者には投与しないこと）"],
+    "efficacy": ["効能又は効果","効能・効果","効能効果","効能及び効果"],
+    "efficacy_notes": ["効能又は効果に関連する注意","効能又は効果に関する注意"],
+    "dosage": ["用法及び用量","用法・用量","用法、用量","用量及び用法"],
+    "dosage_notes": ["用法及び用量に関連する注意","用法及び用量に関する注意","用法及び用量に関連する使用上の注意"],
+    "precautions": ["使用上の注意"],
+    "important_notes": ["重要な基本的注意"],
+    "special_patient_notes": ["特定の背景を有する患者に関する注意"],
+    "interactions": ["相互作用"],
+    "side_effects": ["副作用","その他の副作用","重大な副作用"],
+    "lab_influence": ["臨床検査結果に及ぼす影響"],
+    "overdose": ["過量投与"],
+    "application_notes": ["適用上の注意"],
+    "other_notes": ["その他の注意"],
+    "pharmacokinetics": ["薬物動態","薬物動態パラメータ"],
+    "clinical_results": ["臨床成績"],
+    "pharmacodynamics": ["薬効薬理"],
+    "compound_properties": ["有効成分に関する理化学的知見"],
+    "handling_notes": ["取扱い上の注意"],
+    "approval_conditions": ["承認条件"],
+    "packaging": ["包装"],
+    "main_references": ["主要文献","主要文献及び文献請求先"],
+    "contact_info": ["文献請求先","文献請求先及び問い合わせ先","製造販売業者等の氏名又は名称及び所在地","主要文献及び文献請求先"],
+}
+
+# 併記見出しの時に「用法」の先頭として認識しやすい行のパターン（分割点候補）
+DOSAGE_START = re.compile(
+    r"(?m)^(?:[ 　]*"
+    r"(?:錠|ドライシロップ|カプセル|散|内用液|坐剤|注|吸入|貼付|懸濁|シロップ)\b"
+    r"|[ 　]*(?:通常|用法|投与|経口|静注|点滴|分(?:(?:\s*|[ 　]*)[0-9０-９]+)|回|mg|g|mL)\b)"
+)
+
+# 行頭の装飾・番号（*, ※, 1., 1) 等）を剥がす
+LEAD_NOISE = re.compile(r"^\s*(?:[*※＊]?\s*)?(?:[0-9０-９]+(?:\.[0-9０-９]+)*[.)]?\s*)?")
+
+# セクション優先度（同一行に複数検知したときの代表）
+SECTION_PRIORITY = [
+    "warning","contraindications","efficacy","dosage",
+    "precautions","important_notes","special_patient_notes","interactions",
+    "side_effects","lab_influence","overdose","application_notes","other_notes",
+    "pharmacokinetics","clinical_results","pharmacodynamics","compound_properties",
+    "handling_notes","approval_conditions","packaging","main_references","contact_info"
+]
+
+# 分割ロジックを変えたら上げる（辞書・閾値の変更は splitter_version() が自動で検知）
+SPLITTER_LOGIC_VERSION = 1
+
+@functools.lru_cache(maxsize=None)
+def splitter_version(min_score: float = MIN_HEADING_SCORE) -> str:
+    """分割ルールの版。これが変わると全ファイルが再処理対象になる"""
+    rules = [SPLITTER_LOGIC_VERSION, ALIASES, SECTION_KEYS, SECTION_PRIORITY,
+             min_score, DOSAGE_START.pattern, LEAD_NOISE.pattern]
+    digest = hashlib.md5(json.dumps(rules, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f"{SPLITTER_LOGIC_VERSION}:{digest[:12]}"
+
+def _shorten(s: str, n: int = 120) -> str:
+    if s is None: return ""
+    s = s.replace("\r", "").replace("\n", " ")
+    return s if len(s) <= n else s[:n] + f"...(+{len(s)-n})"
+
+def build_heading_record(filename: str, lines: list, bucket_by_line: dict, anchors: dict,
+                         level: str = "candidates", min_score: float = 0.0, max_lines: int = 300) -> dict:
+    """
+    見出し判定ログ1ファイル分を構造化して返す（テキスト/JSONL への整形は書き込みスレッド側で行う）
+    bucket_by_line: {line_idx: {section_key: score, ...}, ...}
+    anchors: {section_key: line_idx}
+    min_score / max_lines: 候補行に出すスコアの下限と最大行数
+    """
+    rec = {
+        "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "file": filename,
+        "total_lines": len(lines),
+        "min_score": min_score,
+        "candidates": None,
+        "truncated": False,
+        "anchors": [],
+        "multi": [],
+        "bridge": [],
+    }
+
+    # 候補行（スコア付き）
+    if level == "candidates" and bucket_by_line:
+        rec["candidates"] = []
+        for idx in sorted(bucket_by_line.keys()):
+            kv = {k:v for k,v in bucket_by_line[idx].items() if v >= min_score}
+            if not kv:
+                continue
+            # スコア降順で並べる
+            items = sorted(kv.items(), key=lambda x: (-x[1], x[0]))
+            rec["candidates"].append([idx, _shorten(lines[idx]), items])
+            if len(rec["candidates"]) >= max_lines:
+                rec["truncated"] = True
+                break
+
+    # 採用アンカー（セクション優先度順）
+    for key in SECTION_PRIORITY:
+        if key in anchors:
+            li = anchors[key]
+            score = bucket_by_line.get(li, {}).get(key, None)
+            rec["anchors"].append([key, li, score, _shorten(lines[li])])
+
+    # 同一行に複数キーが乗っている箇所
+    rev = {}
+    for k, li in anchors.items():
+        rev.setdefault(li, []).append(k)
+    multi = [(li, keys) for li, keys in rev.items() if len(keys) >= 2]
+    for li, keys in sorted(multi, key=lambda x: x[0]):
+        rec["multi"].append([li, keys, _shorten(lines[li])])
+    return rec
+
+def format_heading_text(rec: dict) -> str:
+    """従来の 11heading_detect.log 形式に整形"""
+    out = ["====================================================================================================\n",
+           f"[{rec['ts']}] file={rec['file']} total_lines={rec['total_lines']} min_score={rec['min_score']}\n"]
+    if rec["candidates"] is not None:
+        out.append("[CANDIDATES] (idx: text :: key:score,...)\n")
+        for idx, text, items in rec["candidates"]:
+            pairs = ", ".join([f"{k}:{x:.2f}" for k,x in items])
+            out.append(f"  [{idx:>5}] {text} :: {pairs}\n")
+        if rec["truncated"]:
+            out.append(f"  ... (truncated at {len(rec['candidates'])} candidates)\n")
+    out.append("[ANCHORS]\n")
+    for key, li, score, text in rec["anchors"]:
+        score_str = f"{score:.2f}" if isinstance(score, (int,float)) else "-"
+        out.append(f"  {key:<22} -> line {li:<5} score {score_str} | {text}\n")
+    if rec["multi"]:
+        out.append("[MULTI-KEY-LINE]\n")
+        for li, keys, text in rec["multi"]:
+            out.append(f"  line {li:<5} keys={keys} | {text}\n")
+    out.append("====================================================================================================\n\n")
+    out.extend(rec["bridge"])
+    return "".join(out)
+
+def format_heading_jsonl(rec: dict) -> str:
+    """同じ内容を1ファイル1行の JSON に整形（オフライン分析用）"""
+    data = dict(rec)
+    if data["candidates"] is not None:
+        data["candidates"] = [{"line": idx, "text": text, "scores": dict(items)}
+                              for idx, text, items in data["candidates"]]
+    data["anchors"] = [{"key": k, "line": li, "score": sc, "text": t} for k, li, sc, t in data["anchors"]]
+    data["multi"] = [{"line": li, "keys": keys, "text": t} for li, keys, t in data["multi"]]
+    data["bridge"] = [b.rstrip("\n") for b in data["bridge"]]
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+class _LineCollector:
+    """slice_sections の heading_logf として渡し、[BRIDGE] 行をレコードに集める"""
+    def __init__(self):
+        self.lines = []
+
+    def write(self, s: str):
+        self.lines.append(s)
+
+class RotatingLogFile:
+    """サイズ上限を超えたら path.1.gz, path.2.gz ... に gzip で退避するログファイル（バイナリ・大きめのバッファで追記）"""
+
+    def __init__(self, path: str, max_bytes: int = 0, backups: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self.f = open(path, "ab", buffering=1 << 20)
+        self.size = os.path.getsize(path)
+
+    def write(self, s: str):
+        data = s.encode("utf-8")
+        if self.max_bytes and self.size and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.f.write(data)
+        self.size += len(data)
+
+    def rotate(self):
+        self.f.close()
+        for n in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{n}.gz"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{n+1}.gz")
+        with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        self.f = open(self.path, "wb", buffering=1 << 20)
+        self.size = 0
+
+    def close(self):
+        self.f.close()
+
+class HeadingLogWriter:
+    """
+    見出し判定ログの書き込みスレッド。メインループは record を queue に積むだけで、
+    整形・書き込み・ローテーションはバックグラウンドで行う（ファイルごとの flush はしない）。
+    level: off / anchors / candidates、fmt: text / jsonl / both
+    """
+
+    def __init__(self, level: str, fmt: str, text_path: str, jsonl_path: str,
+                 max_bytes: int = 0, backups: int = 5):
+        self.level = level
+        self.outputs = []
+        if level != "off":
+            if fmt in ("text", "both"):
+                self.outputs.append((RotatingLogFile(text_path, max_bytes, backups), format_heading_text))
+            if fmt in ("jsonl", "both"):
+                self.outputs.append((RotatingLogFile(jsonl_path, max_bytes, backups), format_heading_jsonl))
+        self.queue = queue.Queue(maxsize=1000)
+        self.thread = threading.Thread(target=self._run, name="heading-log", daemon=True)
+        self.thread.start()
+
+    def write(self, rec):
+        if rec is not None and self.outputs:
+            self.queue.put(rec)
+
+    def _run(self):
+        while True:
+            rec = self.queue.get()
+            if rec is None:
+                break
+            for out, fmt in self.outputs:
+                try:
+                    out.write(fmt(rec))
+                except Exception as e:
+                    from tqdm import tqdm
+                    tqdm.write(f"[{rec.get('file')}] 見出しログ出力エラー: {e}")
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        for out, _ in self.outputs:
+            out.close()
+
+def read_text_euc(path: str) -> str:
+    with open(path, "rb") as f:
+        return decode_text_euc(f.read())
+
+def decode_text_euc(data: bytes) -> str:
+    """EUC-JP のバイト列を文字列にし、タブをスペースにする（改行は open() のテキストモードと同じく \n にそろえる）"""
+    text = data.decode("euc_jp", errors="replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n").replace("\t", " ")
+
+# ===================== 見出し語マッチャ =====================
+# ALIASES の全表記を1本の正規表現にまとめ、行内の全出現位置を1回の走査で列挙する。
+# 先読み＋長い表記優先なので、各位置では最長の表記が取れ、同じ位置から始まる短い表記は
+# 「最長表記の接頭辞」として _ALIAS_PREFIXES から引く（例: 用法及び用量 ⊂ 用法及び用量に関連する注意）。
+_ALIAS_VARIANTS = sorted({v for vs in ALIASES.values() for v in vs}, key=len, reverse=True)
+_ALIAS_ANY    = re.compile("|".join(re.escape(v) for v in _ALIAS_VARIANTS))  # 前段フィルタ（先読み無しの方が速い）
+_ALIAS_FINDER = re.compile("(?=(" + "|".join(re.escape(v) for v in _ALIAS_VARIANTS) + "))")
+_ALIAS_PREFIXES = {v: tuple(w for w in _ALIAS_VARIANTS if v.startswith(w)) for v in _ALIAS_VARIANTS}
+# 表記 -> [(section_key, ALIASES内の順番), ...]
+_ALIAS_KEYS = {}
+for _key, _variants in ALIASES.items():
+    for _order, _v in enumerate(_variants):
+        _ALIAS_KEYS.setdefault(_v, []).append((_key, _order))
+_KEY_ORDER = {key: i for i, key in enumerate(ALIASES)}
+# 合体見出し（主要文献・文献請求先）扱いになる表記
+_COMBINED_REF_VARIANTS = frozenset(v for v in _ALIAS_VARIANTS if "主要文献" in v and "文献請求先" in v)
+
+def find_alias_hits(s: str) -> set:
+    """s に含まれる ALIASES の表記をすべて返す"""
+    first = _ALIAS_ANY.search(s)
+    if not first:
+        return set()
+    hits = set()
+    for m in _ALIAS_FINDER.finditer(s, first.start()):
+        hits.update(_ALIAS_PREFIXES[m.group(1)])
+    return hits
+
+def calc_line_score(line: str, idx: int, lines: list) -> dict:
+    """行に対して各セクションのスコアを返す {section_key: score}"""
+    # 見出し語を1つも含まない行（大半の本文行）は特徴量計算の前に除外。
+    # 「。」を含む長い行は除外しない: 見出し語を含めば旧実装でも 5.0 以上（MIN_HEADING_SCORE 以上）になり、
+    # 他に候補が無いセクションのアンカーや見出しログの候補行に出るので、除くとスコアが変わってしまう
+    if not _ALIAS_ANY.search(line):
+        return {}
+    raw = line.rstrip("\r\n")
+    s = LEAD_NOISE.sub("", raw).strip()
+    if not s:
+        return {}
+    hits = find_alias_hits(s)
+    if not hits:
+        return {}
+
+    # キーごとに 完全一致の有無 と 採用表記（完全一致 > ALIASES 内で最初に含まれる表記）を決める
+    per_key = {}  # key -> (exact, hit_variant, order)
+    for v in hits:
+        exact = (s == v)
+        for key, order in _ALIAS_KEYS[v]:
+            cur = per_key.get(key)
+            if cur is None or (exact and not cur[0]) or (not cur[0] and order < cur[2]):
+                per_key[key] = (exact, v, order)
+
+    # 特徴量は行ごとに1回だけ計算（加算順は旧実装と同じにして浮動小数の結果を一致させる）
+    begins = (len(raw) - len(raw.lstrip()))  # 行頭空白
+    length = len(s)
+    has_period = "。" in s
+    prev_empty = (idx-1 >= 0 and lines[idx-1].strip() == "")
+    next_empty = (idx+1 < len(lines) and lines[idx+1].strip() == "")
+    stripped = raw.strip()
+    bracketed = stripped.startswith(("【","[")) or stripped.endswith(("】","]"))
+
+    base_scores = {}
+    for base in (8.0, 5.0):
+        local_score = base
+        if begins <= 4:
+            local_score += 2.0
+        if length <= 20:
+            local_score += 1.5
+        elif length <= 35:
+            local_score += 0.8
+        if not has_period:
+            local_score += 0.5
+        if prev_empty or next_empty:
+            local_score += 0.5
+        if bracketed:
+            local_score += 0.5
+        base_scores[base] = local_score
+
+    scores = {}
+    for key in sorted(per_key, key=_KEY_ORDER.__getitem__):
+        exact, hit_variant, _ = per_key[key]
+        local_score = base_scores[8.0 if exact else 5.0]
+        # 合体見出しの特別扱い（主要文献・文献請求先）
+        if hit_variant in _COMBINED_REF_VARIANTS and key in ("main_references", "contact_info"):
+            local_score += 0.5
+        scores[key] = local_score
+
+    return scores
+
+def choose_best_anchors(lines: list, min_score: float = MIN_HEADING_SCORE, line_score=None) -> dict:
+    """
+    各セクションについてスコア min_score 以上で最大の行を1つ選ぶ。
+    同一行に複数セクションが高得点で出ることは許容（efficacy/dosage, main_references/contact_info など）
+    line_score: 行のスコア関数（既定 calc_line_score。check_heading_scores.py が legacy 版と比べるのに使う）
+    return: {section_key: line_index}
+    """
+    line_score = line_score or calc_line_score
+    best = {}        # key -> (score, idx)
+    bucket_by_line = {}  # idx -> {key:score}
+
+    for idx, line in enumerate(lines):
+        sc = line_score(line, idx, lines)
+        if not sc:
+            continue
+        bucket_by_line[idx] = sc
+        for key, val in sc.items():
+            if val < min_score:
+                continue
+            if key not in best or val > best[key][0] or (val == best[key][0] and idx < best[key][1]):
+                best[key] = (val, idx)
+
+    # 同一点（同じ行）に複数キーが載るのはそのまま許容
+    anchors = {key: idx for key, (score, idx) in best.items()}
+    return anchors, bucket_by_line
+
+def make_offsets(text: str):
+    """改行込みで絶対位置配列を作成"""
+    raw_lines = text.splitlines(True)  # 改行保持
+    lines     = [ln.rstrip("\r\n") for ln in raw_lines]
+    starts, off = [], 0
+    for ln in raw_lines:
+        starts.append(off)
+        off += len(ln)
+    return lines, raw_lines, starts, len(text)
+
+def slice_sections(text: str,
+                   anchors: dict,
+                   lines, raw_lines, starts, text_len: int,
+                   bucket_by_line: dict,
+                   heading_logf=None, filename:str=""):
+    """
+    anchors: {section_key: line_idx}
+    bucket_by_line: {line_idx: {section_key: score, ...}}
+    - 「効能」→直後に「効能／用法」併記行が来るケースを bridge。
+      * 効能 = [E_line .. (併記ブロックの用法開始直前)]
+      * 用法 = [併記ブロックの用法開始 .. 次アンカー直前]
+      * 二分不可なら 用法 = 効能（複製）
+    """
+    # line順に並べる
+    order = sorted([(idx, key) for key, idx in anchors.items()], key=lambda x: x[0])
+    if not order:
+        return {}
+
+    # 次アンカーの絶対位置（line_idx -> abs）
+    line_to_next_abs = {}
+    for i, (li, key) in enumerate(order):
+        next_abs = text_len if i+1 == len(order) else starts[order[i+1][0]]
+        line_to_next_abs[li] = next_abs
+
+    sections = {}
+    skip_lines = set()   # ここに入れた line は通常処理をスキップ（併記を個別に処理するため）
+
+    # ---------- BRIDGING: 「効能」→すぐ下に「効能／用法」併記 ----------
+    # 併記候補となる行を抽出（同じ行で efficacy と dosage のスコアが出ている）
+    combined_lines = {li for li, m in bucket_by_line.items()
+                      if ("efficacy" in m) and ("dosage" in m)}
+    # 効能アンカー行
+    e_line = anchors.get("efficacy")
+    d_line = anchors.get("dosage")
+
+    def _log(msg):
+        if heading_logf:
+            heading_logf.write(f"[BRIDGE] {filename}: {msg}\n")
+
+    if e_line is not None and d_line is not None and d_line in combined_lines and e_line < d_line:
+        # 併記ブロック: d_line 〜 次アンカー直前
+        block_start_abs = starts[d_line]
+        block_end_abs   = line_to_next_abs.get(d_line, text_len)
+        block = text[block_start_abs:block_end_abs]
+
+        # 効能の前段: e_line 〜 d_line 直前
+        pre_eff = text[starts[e_line]:starts[d_line]]
+
+        # 併記ブロック内を二分
+        m = DOSAGE_START.search(block)
+        if m:
+            split_at = m.start()
+            eff2 = block[:split_at].rstrip()
+            dos  = block[split_at:].lstrip()
+            _log(f"efficacy@{e_line} + combined@{d_line} split={split_at}")
+        else:
+            # 二分できない → 複製
+            eff2 = block
+            dos  = block
+            _log(f"efficacy@{e_line} + combined@{d_line} split=FAILED -> duplicate")
+
+        eff = (pre_eff + eff2).strip()
+        sections["efficacy"] = eff
+        sections["dosage"]   = dos if dos.strip() else eff
+
+        # 通常処理では e_line / d_line をスキップ（重複生成防止）
+        skip_lines.add(e_line)
+        skip_lines.add(d_line)
+
+    # ---------- 通常スライス（bridgingで使ってない行だけ処理） ----------
+    for i, (li, key) in enumerate(order):
+        if li in skip_lines:
+            continue
+
+        start_abs = starts[li]
+        end_abs   = line_to_next_abs.get(li, text_len)
+        block = text[start_abs:end_abs].rstrip()
+
+        # 同一行に efficacy & dosage がある純粋な併記（bridgingではない）もケア
+        same_keys = [k for k, idx in anchors.items() if idx == li]
+        if "efficacy" in same_keys and "dosage" in same_keys and key in ("efficacy","dosage"):
+            m = DOSAGE_START.search(block)
+            if m:
+                split_at = m.start()
+                sections["efficacy"] = block[:split_at].rstrip()
+                sections["dosage"]   = block[split_at:].lstrip()
+            else:
+                sections["efficacy"] = block
+                sections["dosage"]   = block
+            # 同一行のもう片方もスキップ
+            skip_lines.add(li)
+            continue
+
+        # 通常登録（長い方優先で上書き）
+        if key not in sections or len(block) > len(sections[key]):
+            sections[key] = block
+
+    # 合体見出し（主要文献／文献請求先）の補完
+    if "main_references" in anchors or "contact_info" in anchors:
+        li_main = anchors.get("main_references")
+        li_ct   = anchors.get("contact_info")
+        if li_main is not None and li_ct is None:
+            if "文献請求先" in lines[li_main] and "contact_info" not in sections:
+                sections["contact_info"] = sections.get("main_references","")
+        elif li_ct is not None and li_main is None:
+            if "主要文献" in lines[li_ct] and "main_references" not in sections:
+                sections["main_references"] = sections.get("contact_info","")
+
+    # 用法が空なら効能を複製
+    if sections.get("dosage","").strip() == "" and "efficacy" in sections:
+        sections["dosage"] = sections["efficacy"]
+
+    return sections
+
+# ===================== DB =====================
+def ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS drug_filedata (
+            id_druginformation SERIAL PRIMARY KEY,
+            yj_code VARCHAR(16),
+            section_key VARCHAR(50),
+            content TEXT,
+            content_length INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (yj_code, section_key)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS drug_filedata_fingerprint (
+            yj_code VARCHAR(16) PRIMARY KEY,
+            file_size BIGINT,
+            mtime DOUBLE PRECISION,
+            content_hash CHAR(32),
+            splitter_version VARCHAR(32),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def load_fingerprints(cur) -> dict:
+    """{yj_code: (file_size, mtime, content_hash, splitter_version)}"""
+    cur.execute("SELECT yj_code, file_size, mtime, content_hash, splitter_version FROM drug_filedata_fingerprint")
+    return {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+
+def stat_unchanged(path: str, version: str, known=None) -> bool:
+    """サイズ・更新時刻・分割ルール版が前回の指紋と同じなら True（ファイルは読まない）"""
+    st = os.stat(path)
+    return bool(known and known[0] == st.st_size and known[1] == st.st_mtime and known[3] == version)
+
+def file_fingerprint(data: bytes, mtime: float, version: str) -> tuple:
+    """読み込んだ内容から指紋 (file_size, mtime, content_hash, splitter_version) を作る"""
+    return (len(data), mtime, hashlib.md5(data).hexdigest(), version)
+
+def content_unchanged(fingerprint, known=None) -> bool:
+    """内容ハッシュ・分割ルール版が前回と同じなら True（更新時刻だけ変わったファイル）"""
+    return bool(fingerprint and known and fingerprint[2:] == tuple(known[2:]))
+
+def prune_missing(cur, yj_codes: list) -> int:
+    """DI_folder から消えたファイルの drug_filedata / 指紋を削除し、削除した yj_code 数を返す"""
+    cur.execute("""
+        SELECT DISTINCT yj_code FROM (
+            SELECT yj_code FROM drug_filedata
+            UNION SELECT yj_code FROM drug_filedata_fingerprint
+        ) t WHERE NOT (yj_code = ANY(%s))
+    """, (yj_codes,))
+    gone = [row[0] for row in cur.fetchall()]
+    if gone:
+        cur.execute("DELETE FROM drug_filedata WHERE yj_code = ANY(%s)", (gone,))
+        cur.execute("DELETE FROM drug_filedata_fingerprint WHERE yj_code = ANY(%s)", (gone,))
+    return len(gone)
+
+def upsert_section(cur, yj_code, section_key, content):
+    content = content or ""
+    cur.execute("""
+        INSERT INTO drug_filedata (yj_code, section_key, content, content_length, created_at)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON CONFLICT (yj_code, section_key) DO UPDATE SET
+            content = EXCLUDED.content,
+            content_length = EXCLUDED.content_length,
+            created_at = EXCLUDED.created_at
+    """, (yj_code, section_key, content, len(content)))
+
+FINGERPRINT_SQL = """
+    INSERT INTO drug_filedata_fingerprint (yj_code, file_size, mtime, content_hash, splitter_version, updated_at)
+    VALUES %s
+    ON CONFLICT (yj_code) DO UPDATE SET
+        file_size = EXCLUDED.file_size,
+        mtime = EXCLUDED.mtime,
+        content_hash = EXCLUDED.content_hash,
+        splitter_version = EXCLUDED.splitter_version,
+        updated_at = EXCLUDED.updated_at
+"""
+
+UPSERT_SQL = """
+    INSERT INTO drug_filedata (yj_code, section_key, content, content_length, created_at)
+    VALUES %s
+    ON CONFLICT (yj_code, section_key) DO UPDATE SET
+        content = EXCLUDED.content,
+        content_length = EXCLUDED.content_length,
+        created_at = EXCLUDED.created_at
+"""
+
+class SectionBatchWriter:
+    """
+    drug_filedata への書き込みを batch_files ファイル分ためて、1回の execute_values／1トランザクションで流す。
+    バッチが失敗した場合はロールバックして1行ずつ書き直し、失敗した行だけを報告する。
+    ファイルの指紋も同じトランザクションで更新する（書き込みに失敗したファイルの指紋は更新しない）。
+    """
+
+    def __init__(self, conn, metrics, batch_files: int = 50, report=print):
+        self.conn = conn
+        self.metrics = metrics
+        self.cur = conn.cursor()
+        self.batch_files = max(1, batch_files)
+        self.report = report
+        self.rows = {}       # (yj_code, section_key) -> (filename, content)
+        self.fingerprints = {}  # yj_code -> (file_size, mtime, content_hash, splitter_version)
+        self.replaced = {}   # yj_code -> 今回のセクションキー一覧（再処理ファイルの古いセクション削除用）
+        self.n_files = 0
+        self.written = 0
+        self.failed = 0
+
+    def add(self, filename: str, yj_code: str, sections: dict,
+            fingerprint=None, replace: bool = False) -> int:
+        """
+        1ファイル分のセクションを追加し、追加した行数を返す。
+        replace=True なら、今回出てこなかった既存セクションを削除する（変更ファイルの再処理時）。
+        """
+        n = 0
+        keys = []
+        for key, content in sections.items():
+            if key not in SECTION_KEYS:
+                continue
+            self.rows[(yj_code, key)] = (filename, content or "")
+            keys.append(key)
+            n += 1
+        if fingerprint is not None:
+            self.fingerprints[yj_code] = fingerprint
+        if replace:
+            self.replaced[yj_code] = keys
+        self.n_files += 1
+        if self.n_files >= self.batch_files:
+            self.flush()
+        return n
+
+    def flush(self):
+        if not self.rows and not self.fingerprints and not self.replaced:
+            self.n_files = 0
+            return
+        with self.metrics.stage("db_write"):
+            self._flush()
+
+    def _flush(self):
+        values = [(yj, key, content, len(content))
+                  for (yj, key), (_, content) in self.rows.items()]
+        try:
+            self._delete_stale(self.replaced)
+            if values:
+                execute_values(self.cur, UPSERT_SQL, values,
+                               template="(%s, %s, %s, %s, NOW())", page_size=len(values))
+            self._write_fingerprints(self.fingerprints)
+            self.conn.commit()
+            self.written += len(values)
+        except Exception as e:
+            self.conn.rollback()
+            self.report(f"[batch] 一括UPSERT失敗のため1行ずつ再実行します: {e}")
+            self._flush_one_by_one()
+        self.rows = {}
+        self.fingerprints = {}
+        self.replaced = {}
+        self.n_files = 0
+
+    def _delete_stale(self, replaced: dict):
+        for yj_code, keys in replaced.items():
+            self.cur.execute(
+                "DELETE FROM drug_filedata WHERE yj_code = %s AND NOT (section_key = ANY(%s))",
+                (yj_code, keys))
+
+    def _write_fingerprints(self, fingerprints: dict):
+        if fingerprints:
+            execute_values(self.cur, FINGERPRINT_SQL,
+                           [(yj, *fp) for yj, fp in fingerprints.items()],
+                           template="(%s, %s, %s, %s, %s, NOW())")
+
+    def _flush_one_by_one(self):
+        failed_codes = set()
+        for (yj_code, key), (filename, content) in self.rows.items():
+            try:
+                upsert_section(self.cur, yj_code, key, content)
+                self.conn.commit()
+                self.written += 1
+            except Exception as e:
+                self.conn.rollback()
+                self.failed += 1
+                failed_codes.add(yj_code)
+                self.report(f"[{filename}] SQLエラー({key}): {e}")
+        # 全セクションを書けたファイルだけ、古いセクション削除と指紋更新を行う（失敗分は次回再処理）
+        try:
+            self._delete_stale({yj: k for yj, k in self.replaced.items() if yj not in failed_codes})
+            self._write_fingerprints({yj: fp for yj, fp in self.fingerprints.items() if yj not in failed_codes})
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.report(f"[batch] 指紋の更新に失敗しました: {e}")
+
+    def close(self):
+        self.flush()
+        self.cur.close()
+
+# ===================== ファイル単位の処理 =====================
+def split_file(path: str, settings: Settings = None) -> dict:
+    """
+    1ファイルを 読み込み→オフセット→スコアリング→切り出し まで行う（DBには触らない）。
+    --workers 指定時はワーカープロセスで実行され、見出しログはファイル単位のレコードで親に返す。
+    settings: 見出しスコアの下限・見出しログの設定（省略時は既定値）
+    return: {"filename", "yj_code", "sections"(None=登録なし), "log", "messages", "read_error",
+             "fingerprint"(読み込めたときの指紋), "timings"(段階ごとの秒数。親プロセスで metrics に足す)}
+    """
+    settings = settings or Settings()
+    filename = os.path.basename(path)
+    yj_code = os.path.splitext(filename)[0]
+    timings = {}
+    result = {"filename": filename, "yj_code": yj_code, "sections": None, "log": None, "messages": [],
+              "read_error": False, "fingerprint": None, "timings": timings}
+    clock = time.perf_counter
+
+    try:
+        started = clock()
+        with open(path, "rb") as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            data = f.read()
+        timings["read"] = clock() - started
+        # 指紋は読み込んだ内容からワーカー側で作る（親プロセスで読み直さない）
+        started = clock()
+        result["fingerprint"] = file_fingerprint(data, mtime, splitter_version(settings.min_heading_score))
+        timings["fingerprint"] = clock() - started
+        started = clock()
+        text = decode_text_euc(data)
+        timings["decode"] = clock() - started
+    except Exception as e:
+        result["messages"].append(f"[{filename}] 読み込み失敗: {e}")
+        result["read_error"] = True
+        return result
+
+    # オフセット
+    started = clock()
+    lines, raw_lines, starts, text_len = make_offsets(text)
+    timings["offsets"] = clock() - started
+
+    # スコアリング→アンカー選定
+    started = clock()
+    anchors, bucket = choose_best_anchors(lines, settings.min_heading_score)
+    timings["score"] = clock() - started
+
+    bridge = None
+    if settings.heading_log_level != "off":
+        try:
+            result["log"] = build_heading_record(filename, lines, bucket, anchors, settings.heading_log_level,
+                                                 settings.log_min_score, settings.log_max_lines)
+            bridge = _LineCollector()
+        except Exception as e:
+            result["messages"].append(f"[{filename}] 見出しログ出力エラー: {e}")
+
+    if not anchors:
+        result["messages"].append(f"[{filename}] 見出し検出なし（スコア下限 {settings.min_heading_score}）")
+        return result
+
+    # 切り出し
+    started = clock()
+    result["sections"] = slice_sections(
+        text, anchors, lines, raw_lines, starts, text_len,
+        bucket_by_line=bucket, heading_logf=bridge, filename=filename
+    )
+    timings["slice"] = clock() - started
+    if bridge is not None:
+        result["log"]["bridge"] = bridge.lines
+    return result
+
+def iter_split_results(paths: list, settings: Settings, pool=None, workers: int = 1):
+    """
+    split_file の結果をファイル名順に返す（pool を渡せばプロセスプールで並列実行）。
+    pool は見出しログのスレッドや DB 接続より前に作っておくこと（fork でスレッド・ソケットを子に持ち込まないため）。
+    """
+    if pool is None:
+        for path in paths:
+            yield split_file(path, settings)
+        return
+    chunksize = max(1, min(32, len(paths) // (workers * 8)))
+    # imap は投入順に結果を返すので、ログ・DB書き込み順は逐次実行と同じ
+    yield from pool.imap(functools.partial(split_file, settings=settings), paths, chunksize=chunksize)
+
+# ===================== メイン =====================
+def add_arguments(ap):
+    ap.add_argument("--yes", "-y", action="store_true", help="確認せずに実行する（cron などの無人実行用）")
+    ap.add_argument("--drop", action="store_true", help="確認せずに drug_filedata を削除して作り直す")
+    ap.add_argument("--folder", help="添付文書フォルダ（既定は config.json の DI_folder）")
+    ap.add_argument("--workers", type=int,
+                    help="分割処理のプロセス数（0 で CPU コア数。既定は config.json の split_workers、なければ 1 = 逐次）")
+    ap.add_argument("--all", action="store_true",
+                    help="指紋が変わっていないファイルも含めて全件処理する（skip_unchanged_files を無視）")
+    ap.add_argument("--prune", action="store_true",
+                    help="DI_folder から消えたファイルの drug_filedata 行を削除する")
+
+def main(args):
+    from tqdm import tqdm
+    config = config_file.load(args.config)
+    settings = Settings(config)
+    workers = settings.workers if args.workers is None else args.workers
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    source_dir = args.folder or settings.source_dir
+
+    if not confirm(f"{source_dir} のテキストを ルールベースで分割し、DB '{settings.db_conf.get('dbname')}' に登録します。続行しますか？ (y/n): ", args.yes):
+        print("中止しました。"); return 1
+
+    drop = args.drop or (not args.yes and confirm("既存の drug_filedata を削除して作り直しますか？ (Y/n): "))
+
+    try:
+        files = sorted([fn for fn in os.listdir(source_dir) if fn.endswith(".txt")])
+    except FileNotFoundError:
+        print(f"フォルダが見つかりません: {source_dir}")
+        return 1
+    if not files:
+        print("対象テキストが見つかりません。"); return 1
+
+    # ワーカーは見出しログのスレッドと DB 接続より先に作る
+    pool = multiprocessing.Pool(processes=workers) if workers > 1 else None
+    try:
+        metrics = Metrics("11druginformation2SQL_score", config)
+        conn = connect(settings.db_conf)
+        cur = conn.cursor()
+        if drop:
+            cur.execute("DROP TABLE IF EXISTS drug_filedata")
+            cur.execute("DROP TABLE IF EXISTS drug_filedata_fingerprint")
+            conn.commit()
+        ensure_table(cur); conn.commit()
+
+        if args.prune:
+            n_pruned = prune_missing(cur, [os.path.splitext(fn)[0] for fn in files])
+            conn.commit()
+            print(f"消えたファイル {n_pruned} 件分のデータを削除しました。")
+
+        inserted_total = 0
+        writer = SectionBatchWriter(conn, metrics, settings.upsert_batch_files, report=tqdm.write)
+
+        # 指紋（サイズ・更新時刻・内容ハッシュ・分割ルール版）が前回と同じファイルは処理しない。
+        # ここではサイズ・更新時刻だけを見て、内容ハッシュは split_file が読み込んだ内容から作る
+        version = splitter_version(settings.min_heading_score)
+        skip = settings.skip_unchanged and not args.all
+        known = load_fingerprints(cur)
+        paths = []
+        for fn in files:
+            yj_code = os.path.splitext(fn)[0]
+            path = os.path.join(source_dir, fn)
+            try:
+                with metrics.stage("stat"):
+                    unchanged = stat_unchanged(path, version, known.get(yj_code))
+            except OSError as e:
+                tqdm.write(f"[{fn}] 読み込み失敗: {e}")
+                continue
+            if skip and unchanged:
+                metrics.count("skipped")
+                continue
+            paths.append(path)
+        if skip:
+            print(f"サイズ・更新時刻が前回と同じ {len(files) - len(paths)} 件をスキップ / 読み込み対象 {len(paths)} 件（分割ルール {version}）")
+
+        heading_log = HeadingLogWriter(settings.heading_log_level, settings.heading_log_format,
+                                       settings.heading_log_path, settings.heading_log_jsonl_path,
+                                       max_bytes=int(settings.heading_log_rotate_mb * 1024 * 1024),
+                                       backups=settings.heading_log_backups)
+
+        with tqdm(total=len(paths), desc=f"項目分割→SQL (workers={workers})", unit="file", disable=None) as pbar:
+            for res in iter_split_results(paths, settings, pool, workers):
+                filename, yj_code, sections = res["filename"], res["yj_code"], res["sections"]
+                for stage, seconds in res["timings"].items():
+                    metrics.record(stage, seconds)
+                fingerprint = res["fingerprint"]
+                if skip and content_unchanged(fingerprint, known.get(yj_code)):
+                    # 内容は同じで更新時刻だけ変わった → 指紋だけ更新
+                    metrics.count("skipped")
+                    writer.add(filename, yj_code, {}, fingerprint=fingerprint)
+                    pbar.update(1)
+                    continue
+                metrics.count("files")
+                with metrics.stage("heading_log"):
+                    heading_log.write(res["log"])
+                for msg in res["messages"]:
+                    tqdm.write(msg)
+
+                if sections is None:
+                    # 見出しなしも「処理済み」として指紋を残す（読み込み失敗は残さず次回再試行）
+                    metrics.count("read_errors" if res["read_error"] else "no_heading")
+                    if not res["read_error"]:
+                        writer.add(filename, yj_code, {}, fingerprint=fingerprint, replace=yj_code in known)
+                    pbar.update(1)
+                    continue
+
+                # 書き込み（UPSERT_BATCH_FILES ファイルごとにまとめて commit）
+                inserted_this = writer.add(filename, yj_code, sections,
+                                           fingerprint=fingerprint,
+                                           replace=yj_code in known)
+
+                inserted_total += inserted_this
+                metrics.count("sections", inserted_this)
+                head_keys = ", ".join(list(sections.keys())[:6])
+                tqdm.write(f"[{filename}] sections:{len(sections)} keys:{head_keys} | INSERT:{inserted_this}")
+                pbar.set_postfix({"ins": inserted_this, "total": inserted_total})
+                pbar.update(1)
+
+        writer.close()
+        heading_log.close()
+        cur.close(); conn.close()
+        print(f"\n完了: ファイル {len(paths)}/{len(files)} 件 / 総INSERT {writer.written} 件 / SQLエラー {writer.failed} 件")
+        metrics.count("rows_written", writer.written)
+        metrics.count("failures", writer.failed)
+        metrics.finish()
+        return 0
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# GPU なしで python -m druginfo extract を試すための、Ollama の /api/generate を真似るだけの HTTP サーバー
+#   python3 fake_ollama.py --port 11435 [--latency 0.5 --latency-dist lognormal] [--tokens-per-sec 40] [--error-rate 0.1]
+# config.json の "ollama_url" または "ollama_backends" の url を http://127.0.0.1:11435/api/generate にして使う。
+# 応答は、プロンプト中の添付文書部分からカタカナの薬剤名らしい語を拾って JSON 配列にしたもの（内容に意味はない）。
+# --canned で応答を固定でき、--error-rate の割合で壊れた JSON や HTTP 500 を返す。
+# bench_interaction_pipeline.py からは start_server() でスレッドとして起動する。
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添付文書部分の始まり（build_prompt の prefix / system / legacy いずれの文面にも含まれる）
+DOCUMENT_MARK = re.compile(r"以下が添付文書です[^\n]*\n")
+AGENT_WORD = re.compile(r"[ァ-ヴー]{4,}")
+
+LATENCY_DISTS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+ERROR_KINDS = ("truncated", "prose", "single_quote", "http500")
+
+def fake_entries(prompt, max_items=20):
+    match = DOCUMENT_MARK.search(prompt)
+    document = prompt[match.end():] if match else prompt
+    agents = list(dict.fromkeys(AGENT_WORD.findall(document)))[:max_items]
+    return [{"agent": agent, "category": "不明", "interaction_type": "併用注意",
+             "description": "（fake_ollama の応答）"} for agent in agents]
+
+def sample_latency(dist, mean, rng):
+    """平均が mean 秒になるよう、指定した分布から待ち時間を引く"""
+    if mean <= 0 or dist == "fixed":
+        return max(0.0, mean)
+    if dist == "uniform":
+        return rng.uniform(0, 2 * mean)
+    if dist == "normal":
+        return max(0.0, rng.gauss(mean, mean / 4))
+    if dist == "lognormal":
+        sigma = 0.8
+        return rng.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+    return rng.expovariate(1 / mean)
+
+def broken_text(kind, text):
+    """エラー応答の本文（http500 は呼び出し側で扱う）"""
+    if kind == "truncated":
+        return text[: max(1, len(text) // 2)]
+    if kind == "prose":
+        return "申し訳ありませんが、この文章から相互作用を抽出できませんでした。"
+    return text.replace('"', "'")    # single_quote: Python のリテラル風
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """設定と、受けたリクエスト数・同時処理数・待機（処理中のリクエストが無い）時間を持つ"""
+    daemon_threads = True
+
+    def __init__(self, address, model="fake", latency=0.2, latency_dist="normal", tokens_per_sec=200.0,
+                 error_rate=0.0, error_kinds=ERROR_KINDS, canned=None, seed=None, verbose=False):
+        super().__init__(address, FakeOllamaHandler)
+        self.model = model
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.error_kinds = tuple(error_kinds)
+        self.canned = canned
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.idle = 0.0
+        self.idle_gaps = 0
+        self.idle_since = None    # 最初のリクエストが来るまでは数えない
+
+    def begin(self):
+        """リクエスト開始。(待ち時間, エラーの種類 または None) を返す"""
+        with self.lock:
+            now = time.time()
+            if self.in_flight == 0 and self.idle_since is not None:
+                self.idle += now - self.idle_since
+                self.idle_gaps += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.requests += 1
+            delay = sample_latency(self.latency_dist, self.latency, self.rng)
+            kind = None
+            if self.error_kinds and self.rng.random() < self.error_rate:
+                kind = self.rng.choice(self.error_kinds)
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+            return delay, kind
+
+    def end(self):
+        with self.lock:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.idle_since = time.time()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = {}
+            self.max_in_flight = self.in_flight
+            self.idle = 0.0
+            self.idle_gaps = 0
+            self.idle_since = None
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "errors": dict(self.errors), "max_in_flight": self.max_in_flight,
+                    "idle_seconds": self.idle, "idle_gaps": self.idle_gaps}
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server_version = "fake-ollama/0.2"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._send_json({"models": [{"name": self.server.model}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if not self.path.startswith("/api/generate"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        delay, error_kind = self.server.begin()
+        try:
+            self._generate(req, delay, error_kind)
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # クライアントが ] を読んで切断した
+        finally:
+            self.server.end()
+
+    def _generate(self, req, delay, error_kind):
+        server = self.server
+        prompt = req.get("system", "") + req.get("prompt", "")
+        entries = server.canned if server.canned is not None else fake_entries(req.get("prompt", ""))
+        text = json.dumps(entries, ensure_ascii=False, indent=2)
+        if "format" not in req:
+            text = "```json\n" + text + "\n```"
+        started = time.time()
+        time.sleep(delay)
+        if error_kind == "http500":
+            self._send_json({"error": "fake internal error"}, 500)
+            return
+        if error_kind:
+            text = broken_text(error_kind, text)
+        tokens = [text[i:i + 3] for i in range(0, len(text), 3)]
+        final = {
+            "model": req.get("model", server.model), "done": True,
+            "prompt_eval_count": len(prompt) // 2, "prompt_eval_duration": len(prompt) * 20000,
+            "eval_count": len(tokens), "eval_duration": int(len(tokens) / server.tokens_per_sec * 1e9),
+        }
+        if not req.get("stream", True):
+            time.sleep(len(tokens) / server.tokens_per_sec)
+            final["response"] = text
+            final["total_duration"] = int((time.time() - started) * 1e9)
+            self._send_json(final)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(1 / server.tokens_per_sec)
+            self.wfile.write((json.dumps({"response": token, "done": False}, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        final["response"] = ""
+        final["total_duration"] = int((time.time() - started) * 1e9)
+        self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """別スレッドでサーバーを起動して返す（port=0 なら空いているポート。url は server.url）"""
+    server = FakeOllamaServer((host, port), **options)
+    server.url = f"http://{host}:{server.server_address[1]}/api/generate"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_server_arguments(ap):
+    ap.add_argument("--latency", type=float, default=0.2, help="最初のトークンまでの平均秒数")
+    ap.add_argument("--latency-dist", choices=LATENCY_DISTS, default="normal", help="待ち時間の分布")
+    ap.add_argument("--tokens-per-sec", type=float, default=200.0, help="生成速度")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="壊れた応答を返す割合（0〜1）")
+    ap.add_argument("--error-kinds", default=",".join(ERROR_KINDS),
+                    help=f"返すエラーの種類（カンマ区切り: {', '.join(ERROR_KINDS)}）")
+    ap.add_argument("--canned", help="常にこの JSON ファイルの配列を応答にする")
+    ap.add_argument("--seed", type=int, help="乱数の種")
+
+def server_options(args):
+    canned = None
+    if args.canned:
+        with open(args.canned, "r", encoding="utf-8") as f:
+            canned = json.load(f)
+    kinds = [k for k in args.error_kinds.split(",") if k]
+    unknown = set(kinds) - set(ERROR_KINDS)
+    if unknown:
+        raise SystemExit(f"不明なエラーの種類: {', '.join(sorted(unknown))}")
+    return {"latency": args.latency, "latency_dist": args.latency_dist, "tokens_per_sec": args.tokens_per_sec,
+            "error_rate": args.error_rate, "error_kinds": kinds, "canned": canned, "seed": args.seed}
+
+def main():
+    ap = argparse.ArgumentParser(description="Ollama の /api/generate を真似るテスト用サーバー")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--model", default="fake")
+    ap.add_argument("--verbose", action="store_true", help="アクセスログを表示")
+    add_server_arguments(ap)
+    args = ap.parse_args()
+
+    server = FakeOllamaServer((args.host, args.port), model=args.model, verbose=args.verbose, **server_options(args))
+    print(f"fake Ollama: http://{args.host}:{args.port}/api/generate"
+          f"（latency {args.latency}s {args.latency_dist} / {args.tokens_per_sec} tokens/sec / error {args.error_rate:.0%}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{json.dumps(server.stats(), ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    main()